@@ -0,0 +1,397 @@
+#!/usr/bin/python3
+
+#*******************************************************************************
+#*******************************************************************************
+# 
+#                      COPYRIGHT (c) 2015, James Sinton
+#                             ALL RIGHTS RESERVED
+# 
+#  This library is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+# 
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with this library; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# 
+#   DESCRIPTION
+#      Benchmarks the file heavy phases of the owncloud_upgrade package
+#      on a synthetic owncloud/ and data/ tree, and its start up, and
+#      compares the timings with a stored baseline
+# 
+#   EXAMPLES
+#      python3 benchmarks/benchmark.py
+# 
+#      python3 benchmarks/benchmark.py --files 20000 --save-baseline
+# 
+#      python3 benchmarks/benchmark.py --phase permissions --phase backup
+# 
+#********************************************************************************
+#********************************************************************************
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+import zipfile
+from pwd import getpwuid
+
+here=os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+from owncloud_upgrade import backup, database, permissions, release
+
+words=['<?php', 'function', 'return', '$this->', 'array(', ');', 'public', 'static',
+       'OC::$server', '\\OCP\\Util', 'if (', '} else {', 'foreach (', ' as ', '=>',
+       'null', 'true', 'false', '$config', '$request', '// ', '/**', ' */', '\n']
+
+##################################################################
+#Function Name: fileSizes
+#Parameters:    rnd, count, median, maximum
+#Purpose:       Draw count file sizes from a log-normal distribution
+#               around median, which is roughly how the sizes of the
+#               files of an owncloud release are spread
+#		@buildTree
+##################################################################
+def fileSizes(rnd, count, median, maximum):
+    return [min(maximum, int(rnd.lognormvariate(0, 1.2)*median)) for i in range(count)]
+
+##################################################################
+#Function Name: fileContent
+#Parameters:    rnd, size
+#Purpose:       Return size bytes of source-like text that compresses
+#               about as well as PHP does
+#		@buildTree, buildDump
+##################################################################
+def fileContent(rnd, size):
+    chunk=' '.join(rnd.choice(words) for i in range(512))
+    return (chunk*(size//len(chunk)+1))[:size]
+
+##################################################################
+#Function Name: buildTree
+#Parameters:    root, files, depth, fanout, median, maximum, seed
+#Purpose:       Create files files below root spread over
+#               directories fanout wide and depth deep
+#		@buildFixtures
+##################################################################
+def buildTree(root, files, depth, fanout, median, maximum, seed):
+    rnd=random.Random(seed)
+    dirs=[root]
+    level=[root]
+    for d in range(depth):
+        level=[os.path.join(parent, 'dir%d' % i) for parent in level for i in range(fanout)]
+        dirs.extend(level)
+    for d in dirs:
+        if not os.path.isdir(d):
+            os.makedirs(d, 0o755)
+    total=0
+    for i, size in enumerate(fileSizes(rnd, files, median, maximum)):
+        with open(os.path.join(rnd.choice(dirs), 'file%d.php' % i), 'wb') as f:
+            f.write(fileContent(rnd, size).encode())
+        total += size
+    return {'dirs':len(dirs), 'files':files, 'bytes':total}
+
+##################################################################
+#Function Name: buildFixtures
+#Parameters:    work, args
+#Purpose:       Build the synthetic instance, tar and zip releases
+#               and a database dump in work
+#		@main
+##################################################################
+def buildFixtures(work, args):
+    ocDir=os.path.join(work, 'www', 'owncloud')
+    dataPath=os.path.join(ocDir, 'data')
+    fixtures={'ocDir':ocDir, 'dataPath':dataPath}
+    fixtures['code']=buildTree(ocDir, args.files, args.depth, args.fanout, args.median_size, args.max_size, args.seed)
+    for sub in ('apps', 'config', 'themes'):
+        if not os.path.isdir(os.path.join(ocDir, sub)):
+            os.mkdir(os.path.join(ocDir, sub))
+    with open(os.path.join(ocDir, 'config', 'config.php'), 'w') as f:
+        f.write("<?php\n$CONFIG = array (\n  'datadirectory' => '%s',\n);\n" % dataPath)
+    fixtures['data']=buildTree(dataPath, args.data_files, args.depth, args.fanout, args.median_size*4, args.max_size*4, args.seed+1)
+
+    # the release holds the code only, below a top level owncloud/
+    fixtures['tar']=os.path.join(work, 'owncloud-release.tar.gz')
+    fixtures['zip']=os.path.join(work, 'owncloud-release.zip')
+    # GNU headers like the published releases; python3 defaults to pax,
+    # which adds an extended header to every member
+    tar=tarfile.open(fixtures['tar'], 'w:gz', format=tarfile.GNU_FORMAT)
+    archive=zipfile.ZipFile(fixtures['zip'], 'w', zipfile.ZIP_DEFLATED)
+    for dirPath, dirNames, fileNames in os.walk(ocDir):
+        if dirPath == ocDir:
+            dirNames.remove('data')
+        for name in dirNames + fileNames:
+            fullPath=os.path.join(dirPath, name)
+            arcName=os.path.join('owncloud', os.path.relpath(fullPath, ocDir))
+            tar.add(fullPath, arcName, recursive=False)
+            archive.write(fullPath, arcName)
+    tar.close()
+    archive.close()
+
+    rnd=random.Random(args.seed+2)
+    fixtures['dump']=os.path.join(work, 'dump.sql')
+    with open(fixtures['dump'], 'wb') as f:
+        for i in range(args.dump_size*1024*1024//65536):
+            f.write(("INSERT INTO `oc_filecache` VALUES (%d,'%s');\n" % (i, fileContent(rnd, 65500))).encode())
+    return fixtures
+
+##################################################################
+#Class Name:    ChownCounter
+#Purpose:       Stands in for os.chown and os.fchown when not running
+#               as root, so the permission phases run unprivileged
+#		@main
+##################################################################
+class ChownCounter(object):
+    def __init__(self):
+        self.calls=0
+
+    def __call__(self, *args):
+        self.calls += 1
+
+##################################################################
+#Function Name: quiet
+#Parameters:    none
+#Purpose:       Context manager discarding what the phases print
+#		@phases, main
+##################################################################
+@contextlib.contextmanager
+def quiet():
+    stdout=sys.stdout
+    sys.stdout=open(os.devnull, 'w')
+    try:
+        yield
+    finally:
+        sys.stdout.close()
+        sys.stdout=stdout
+
+##################################################################
+#Function Name: phases
+#Parameters:    work, fixtures, args
+#Purpose:       Return the benchmarked phases in order as (name,
+#               setup, run) tuples.  setup runs untimed before each
+#               repetition; run returns the stats of the phase.
+#		@main
+##################################################################
+def phases(work, fixtures, args):
+    user=getpwuid(os.getuid()).pw_name
+    ocDir, dataPath=fixtures['ocDir'], fixtures['dataPath']
+    rules=permissions.permissionRules(ocDir, user, dataPath)
+    full=os.path.join(work, 'backup-full')
+    linked=os.path.join(work, 'backup-linked')
+    extracted=os.path.join(work, 'extracted')
+    compared=os.path.join(work, 'compared')
+    dumpOut=os.path.join(work, 'dump-out')
+    stateDir=os.path.join(work, 'state')
+    dataRules=permissions.permissionRules(None, user, dataPath)
+    indexFile=permissions.indexFileName(stateDir, dataPath)
+
+    def remove(*paths):
+        def setup():
+            for p in paths:
+                if os.path.isdir(p):
+                    shutil.rmtree(p)
+                elif os.path.exists(p):
+                    os.remove(p)
+        return setup
+
+    def loosen():
+        # put the tree back in the state a fresh install leaves it in
+        for dirPath, dirNames, fileNames in os.walk(ocDir):
+            os.chmod(dirPath, 0o755)
+            for name in fileNames:
+                os.chmod(os.path.join(dirPath, name), 0o644)
+
+    def nothing():
+        pass
+
+    def ensure(path, build):
+        def setup():
+            if not os.path.isdir(path):
+                with quiet():
+                    build()
+        return setup
+
+    installed={}
+
+    def install():
+        # a full install leaves the manifest a delta upgrade starts from
+        remove(extracted)()
+        installed['manifest']=release.newManifest('release', os.path.basename(fixtures['tar']))
+        release.extractRelease(fixtures['tar'], extracted, rules, manifest=installed['manifest'])
+
+    def delta():
+        journal={'added':[], 'saved':[], 'removedDirs':[]}
+        return release.applyDelta(fixtures['tar'], extracted, rules, installed['manifest'], lambda rel: False, extracted+'.undo', journal)
+
+    def dump(method):
+        cmd=['cat', fixtures['dump']]
+        return lambda: database.dumpDatabase(cmd, dumpOut, method, args.jobs)
+
+    def startup():
+        # a fresh interpreter loading the entry point, as a monitoring
+        # probe running --check-only does
+        env=dict(os.environ, PYTHONPATH=os.path.dirname(here))
+        with open(os.devnull, 'w') as devnull:
+            subprocess.check_call([sys.executable, '-m', 'owncloud_upgrade', '--version'], stdout=devnull, env=env)
+
+    return [
+        ('permissions', loosen, lambda: permissions.securePermissions(ocDir, user, dataPath, args.jobs)),
+        ('permissionsUnchanged', nothing, lambda: permissions.securePermissions(ocDir, user, dataPath, args.jobs)),
+        ('dataRepair', remove(stateDir), lambda: permissions.repairDataPermissions(dataPath, dataRules, indexFile, args.jobs)),
+        ('dataRepairIndexed', ensure(stateDir, lambda: permissions.repairDataPermissions(dataPath, dataRules, indexFile, args.jobs)),
+            lambda: permissions.repairDataPermissions(dataPath, dataRules, indexFile, args.jobs)),
+        ('dataRepairTrusted', ensure(stateDir, lambda: permissions.repairDataPermissions(dataPath, dataRules, indexFile, args.jobs)),
+            lambda: permissions.repairDataPermissions(dataPath, dataRules, indexFile, args.jobs, trustDirs=True)),
+        ('backup', remove(full), lambda: backup.backupTree(ocDir, full, None, rules, False, args.jobs)),
+        ('backupLinked', lambda: (ensure(full, lambda: backup.backupTree(ocDir, full, None, rules, False, args.jobs))(), remove(linked)()),
+            lambda: backup.backupTree(ocDir, linked, full, rules, False, args.jobs)),
+        ('extractTar', remove(extracted), lambda: release.extractRelease(fixtures['tar'], extracted, rules)),
+        ('extractZip', remove(extracted), lambda: release.extractRelease(fixtures['zip'], extracted, rules)),
+        ('extractCompare', lambda: (ensure(extracted, lambda: release.extractRelease(fixtures['tar'], extracted, rules))(), remove(compared)()),
+            lambda: release.extractRelease(fixtures['tar'], compared, rules, extracted)),
+        ('deltaUnchanged', lambda: installed or install(), delta),
+        ('compressGzip', remove(dumpOut), dump('gzip')),
+        ('compressZstd', remove(dumpOut), dump('zstd')),
+        ('startup', nothing, startup),
+    ]
+
+##################################################################
+#Function Name: compare
+#Parameters:    results, baseline, tolerance
+#Purpose:       Print each phase against the baseline and return the
+#               phases that got slower by more than tolerance
+#		@main
+##################################################################
+def compare(results, baseline, tolerance):
+    regressions=[]
+    print("%-22s %10s %10s %8s" % ('Phase', 'Seconds', 'Baseline', 'Change'))
+    for name in sorted(results, key=lambda n: results[n]['order']):
+        seconds=results[name]['seconds']
+        base=baseline.get('phases', {}).get(name, {}).get('seconds')
+        if base is None:
+            print("%-22s %10.3f %10s %8s" % (name, seconds, '-', '-'))
+            continue
+        change=(seconds-base)/base if base > 0 else 0.0
+        flag=''
+        if change > tolerance:
+            flag=' slower'
+            regressions.append(name)
+        elif change < -tolerance:
+            flag=' faster'
+        print("%-22s %10.3f %10.3f %+7.0f%%%s" % (name, seconds, base, change*100, flag))
+    return regressions
+
+##################################################################
+#Function Name: parameters
+#Parameters:    args
+#Purpose:       Return the arguments that shape the fixtures, stored
+#               with the baseline
+#		@main
+##################################################################
+def parameters(args):
+    return dict((k, getattr(args, k)) for k in ('files', 'data_files', 'depth', 'fanout', 'median_size', 'max_size', 'dump_size', 'seed', 'jobs'))
+
+##################################################################
+#Function Name: getArgs
+#Parameters:    none
+#Purpose:       Parse command line arguments
+#		@main
+##################################################################
+def getArgs():
+    parser = argparse.ArgumentParser(description='Benchmark the file heavy phases of owncloud_upgrade on a synthetic instance.')
+    parser.add_argument('--files',type=int,default=5000,help='files in the owncloud code tree (default: 5000)')
+    parser.add_argument('--data-files',type=int,default=2000,help='files in the data tree (default: 2000)')
+    parser.add_argument('--depth',type=int,default=3,help='directory depth of both trees (default: 3)')
+    parser.add_argument('--fanout',type=int,default=4,help='subdirectories per directory (default: 4)')
+    parser.add_argument('--median-size',type=int,default=4096,help='median code file size in bytes; data files are 4x (default: 4096)')
+    parser.add_argument('--max-size',type=int,default=1048576,help='largest code file in bytes (default: 1048576)')
+    parser.add_argument('--dump-size',type=int,default=64,help='size of the database dump in MB (default: 64)')
+    parser.add_argument('--seed',type=int,default=1,help='random seed for the synthetic trees (default: 1)')
+    parser.add_argument('-j','--jobs',type=int,default=8,help='worker threads passed to each phase (default: 8)')
+    parser.add_argument('--repeat',type=int,default=3,help='runs per phase; the fastest is kept (default: 3)')
+    parser.add_argument('--phase',action='append',help='only run this phase; may be repeated')
+    parser.add_argument('--work-dir',help='build the fixtures here instead of a temporary directory')
+    parser.add_argument('--baseline',default=os.path.join(here,'baseline.json'),help='baseline to compare with (default: benchmarks/baseline.json)')
+    parser.add_argument('--save-baseline',action='store_true',help='write the results to the baseline file')
+    parser.add_argument('--tolerance',type=float,default=0.25,help='slowdown counted as a regression (default: 0.25)')
+    return parser.parse_args()
+
+##################################################################
+#Function Name: main
+#Parameters:    none
+#Purpose:       Build the fixtures, time every phase and compare the
+#               results with the baseline.  Exits 1 on a regression.
+#		@
+##################################################################
+def main():
+    args=getArgs()
+    work=args.work_dir or tempfile.mkdtemp(prefix='owncloud-bench-')
+    if not os.path.isdir(work):
+        os.makedirs(work)
+    mocked=None
+    if os.getuid() != 0:
+        # ownership can only be changed by root; count the calls instead
+        mocked=ChownCounter()
+        os.chown=os.fchown=mocked
+    try:
+        print("Building fixtures in " + work)
+        start=time.time()
+        fixtures=buildFixtures(work, args)
+        print("\t%d code files, %d data files in %.1f s" % (fixtures['code']['files'], fixtures['data']['files'], time.time()-start))
+
+        results={}
+        for order, (name, setup, run) in enumerate(phases(work, fixtures, args)):
+            if args.phase and name not in args.phase:
+                continue
+            if name == 'compressZstd' and database.findExecutable('zstd') is None:
+                print("%-22s skipped, zstd is not installed" % name)
+                continue
+            times=[]
+            for i in range(max(1, args.repeat)):
+                setup()
+                with quiet():
+                    start=time.time()
+                    run()
+                    times.append(time.time()-start)
+            results[name]={'order':order, 'seconds':min(times), 'runs':times}
+
+        baseline={}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline=json.load(f)
+            if baseline.get('parameters') != parameters(args):
+                print("Warning:  the baseline was recorded with other parameters: %s" % json.dumps(baseline.get('parameters'), sort_keys=True))
+        regressions=compare(results, baseline, args.tolerance)
+        if mocked is not None:
+            print("Not running as root: %d chown calls were counted, not made" % mocked.calls)
+
+        if args.save_baseline:
+            with open(args.baseline, 'w') as f:
+                json.dump({'parameters':parameters(args),
+                           'machine':{'python':platform.python_version(), 'system':platform.platform(), 'cpus':os.cpu_count()},
+                           'phases':dict((n, {'seconds':round(r['seconds'], 4)}) for n, r in results.items())},
+                          f, indent=2, sort_keys=True)
+                f.write('\n')
+            print("Saved baseline to " + args.baseline)
+        elif regressions:
+            print("Slower than the baseline: " + ', '.join(regressions))
+            sys.exit(1)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work, True)
+
+if __name__ == '__main__':
+    main()
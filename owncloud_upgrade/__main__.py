@@ -0,0 +1,30 @@
+#*******************************************************************************
+#*******************************************************************************
+# 
+#                      COPYRIGHT (c) 2015, James Sinton
+#                             ALL RIGHTS RESERVED
+# 
+#  This library is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+# 
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with this library; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# 
+#   DESCRIPTION
+#      Runs the package: python3 -m owncloud_upgrade --code oc.tar.gz
+# 
+#********************************************************************************
+#********************************************************************************
+
+from .cli import main
+
+if __name__ == '__main__':
+    main()
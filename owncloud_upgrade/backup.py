@@ -0,0 +1,650 @@
+#*******************************************************************************
+#*******************************************************************************
+# 
+#                      COPYRIGHT (c) 2015, James Sinton
+#                             ALL RIGHTS RESERVED
+# 
+#  This library is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+# 
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with this library; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# 
+#   DESCRIPTION
+#      Backs up the code and database and applies the backup
+#      retention policy
+# 
+#********************************************************************************
+#********************************************************************************
+
+import contextlib
+import datetime
+import glob
+import hashlib
+import os
+import re
+import shutil
+import stat
+
+from .metrics import phase
+from .commands import CommandError, ioSlot, runCommand, runPhases
+
+##################################################################
+#Function Name: copytree
+#Parameters:    src, dst, symlinks=False, ignore=None 
+#Purpose:       
+#		@backupOC, intstallUpgrade
+##################################################################
+def copytree(src, dst, symlinks=False, ignore=None):
+    for item in os.listdir(src):
+        s = os.path.join(src, item)
+        d = os.path.join(dst, item)
+        if os.path.isdir(s):
+            shutil.copytree(s, d, symlinks, ignore)
+        else:
+            shutil.copy2(s, d)
+
+##################################################################
+#Function Name: findLatestBackup
+#Parameters:    backupRoot
+#Purpose:       Return the newest oc_<version>_<time> code backup in
+#               backupRoot, or None if there is none
+#		@backupOC
+##################################################################
+def findLatestBackup(backupRoot):
+    backups=[]
+    for path in glob.glob(os.path.join(backupRoot,'oc_*')):
+        m=re.match(r'^oc_(.+)_(\d{4}-\d{2}-\d{2}_\d{6})$', os.path.basename(path))
+        if m and os.path.isdir(path) and not os.path.islink(path):
+            backups.append((m.group(2), path))
+    if not backups:
+        return None
+    return max(backups)[1]
+
+##################################################################
+#Function Name: backupUsage
+#Parameters:    backups
+#Purpose:       Walk the code and database files of backups once and
+#               return {inode: [size, nlink, {backup index: links}]},
+#               so the space shared between hard linked backups is
+#               only counted once
+#		@pruneBackups
+##################################################################
+def backupUsage(backups):
+    usage={}
+    for i, backup in enumerate(backups):
+        for root in (backup['code'], backup['db']):
+            if root is None:
+                continue
+            paths=[root] if os.path.isfile(root) else (os.path.join(d, n) for d, ds, fs in os.walk(root) for n in fs)
+            for path in paths:
+                try:
+                    st=os.lstat(path)
+                except OSError:
+                    continue
+                if not stat.S_ISREG(st.st_mode):
+                    continue
+                entry=usage.setdefault((st.st_dev, st.st_ino), [st.st_blocks*512, st.st_nlink, {}])
+                entry[2][i]=entry[2].get(i, 0)+1
+    return usage
+
+##################################################################
+#Function Name: usedBytes
+#Parameters:    usage, selected
+#Purpose:       Return the disk space of the backups in selected, a
+#               set of indexes, counting each inode once
+#		@planRetention
+##################################################################
+def usedBytes(usage, selected):
+    return sum(size for size, nlink, links in usage.values() if any(i in selected for i in links))
+
+##################################################################
+#Function Name: freedBytes
+#Parameters:    usage, selected
+#Purpose:       Return the space deleting the backups in selected
+#               gives back: only files with no links left elsewhere,
+#               e.g. in a newer backup or a rolled back installation
+#		@planRetention, pruneBackups
+##################################################################
+def freedBytes(usage, selected):
+    return sum(size for size, nlink, links in usage.values()
+               if nlink and sum(n for i, n in links.items() if i in selected) == nlink)
+
+##################################################################
+#Function Name: planRetention
+#Parameters:    backups, keepLast, keepDaily, keepWeekly, maxBytes,
+#               usage
+#Purpose:       Return the indexes of the backups (oldest first, from
+#               findBackups) to delete.  The newest backups are kept
+#               by keepLast, the newest of each of the last keepDaily
+#               days and keepWeekly ISO weeks likewise; without any of
+#               these every backup is kept.  maxBytes then drops the
+#               oldest kept backups until the rest fit.  The newest
+#               complete backup is always kept, and so is anything
+#               newer, which may be a backup still being written.
+#               Incomplete backups older than it are deleted.
+#		@pruneBackups
+##################################################################
+def planRetention(backups, keepLast=None, keepDaily=None, keepWeekly=None, maxBytes=None, usage=None):
+    complete=[i for i, b in enumerate(backups) if b['code'] is not None and b['db'] is not None]
+    if not complete:
+        return []
+    newest=complete[-1]
+    keep=set(range(newest, len(backups)))
+    if keepLast is None and keepDaily is None and keepWeekly is None:
+        keep.update(complete)
+    if keepLast:
+        keep.update(complete[-keepLast:])
+    for count, period in ((keepDaily, lambda d: d.date()), (keepWeekly, lambda d: d.isocalendar()[:2])):
+        if not count:
+            continue
+        seen=set()
+        for i in reversed(complete):
+            p=period(datetime.datetime.strptime(backups[i]['time'], '%Y-%m-%d_%H%M%S'))
+            if p not in seen:
+                seen.add(p)
+                keep.add(i)
+                if len(seen) == count:
+                    break
+    if maxBytes is not None and usage is not None:
+        for i in sorted(keep):
+            if i >= newest or usedBytes(usage, keep) <= maxBytes:
+                break
+            keep.discard(i)
+    return [i for i in range(len(backups)) if i not in keep]
+
+##################################################################
+#Function Name: retentionConfigured
+#Parameters:    configDict
+#Purpose:       Tell whether any retention policy is set
+#		@backupOC, pruneBackups
+##################################################################
+def retentionConfigured(configDict):
+    return any(configDict[k] is not None for k in ('keepLast', 'keepDaily', 'keepWeekly', 'maxBackupBytes'))
+
+##################################################################
+#Function Name: pruneBackups
+#Parameters:    configDict, needBytes
+#Purpose:       Delete the backups in backupRoot the retention policy
+#               does not keep.  With needBytes, older backups are also
+#               deleted, oldest first, until that much space is free.
+#               Returns the number of bytes given back.
+#		@backupOC, main
+##################################################################
+def pruneBackups(configDict, needBytes=None):
+    backups=findBackups(configDict['backupRoot'])
+    if not backups:
+        return 0
+    usage=backupUsage(backups)
+    prune=planRetention(backups,configDict['keepLast'],configDict['keepDaily'],configDict['keepWeekly'],configDict['maxBackupBytes'],usage)
+    if needBytes is not None:
+        complete=[i for i, b in enumerate(backups) if b['code'] is not None and b['db'] is not None]
+        for i in complete[:-1]:
+            if freeBytes(configDict['backupRoot'])+freedBytes(usage, set(prune)) >= needBytes:
+                break
+            if i not in prune:
+                prune.append(i)
+    freed=0
+    for i in sorted(prune):
+        backup=backups[i]
+        gain=freedBytes(usage, set([i]))
+        print("\tdeleting backup %s of %s (%.1f MB)" % (backup['version'], backup['time'], gain/1048576.))
+        for path in (backup['code'], backup['db']):
+            if path is None:
+                continue
+            try:
+                if os.path.isdir(path) and not os.path.islink(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+            except OSError as e:
+                print("Error:  %s - %s." % (e.filename,e.strerror))
+        # links into the deleted backup no longer count against the others
+        for entry in usage.values():
+            n=entry[2].pop(i, 0)
+            entry[1] -= n
+        freed += gain
+    print("\t%d of %d backups deleted, %.1f MB freed" % (len(prune), len(backups), freed/1048576.))
+    return freed
+
+##################################################################
+#Function Name: freeBytes
+#Parameters:    path
+#Purpose:       Return the space available to this user on the file
+#               system holding path
+#		@pruneBackups, preflightSpace
+##################################################################
+def freeBytes(path):
+    st=os.statvfs(path)
+    return st.f_bavail*st.f_frsize
+
+##################################################################
+#Function Name: estimateBackupSpace
+#Parameters:    configDict, linkDest
+#Purpose:       Estimate the space backupOC will need: the code files
+#               that cannot be hard linked from linkDest, plus the
+#               previous database dump with some room to grow
+#		@preflightSpace
+##################################################################
+def estimateBackupSpace(configDict, linkDest):
+    ocDir=os.path.normpath(configDict['ocDir'])
+    code=0
+    for dirPath, dirNames, fileNames in os.walk(ocDir):
+        code += 4096
+        for name in fileNames:
+            path=os.path.join(dirPath, name)
+            try:
+                st=os.lstat(path)
+            except OSError:
+                continue
+            if not stat.S_ISREG(st.st_mode):
+                continue
+            if linkDest is not None:
+                try:
+                    old=os.lstat(os.path.join(linkDest, os.path.relpath(path, ocDir)))
+                    if old.st_size == st.st_size and int(old.st_mtime) == int(st.st_mtime):
+                        continue
+                except OSError:
+                    pass
+            code += st.st_blocks*512
+    db=0
+    dumps=[b['db'] for b in findBackups(configDict['backupRoot']) if b['db'] is not None]
+    if dumps:
+        last=dumps[-1]
+        if os.path.isdir(last):
+            db=sum(os.path.getsize(os.path.join(d, n)) for d, ds, fs in os.walk(last) for n in fs)
+        else:
+            db=os.path.getsize(last)
+        db=int(db*1.2)
+    return code, db
+
+##################################################################
+#Function Name: preflightSpace
+#Parameters:    configDict, linkDest
+#Purpose:       Make sure backupRoot has room for the backup before
+#               the site goes into maintenance mode, deleting old
+#               backups if the retention policy allows it
+#		@backupOC
+##################################################################
+def preflightSpace(configDict, linkDest):
+    code, db=estimateBackupSpace(configDict, linkDest)
+    need=int((code+db)*1.1)
+    free=freeBytes(configDict['backupRoot'])
+    print("\tbackup needs about %.1f MB (code %.1f MB, database %.1f MB), %.1f MB free" % (need/1048576., code/1048576., db/1048576., free/1048576.))
+    if free >= need:
+        return True
+    if retentionConfigured(configDict):
+        print("\tdeleting old backups to make room")
+        pruneBackups(configDict, need)
+        free=freeBytes(configDict['backupRoot'])
+        if free >= need:
+            return True
+    print("Error:  not enough space in %s for the backup: %.1f MB needed, %.1f MB free" % (configDict['backupRoot'], need/1048576., free/1048576.))
+    return False
+
+##################################################################
+#Function Name: fileDigest
+#Parameters:    path, algorithm
+#Purpose:       Return the hex digest of a file, md5 by default
+#		@sameFile, scanManifest, applyDelta
+##################################################################
+def fileDigest(path, algorithm='md5', blockSize=1048576):
+    h=hashlib.new(algorithm)
+    with open(path,'rb') as f:
+        while True:
+            buf=f.read(blockSize)
+            if not buf:
+                break
+            h.update(buf)
+    return h.hexdigest()
+
+##################################################################
+#Function Name: sameFile
+#Parameters:    src, srcStat, other, checksum
+#Purpose:       Check whether other is an unchanged copy of src: same
+#               size and mtime and, if checksum is set, same content
+#		@backupTree
+##################################################################
+def sameFile(src, srcStat, other, checksum=False):
+    try:
+        st=os.lstat(other)
+    except OSError:
+        return False
+    if not stat.S_ISREG(st.st_mode):
+        return False
+    if st.st_size != srcStat.st_size or int(st.st_mtime) != int(srcStat.st_mtime):
+        return False
+    if checksum and fileDigest(src) != fileDigest(other):
+        return False
+    return True
+
+##################################################################
+#Function Name: copyFile
+#Parameters:    src, dst, srcStat, policy
+#Purpose:       Copy a file with large buffers, giving it the owner
+#               and mode of policy as it is created and keeping the
+#               times of src
+#		@backupTree
+##################################################################
+def copyFile(src, dst, srcStat, policy=(None,None,None,None), blockSize=1048576):
+    uid, gid, dirMode, fileMode=policy
+    mode=fileMode if fileMode is not None else stat.S_IMODE(srcStat.st_mode)
+    with open(src,'rb') as fsrc:
+        fd=os.open(dst, os.O_WRONLY|os.O_CREAT|os.O_TRUNC, 0o600)
+        with os.fdopen(fd,'wb') as fdst:
+            if uid is not None or gid is not None:
+                os.fchown(fd, -1 if uid is None else uid, -1 if gid is None else gid)
+            os.fchmod(fd, mode)
+            shutil.copyfileobj(fsrc, fdst, blockSize)
+    os.utime(dst, (srcStat.st_atime, srcStat.st_mtime))
+    return srcStat.st_size
+
+##################################################################
+#Function Name: backupTree
+#Parameters:    src, dst, linkDest, rules, checksum, jobs,
+#               linkWritable
+#Purpose:       Copy src to dst like rsync --link-dest: files that are
+#               unchanged in the previous backup linkDest are hard
+#               linked from it, everything else is copied.  Owner and
+#               mode from rules are set while copying.  Without
+#               linkWritable, files rules give to a user other than
+#               root are always copied, so that user writing to them
+#               in dst cannot change linkDest.  dst must not
+#               exist yet: FileExistsError is raised rather than mixing
+#               two backups in one directory.
+#		@backupOC, cloneBackup
+##################################################################
+def backupTree(src, dst, linkDest=None, rules={}, checksum=False, jobs=8, linkWritable=True):
+    from .permissions import fixPermission, overlayRule, parallelWalk, resolvePermission, scanDir
+    rules=dict((os.path.normpath(k), v) for k, v in rules.items())
+    stats={'dirs':0, 'files':0, 'linked':0, 'copied':0, 'bytes':0, 'changed':0, 'skipped':0, 'avoided':0, 'errors':0}
+
+    def visitDir(item, local):
+        srcDir, dstDir, linkDir, parentPolicy=item
+        subdirs=[]
+        for name, s, st in scanDir(srcDir):
+            d=os.path.join(dstDir,name)
+            l=os.path.join(linkDir,name) if linkDir is not None else None
+            policy=overlayRule(parentPolicy, rules.get(d))
+            try:
+                if stat.S_ISDIR(st.st_mode):
+                    os.mkdir(d, 0o700)
+                    fixPermission(d, os.lstat(d), overlayRule((None,None,stat.S_IMODE(st.st_mode),None), policy), local)
+                    subdirs.append((s, d, l if l is not None and os.path.isdir(l) else None, policy))
+                elif stat.S_ISLNK(st.st_mode):
+                    os.symlink(os.readlink(s), d)
+                elif stat.S_ISREG(st.st_mode):
+                    if l is not None and (linkWritable or policy[0] in (None, 0)) and sameFile(s, st, l, checksum):
+                        try:
+                            os.link(l, d)
+                            local['linked'] += 1
+                            local['avoided'] += 1
+                            fixPermission(d, os.lstat(d), policy, local)
+                            continue
+                        except OSError:
+                            # cross-device or too many links: copy instead
+                            pass
+                    local['bytes'] += copyFile(s, d, st, policy)
+                    local['copied'] += 1
+                    local['files'] += 1
+            except OSError as e:
+                print("Error:  %s - %s." % (e.filename,e.strerror))
+                local['errors'] += 1
+        return subdirs
+
+    os.makedirs(dst)
+    policy=resolvePermission(rules, dst)
+    fixPermission(dst, os.lstat(dst), policy, stats)
+    if linkDest is not None and not os.path.isdir(linkDest):
+        linkDest=None
+    return parallelWalk([(src, dst, linkDest, policy)], visitDir, stats, jobs)
+
+##################################################################
+#Function Name: ownBackup
+#Parameters:    configDict, key
+#Purpose:       Run the code that writes the backup path configDict[key]
+#               and record the path in backupCreated unless it was
+#               refused because the path already existed, so that
+#               discardBackup only removes what this run wrote
+#		@backupCode, backupDatabase
+##################################################################
+@contextlib.contextmanager
+def ownBackup(configDict, key):
+    try:
+        yield
+    except FileExistsError as e:
+        if e.filename != configDict[key]:
+            configDict['backupCreated'].append(configDict[key])
+            raise
+        raise IOError("%s already exists; it is left alone" % configDict[key])
+    except BaseException:
+        configDict['backupCreated'].append(configDict[key])
+        raise
+    configDict['backupCreated'].append(configDict[key])
+
+##################################################################
+#Function Name: backupCode
+#Parameters:    configDict, linkDest
+#Purpose:       Copy the owncloud code into backupDir, hard linking
+#               files unchanged since linkDest
+#		@backupOC
+##################################################################
+def backupCode(configDict, linkDest):
+    from .permissions import permissionRules
+    print("\tcopying old code to backup directory")
+    if linkDest is not None:
+        print("\thard linking unchanged files from " + linkDest)
+    rules=permissionRules(configDict['backupDir'],configDict['wwwUser'],None)
+    with ioSlot(configDict,'diskSlot'), phase(configDict,'codeBackup') as m:
+        with ownBackup(configDict,'backupDir'):
+            stats=backupTree(configDict['ocDir'],configDict['backupDir'],linkDest,rules,configDict['checksum'],configDict['jobs'])
+        m.update(bytes=stats['bytes'], files=stats['copied']+stats['linked'], syscallsAvoided=stats['avoided'])
+    print("\t%(copied)d files copied (%(bytes)d bytes), %(linked)d files linked" % stats)
+    if stats['errors']:
+        raise IOError("%(errors)d files could not be backed up" % stats)
+    return stats
+
+##################################################################
+#Function Name: backupDatabase
+#Parameters:    configDict
+#Purpose:       Dump the owncloud database into backupDB
+#		@backupOC
+##################################################################
+def backupDatabase(configDict):
+    from .database import dumpDatabase, dumpTables, mysqlCmd
+    if configDict['dbDump'] == 'tables':
+        print("\tdumping tables in parallel into " + configDict['backupDB'])
+        with ioSlot(configDict,'dbSlot'), phase(configDict,'dbDump') as m:
+            with ownBackup(configDict,'backupDB'):
+                stats=dumpTables(configDict,configDict['backupDB'])
+            m.update(bytes=stats['bytesIn'], bytesOut=stats['bytesOut'], files=stats['tables'])
+        print("\t%d tables dumped" % stats['tables'])
+    else:
+        #cmd = ['sudo','mysqldump','-v', '--result-file='+configDict['backupDB'],'-u','root', '-p', configDict['ocDB']]
+        cmd = mysqlCmd(configDict,'mysqldump') + [configDict['ocDB']]
+        print("\tstreaming dump into " + configDict['backupDB'])
+        with ioSlot(configDict,'dbSlot'), phase(configDict,'dbDump') as m:
+            with ownBackup(configDict,'backupDB'):
+                stats=dumpDatabase(cmd,configDict['backupDB'],configDict['compress'],configDict['compressThreads'])
+            m.update(bytes=stats['bytesIn'], bytesOut=stats['bytesOut'], files=1)
+    mb=stats['bytesIn']/1048576.
+    print("\t%.1f MB dumped in %.1f s (%.1f MB/s), compression ratio %.2f" % (mb, stats['seconds'], mb/max(stats['seconds'],0.001), stats['bytesIn']/float(max(stats['bytesOut'],1))))
+    return stats
+
+##################################################################
+#Function Name: backupOC
+#Parameters:    configDict
+#Purpose:       backup ownCloud
+#		@main
+##################################################################
+def backupOC(configDict):
+    from .database import compressedSuffix
+    from .download import fetchRelease
+    from .php import getOCconfig
+    configDict['backupDir']=configDict['backupRoot'] + '/oc_' + configDict['ocVersionString'] + '_' + configDict['backupTime']
+    configDict['backupDB']=configDict['backupRoot'] + '/owncloud_' + configDict['ocVersionString'] + '_' + configDict['backupTime']
+    if configDict['dbDump'] == 'tables':
+        configDict['backupDB']+='.tables'
+    else:
+        configDict['backupDB']+='.sql' + compressedSuffix(configDict['compress'])
+    configDict['backupCreated']=[]
+    configDict=getOCconfig(configDict)
+    if not os.path.isdir(configDict['backupRoot']):
+        os.makedirs(configDict['backupRoot'], 0o700)
+    for path in (configDict['backupDir'], configDict['backupDB']):
+        if os.path.lexists(path):
+            print("Error:  the backup %s already exists" % path)
+            return None
+
+    # old backups go and the space is checked while the site is still up
+    linkDest=None
+    if not configDict['fullBackup']:
+        linkDest=findLatestBackup(configDict['backupRoot'])
+    if retentionConfigured(configDict):
+        print("\n")
+        print("Pruning old backups . . .")
+        pruneBackups(configDict)
+        if linkDest is not None and not os.path.isdir(linkDest):
+            linkDest=findLatestBackup(configDict['backupRoot'])
+    print("\n")
+    print("Checking free space for the backup . . .")
+    if not preflightSpace(configDict, linkDest):
+        return None
+    if linkDest is not None and not os.path.isdir(linkDest):
+        linkDest=findLatestBackup(configDict['backupRoot'])
+    if configDict['prepare']:
+        return prepareOC(configDict, linkDest)
+
+    # place owncloud server into maintenance mode
+    print("\n")
+    print("Placing owncloud server into maintainance mode...")
+    cmd = ['sudo','-u',configDict['wwwUser'], configDict['php'], configDict['ocDir']+'/occ', 'maintenance:mode', '--on']
+    try:
+        with phase(configDict,'maintenanceOn'):
+            runCommand(configDict,cmd,check=True)
+    except CommandError as e:
+        print("Error:  %s" % e)
+        return None
+    
+    # the code copy, the database dump and the download of the release
+    # use the disk, the database and the network, so they run side by side
+    print("\n")
+    print("Backing up owncloud code and database . . .")
+    tasks=[('codeBackup', lambda: backupCode(configDict,linkDest), ()),
+           ('dbDump', lambda: backupDatabase(configDict), ())]
+    if configDict['code'] is not None or configDict['updateURL'] is not None:
+        tasks.append(('download', lambda: fetchRelease(configDict), ()))
+    with phase(configDict,'backup'):
+        results=runPhases(tasks)
+    if 'download' in results and results['download'][0] == 'ok':
+        configDict['codeFileName']=results['download'][1]
+    failed=[name for name, (status, value) in sorted(results.items()) if status != 'ok']
+    if failed:
+        print("Error:  %s failed; nothing was changed" % ', '.join(failed))
+        discardBackup(configDict)
+        print("Taking owncloud online")
+        cmd = ['sudo','-u',configDict['wwwUser'], configDict['php'], configDict['ocDir']+'/occ', 'maintenance:mode', '--off']
+        with phase(configDict,'maintenanceOff'):
+            runCommand(configDict,cmd)
+        return None
+
+    return configDict
+
+##################################################################
+#Function Name: prepareOC
+#Parameters:    configDict, linkDest
+#Purpose:       Do everything that does not need a consistent
+#               database while the site is still online: take a warm
+#               code backup, and download, verify and stage the new
+#               release.  Returns None if any of it failed.
+#		@backupOC
+##################################################################
+def prepareOC(configDict, linkDest):
+    from .download import fetchRelease
+    from .install import stageRelease
+    print("\n")
+    print("Preparing the upgrade while owncloud stays online . . .")
+
+    def download():
+        configDict['codeFileName']=fetchRelease(configDict)
+
+    def stage():
+        configDict['stagedCode']=stageRelease(configDict,configDict['codeFileName'])
+        if configDict['stagedCode'] is None:
+            raise IOError("the new release could not be staged")
+
+    tasks=[('codeBackup', lambda: backupCode(configDict,linkDest), ()),
+           ('download', download, ()),
+           ('stage', stage, ('download',))]
+    with phase(configDict,'prepare'):
+        results=runPhases(tasks)
+    failed=[name for name, (status, value) in sorted(results.items()) if status == 'failed']
+    if failed:
+        print("Error:  %s failed; owncloud was not touched" % ', '.join(failed))
+        discardPrepared(configDict)
+        discardBackup(configDict)
+        return None
+    return configDict
+
+##################################################################
+#Function Name: discardPrepared
+#Parameters:    configDict
+#Purpose:       Remove the staged release of a prepared upgrade that
+#               will not be installed
+#		@prepareOC, installPrepared, upgrade
+##################################################################
+def discardPrepared(configDict):
+    if configDict['stagedCode'] is not None:
+        shutil.rmtree(os.path.dirname(configDict['stagedCode']),True)
+        configDict['stagedCode']=None
+
+##################################################################
+#Function Name: discardBackup
+#Parameters:    configDict
+#Purpose:       Remove what a failed run wrote of its code backup and
+#               database dump, so the retention policy and rollback
+#               never take it for a backup.  Only the paths this run
+#               created, as recorded in backupCreated, are removed.
+#		@backupOC, prepareOC, installPrepared
+##################################################################
+def discardBackup(configDict):
+    for path in configDict['backupCreated']:
+        if os.path.isdir(path) and not os.path.islink(path):
+            print("\tremoving incomplete backup " + path)
+            shutil.rmtree(path, True)
+        elif os.path.lexists(path):
+            print("\tremoving incomplete backup " + path)
+            os.remove(path)
+
+##################################################################
+#Function Name: findBackups
+#Parameters:    backupRoot
+#Purpose:       Return the backups in backupRoot, oldest first, as
+#               dicts of version, time, code (the oc_<version>_<time>
+#               directory) and db (the owncloud_<version>_<time> dump);
+#               code or db is None when that half is missing
+#		@selectBackup
+##################################################################
+def findBackups(backupRoot):
+    backups={}
+    for path in glob.glob(os.path.join(backupRoot,'oc_*')):
+        m=re.match(r'^oc_(.+)_(\d{4}-\d{2}-\d{2}_\d{6})$', os.path.basename(path))
+        if m and os.path.isdir(path) and not os.path.islink(path):
+            backups.setdefault((m.group(2), m.group(1)), {'db':None})['code']=path
+    for path in glob.glob(os.path.join(backupRoot,'owncloud_*')):
+        m=re.match(r'^owncloud_(.+)_(\d{4}-\d{2}-\d{2}_\d{6})(\.tables|\.sql(\.gz|\.zst)?)$', os.path.basename(path))
+        if m and (os.path.isfile(path) or os.path.isfile(os.path.join(path,'manifest.json'))):
+            backups.setdefault((m.group(2), m.group(1)), {'code':None})['db']=path
+    result=[]
+    for (backupTime, version), backup in sorted(backups.items()):
+        backup.update(version=version, time=backupTime)
+        result.append(backup)
+    return result
@@ -0,0 +1,217 @@
+#*******************************************************************************
+#*******************************************************************************
+# 
+#                      COPYRIGHT (c) 2015, James Sinton
+#                             ALL RIGHTS RESERVED
+# 
+#  This library is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+# 
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with this library; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# 
+#   DESCRIPTION
+#      Command line entry point
+# 
+#********************************************************************************
+#********************************************************************************
+
+import argparse
+import os
+import sys
+
+from .metrics import writeReport
+from .config import applyArgs, getConfig
+
+##################################################################
+#Function Name: getArgs
+#Parameters:    none
+#Purpose:       Define command line arguments and return them to 
+#		main
+#		@main
+##################################################################
+def getArgs():
+    version='0.4.0'
+    # under python3 -m owncloud_upgrade argv[0] is __main__.py
+    prog=__package__ if os.path.basename(sys.argv[0]) == '__main__.py' else None
+    parser = argparse.ArgumentParser(prog=prog, description='This upgrades owncloud.')
+    parser.add_argument('-c','--code',help='tarball of new code')
+    parser.add_argument('-v','--version',action='version', version='%(prog)s %(version)s' % {"prog": parser.prog, "version": version})
+    parser.add_argument('-d','--debug',help='print debug messages',action="store_true")
+    parser.add_argument('--check-only',help='print the installed version and whether an update is available, then exit with 0 when current, 1 when an update is available or 3 when either is unknown, as monitoring probes expect',action="store_true")
+    parser.add_argument('-j','--jobs',type=int,default=8,help='number of worker threads used for file operations (default: 8)')
+    parser.add_argument('--full-backup',help='copy every file instead of hard linking unchanged files from the previous backup',action="store_true")
+    parser.add_argument('--checksum',help='compare file contents as well as size and mtime when deciding to hard link',action="store_true")
+    parser.add_argument('--compress',choices=['gzip','zstd'],default='gzip',help='compression used for the database dump (default: gzip)')
+    parser.add_argument('--compress-threads',type=int,default=os.cpu_count() or 1,help='threads used to compress the database dump (default: number of CPUs)')
+    parser.add_argument('--db-dump',choices=['single','tables'],default='single',help='dump the database as one file or as one file per table in parallel (default: single)')
+    parser.add_argument('--db-jobs',type=int,default=4,help='number of tables dumped or restored at the same time (default: 4)')
+    parser.add_argument('--restore-db',metavar='DUMP',help='restore the database from a dump file or per-table dump directory and exit')
+    parser.add_argument('--rollback',metavar='BACKUP',nargs='?',const='latest',help='restore code and database from the newest backup, or the one whose time, version or file name is BACKUP, and exit')
+    parser.add_argument('--log',metavar='FILE',help='append the output of every command run to FILE')
+    parser.add_argument('--command-timeout',type=int,default=600,metavar='SECONDS',help='stop occ maintenance and service commands that run longer than this (default: 600)')
+    parser.add_argument('--upgrade-timeout',type=int,metavar='SECONDS',help='stop occ upgrade if it runs longer than this (default: no limit)')
+    parser.add_argument('--keep-last',type=int,help='keep this many of the newest backups')
+    parser.add_argument('--keep-daily',type=int,help='keep the newest backup of each of this many days')
+    parser.add_argument('--keep-weekly',type=int,help='keep the newest backup of each of this many weeks')
+    parser.add_argument('--max-backup-size',type=int,metavar='MB',help='delete the oldest backups until the rest use at most this many MB')
+    parser.add_argument('--prune',help='apply the retention policy to the backups and exit',action="store_true")
+    parser.add_argument('--sha256',help='expected SHA256 of the new release (default: the published .sha256 file)')
+    parser.add_argument('--md5',help='expected MD5 of the new release (default: the published .md5 file)')
+    parser.add_argument('--connections',type=int,default=4,help='parallel connections used to download the release (default: 4)')
+    parser.add_argument('--cache-dir',default='/var/cache/owncloud-upgrade',help='release cache directory, may be shared over NFS (default: /var/cache/owncloud-upgrade)')
+    parser.add_argument('--cache-size',type=int,default=2048,help='maximum size of the release cache in MB (default: 2048)')
+    parser.add_argument('--no-cache',help='always download the release and do not cache it',action="store_true")
+    install=parser.add_mutually_exclusive_group()
+    install.add_argument('--staged',help='prepare the new release next to the live code and swap it in atomically instead of stopping the web server',action="store_true")
+    install.add_argument('--delta',help='only write the files that differ from the installed release and delete the ones it dropped',action="store_true")
+    install.add_argument('--prepare',help='back up the code and download and stage the new release while the site is online; maintenance mode only covers the database dump, the swap and occ upgrade',action="store_true")
+    parser.add_argument('--compare-installed',help='hard link files that are identical to the installed code instead of writing them again',action="store_true")
+    parser.add_argument('-y','--yes',help='answer yes to every question',action="store_true")
+    parser.add_argument('--php',default='/usr/bin/php',help='PHP interpreter used to run occ (default: /usr/bin/php)')
+    parser.add_argument('--inventory',help='JSON file listing the instances to upgrade in fleet mode')
+    parser.add_argument('--fleet-jobs',type=int,default=4,help='instances upgraded at the same time in fleet mode (default: 4)')
+    parser.add_argument('--disk-jobs',type=int,default=2,help='code backups and extractions running at the same time in fleet mode (default: 2)')
+    parser.add_argument('--db-dumps',type=int,default=2,help='database dumps running at the same time in fleet mode (default: 2)')
+    parser.add_argument('--report',help='write a report of the time and resources used by each phase to this file')
+    parser.add_argument('--report-format',choices=['json','prometheus'],default='json',help='format of the --report file (default: json)')
+    parser.add_argument('--state-dir',default='/var/lib/owncloud-upgrade',help='directory for indexes and other state kept between runs (default: /var/lib/owncloud-upgrade)')
+    parser.add_argument('--data-repair',choices=['now','background','skip'],default='now',help='set permissions on the data directory during the upgrade, in the background after the site is back up, or not at all (default: now)')
+    parser.add_argument('--repair-data',metavar='DATAPATH',help='repair the permissions of a data directory, visiting only entries changed since the last repair, and exit')
+    parser.add_argument('--trust-data-dirs',help='when repairing data permissions, take the files of a directory whose mtime and ctime are unchanged from the index without checking each; chmod or chown of such a file is then only noticed once the index is a week old',action="store_true")
+    parser.add_argument('--www-user',help='user running the web server (default: www-data)')
+    parser.add_argument('--updater',default='https://apps.owncloud.com/updater.php',help='URL of the ownCloud updater queried for new releases (default: https://apps.owncloud.com/updater.php)')
+    parser.add_argument('--update-ttl',type=int,default=3600,help='seconds an updater answer is cached in the state directory, 0 to not cache (default: 3600)')
+
+    return parser.parse_args()
+
+##################################################################
+#Function Name: upgrade
+#Parameters:    configDict, args
+#Purpose:       Check for, back up and install an upgrade of a single
+#               instance, asking before each step
+#		@main
+##################################################################
+def upgrade(configDict, args):
+    from .backup import backupOC, discardPrepared
+    from .commands import askYesorNo
+    from .install import installUpgrade
+    from .php import getOCVersion
+    configDict=getOCVersion(configDict)
+    if args.code:
+        configDict['code']=args.code
+        configDict=backupOC(configDict)
+        if configDict is None:
+            return
+        question="Do you want to install " +configDict['code']+ "?"
+        if askYesorNo(question,"yes",configDict['assumeYes']) == "yes":
+            installUpgrade(configDict)
+        else:
+            discardPrepared(configDict)
+    else:
+        # check if an update is available
+        # if there is one
+        # ask whether to install it
+        # backup code and database
+        # install upgrade
+        from .updates import checkUpdate
+        configDict=checkUpdate(configDict)
+        if(configDict['updateIsAvailable']):
+            configDict=backupOC(configDict)
+            if configDict is None:
+                return
+            question="Do you want to install " +configDict['updateVersionString']+ "?"
+            if askYesorNo(question,"yes",configDict['assumeYes']) == "yes":
+                installUpgrade(configDict)
+            else:
+                discardPrepared(configDict)
+        else:
+            print("You are on a current stable release.  No update is available.")
+
+##################################################################
+#Function Name: checkOnly
+#Parameters:    configDict
+#Purpose:       Print one line with the installed version and whether
+#               an update is available, for monitoring probes, and
+#               return the exit status: 0 when current, 1 when an
+#               update is available and 3 when either is unknown, as
+#               the Nagios plugin API expects
+#		@main
+##################################################################
+def checkOnly(configDict):
+    from .php import readOCFiles
+    from .updates import updateChecker
+    try:
+        v=readOCFiles(configDict['ocDir'],configDict['php'])
+    except (IOError, ValueError, KeyError) as e:
+        print("UNKNOWN: cannot read the installed version - %s" % e)
+        return 3
+    try:
+        update=updateChecker(configDict).check(v['OC_Version'])
+    except (IOError, ValueError) as e:
+        print("UNKNOWN: ownCloud %s installed, could not check for an update - %s" % (v['OC_VersionString'], e))
+        return 3
+    if update['updateURL'] is None:
+        print("OK: ownCloud %s installed, no update available" % v['OC_VersionString'])
+        return 0
+    print("WARNING: ownCloud %s installed, %s is available" % (v['OC_VersionString'], update['updateVersionString'] or update['updateURL']))
+    return 1
+
+##################################################################
+#Function Name: main
+#Parameters:    no
+#Purpose:       Main sub-routine
+##################################################################
+def main():
+    # Get command line arguments
+    # each subsystem is imported by the branch that needs it, so
+    # --check-only and the other short runs start quickly
+    args=getArgs()
+    if args.check_only:
+        sys.exit(checkOnly(applyArgs(getConfig(),args)))
+    if args.inventory:
+        from .fleet import runFleet
+        runFleet(args)
+        return
+    # read configuration file
+    # if it does not exist set default
+    configDict=applyArgs(getConfig(),args)
+    if args.restore_db:
+        from .database import restoreDB
+        from .php import getOCconfig
+        configDict=getOCconfig(configDict)
+        restoreDB(configDict,args.restore_db)
+        return
+    if args.prune:
+        from .backup import pruneBackups, retentionConfigured
+        if not retentionConfigured(configDict):
+            print("Error:  --prune needs --keep-last, --keep-daily, --keep-weekly or --max-backup-size")
+            sys.exit(1)
+        print("Pruning backups in " + configDict['backupRoot'])
+        pruneBackups(configDict)
+        return
+    if args.repair_data:
+        from .permissions import repairData
+        configDict['dataPath']=os.path.normpath(os.path.abspath(args.repair_data))
+        configDict['dataRepair']='now'
+        print("Repairing permissions on " + configDict['dataPath'])
+        repairData(configDict)
+        return
+    try:
+        if args.rollback:
+            from .rollback import rollback
+            if not rollback(configDict,args.rollback):
+                sys.exit(1)
+        else:
+            upgrade(configDict,args)
+    finally:
+        if args.report:
+            writeReport(args.report,args.report_format,[(configDict['ocDir'],configDict['metrics'])])
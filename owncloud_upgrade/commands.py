@@ -0,0 +1,381 @@
+#*******************************************************************************
+#*******************************************************************************
+# 
+#                      COPYRIGHT (c) 2015, James Sinton
+#                             ALL RIGHTS RESERVED
+# 
+#  This library is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+# 
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with this library; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# 
+#   DESCRIPTION
+#      Runs occ and service commands, runs phases concurrently and
+#      shares the console between them
+# 
+#********************************************************************************
+#********************************************************************************
+
+import codecs
+import collections
+import contextlib
+import datetime
+import os
+import queue
+import re
+import subprocess
+import sys
+import threading
+import time
+
+##################################################################
+#Class Name:    CommandError
+#Purpose:       Raised by runCommand when a command cannot be run,
+#               fails or runs out of time; output holds its last lines
+#               or why it could not be started
+#		@runCommand
+##################################################################
+class CommandError(Exception):
+    def __init__(self, cmd, returncode, output=(), timeout=None):
+        Exception.__init__(self, cmd, returncode)
+        self.cmd=cmd
+        self.returncode=returncode
+        self.output=list(output)
+        self.timeout=timeout
+
+    def __str__(self):
+        if self.timeout is not None:
+            message="'%s' did not finish in %d s" % (' '.join(self.cmd), self.timeout)
+        elif self.returncode is None:
+            message="'%s' could not be run" % ' '.join(self.cmd)
+        else:
+            message="'%s' exited with status %d" % (' '.join(self.cmd), self.returncode)
+        if self.output:
+            message+=": " + self.output[-1].strip()
+        return message
+
+logLock=threading.Lock()
+
+##################################################################
+#Function Name: logLines
+#Parameters:    configDict, stream, lines
+#Purpose:       Append lines of command output to the --log file,
+#               stamped with the time, the instance and the stream
+#		@runCommand
+##################################################################
+def logLines(configDict, stream, lines):
+    if configDict['logFile'] is None:
+        return
+    stamp=datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    name=getattr(threading.current_thread(), 'instanceName', None) or configDict['ocDir']
+    with logLock:
+        with open(configDict['logFile'], 'a') as log:
+            for line in lines:
+                log.write("%s [%s] %s| %s\n" % (stamp, name, stream, line))
+
+##################################################################
+#Function Name: runCommand
+#Parameters:    configDict, cmd, timeout, progress, check
+#Purpose:       Run cmd and pass its stdout and stderr on line by line
+#               to the console and the log while it runs.  Two reader
+#               threads feed a bounded queue, so a chatty command is
+#               slowed down rather than buffered in memory.  progress
+#               sees every line and returns True for the ones it shows
+#               itself.  A command still running after timeout seconds
+#               is stopped.  Returns the exit status, or None after a
+#               timeout or when cmd could not be started; with check a
+#               failure raises CommandError instead of being reported.
+#		@backupOC, installInPlace, installDelta, installPrepared,
+#		 installStaged, rollback, installUpgrade
+##################################################################
+def runCommand(configDict, cmd, timeout=-1, progress=None, check=False):
+    if timeout == -1:
+        timeout=configDict['commandTimeout']
+    logLines(configDict, '$', [' '.join(cmd)])
+    try:
+        proc=subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, close_fds=True)
+    except OSError as e:
+        # e.g. sudo or service is not installed
+        error=CommandError(cmd, None, [e.strerror or str(e)])
+        logLines(configDict, 'stderr', error.output)
+        if check:
+            raise error
+        print("Error:  %s" % error)
+        return None
+    lines=queue.Queue(1024)
+
+    def pump(stream, name):
+        # progress bars redraw with carriage returns, which end a line too
+        pending=''
+        decoder=codecs.getincrementaldecoder('utf-8')('replace')
+        try:
+            while True:
+                data=os.read(stream.fileno(), 65536)
+                if not data:
+                    break
+                parts=re.split('[\r\n]', pending+decoder.decode(data))
+                pending=parts.pop()
+                for part in parts:
+                    if part.strip():
+                        lines.put((name, part))
+            if pending.strip():
+                lines.put((name, pending))
+        finally:
+            # each reader closes its own pipe, even when a child of the
+            # command kept it open after runCommand gave up waiting
+            stream.close()
+            lines.put((name, None))
+
+    for stream, name in ((proc.stdout, 'stdout'), (proc.stderr, 'stderr')):
+        reader=threading.Thread(target=pump, args=(stream, name))
+        reader.daemon=True
+        reader.start()
+
+    tail=collections.deque(maxlen=20)
+    deadline=None if timeout is None else time.time()+timeout
+    stoppedAt=None
+    streams=2
+    while streams:
+        # checked before every line, so a command that never stops
+        # printing is stopped on time as well
+        now=time.time()
+        if stoppedAt is None and deadline is not None and now > deadline:
+            stoppedAt=now
+            proc.terminate()
+        elif stoppedAt is not None and now > stoppedAt+5:
+            # a child that ignores TERM is killed; one of its own
+            # children keeping the pipes open is not waited for
+            if proc.poll() is None:
+                proc.kill()
+            else:
+                break
+        try:
+            name, line=lines.get(timeout=1)
+        except queue.Empty:
+            continue
+        if line is None:
+            streams-=1
+            continue
+        logLines(configDict, name, [line])
+        tail.append(line)
+        if progress is None or not progress(line):
+            print(line)
+    rc=proc.wait()
+
+    error=None
+    if stoppedAt is not None:
+        error=CommandError(cmd, rc, tail, timeout)
+        rc=None
+    elif rc != 0:
+        error=CommandError(cmd, rc, tail)
+    if error is not None:
+        if check:
+            raise error
+        print("Error:  %s" % error)
+    return rc
+
+##################################################################
+#Class Name:    UpgradeProgress
+#Purpose:       Follow the progress bars occ upgrade prints while it
+#               migrates tables and runs repair steps, and show the
+#               rate and the expected time left every few seconds
+#               instead of every redraw
+#		@installUpgrade
+##################################################################
+class UpgradeProgress(object):
+    pattern=re.compile(r'(\d+)\s*/\s*(\d+)\s*\[')
+
+    def __init__(self, interval=5):
+        self.interval=interval
+        self.step=None
+        self.first=None
+        self.shown=0
+
+    def __call__(self, line):
+        m=self.pattern.search(line)
+        if m is None:
+            self.step=line.strip()
+            return False
+        done, total=int(m.group(1)), int(m.group(2))
+        now=time.time()
+        # a new bar starts when the total changes or the count goes back
+        if self.first is None or self.first[1] != total or done < self.first[0]:
+            self.first=(done, total, now)
+            self.shown=0
+        if done < total and now-self.shown < self.interval:
+            return True
+        self.shown=now
+        elapsed=now-self.first[2]
+        rate=(done-self.first[0])/elapsed if elapsed > 0 else 0
+        eta='--:--'
+        if rate > 0:
+            left=int((total-done)/rate)
+            eta='%d:%02d:%02d' % (left//3600, left//60%60, left%60)
+        print("\t%s %d/%d (%d%%), %.1f/s, %s left" % (self.step or 'progress', done, total, 100*done//max(total, 1), rate, eta))
+        return True
+
+##################################################################
+#Function Name: runPhases
+#Parameters:    tasks
+#Purpose:       Run tasks, a list of (name, function, after) tuples,
+#               each in its own thread as soon as the tasks named in
+#               after have succeeded; after may only name tasks listed
+#               before it.  A task whose dependency failed is skipped.
+#               Returns {name: (status, value)} with status 'ok',
+#               'failed' (value is the exception) or 'skipped'.
+#		@backupOC
+##################################################################
+def runPhases(tasks):
+    done={}
+    for name, func, after in tasks:
+        unknown=[dep for dep in after if dep not in done]
+        if unknown:
+            raise ValueError("phase %s runs after unknown phase %s" % (name, ', '.join(unknown)))
+        done[name]=threading.Event()
+    results={}
+    instanceName=getattr(threading.current_thread(), 'instanceName', None)
+
+    def runTask(name, func, after):
+        # lines are prefixed with the instance in fleet mode, else the phase
+        threading.current_thread().instanceName=instanceName or name
+        try:
+            for dep in after:
+                done[dep].wait()
+            failed=[dep for dep in after if results[dep][0] != 'ok']
+            if failed:
+                results[name]=('skipped', None)
+                print("\tskipped, %s did not complete" % ', '.join(failed))
+                return
+            try:
+                results[name]=('ok', func())
+            except Exception as e:
+                results[name]=('failed', e)
+                print("Error:  %s" % e)
+        finally:
+            done[name].set()
+
+    stdout=sys.stdout
+    if not isinstance(stdout, ThreadPrefixWriter):
+        sys.stdout=ThreadPrefixWriter(stdout)
+    try:
+        threads=[threading.Thread(target=runTask, args=task, name=task[0]) for task in tasks]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.stdout=stdout
+    return results
+
+##################################################################
+#Function Name: askYesorNo
+#Parameters:    question, default answer, assumeYes
+#Purpose:       It asks a yes or no question and prompts the user
+#		@main
+##################################################################
+def askYesorNo(question, default="yes", assumeYes=False):
+    """Ask a yes/no question via input() and return their answer.
+    
+    "question" is a string that is presented to the user.
+    "default" is the presumed answer if the user just hits <Enter>.
+        It must be "yes" (the default), "no" or None (meaning
+        an answer is required of the user).
+    "assumeYes" answers "yes" without asking, for unattended runs.
+
+    The "answer" return value is one of "yes" or "no".
+    """
+    valid = {"yes":"yes",   "y":"yes",  "ye":"yes",
+             "no":"no",     "n":"no"}
+    if default == None:
+        prompt = " [y/n] "
+    elif default == "yes":
+        prompt = " [Y/n] "
+    elif default == "no":
+        prompt = " [y/N] "
+    else:
+        raise ValueError("invalid default answer: '%s'" % default)
+    if assumeYes:
+        print(question + " yes")
+        return "yes"
+
+    while 1:
+        #sys.stdout.write(question + prompt)
+        print(question + prompt)
+        choice = input().lower()
+        if default is not None and choice == '':
+            return default
+        elif choice in valid:
+            return valid[choice]
+        else:
+            #sys.stdout.write("Please respond with 'yes' or 'no' "\
+            print("Please respond with 'yes' or 'no' "\
+                             "(or 'y' or 'n').\n")
+
+##################################################################
+#Function Name: ioSlot
+#Parameters:    configDict, name
+#Purpose:       Return the semaphore limiting a kind of I/O in fleet
+#               mode, or a no-op context outside it
+#		@backupOC, installInPlace, stageRelease
+##################################################################
+def ioSlot(configDict, name):
+    if configDict.get(name) is None:
+        return noLimit()
+    return configDict[name]
+
+@contextlib.contextmanager
+def noLimit():
+    yield
+
+##################################################################
+#Class Name:    ThreadPrefixWriter
+#Purpose:       Stand in for sys.stdout while instances or phases run
+#               in parallel; each complete line is written at once and
+#               prefixed with the name of the instance that printed it.
+#               A carriage return ends a line too: progress that is
+#               redrawn in place, such as the download status, comes
+#               out as a full line at most every interval seconds per
+#               thread, instead of not at all until the next newline.
+#		@runFleet, runPhases
+##################################################################
+class ThreadPrefixWriter(object):
+    def __init__(self, stream, interval=5):
+        self.stream=stream
+        self.interval=interval
+        self.lock=threading.Lock()
+        self.local=threading.local()
+
+    def write(self, data):
+        pending=(getattr(self.local, 'pending', '') + data).replace('\r\n', '\n')
+        lines=[]
+        now=time.time()
+        while True:
+            m=re.search('[\r\n]', pending)
+            if m is None:
+                break
+            line, pending=pending[:m.start()], pending[m.end():]
+            if m.group() == '\r':
+                if not line.strip() or now-getattr(self.local, 'redrawn', 0) < self.interval:
+                    continue
+                self.local.redrawn=now
+            lines.append(line)
+        self.local.pending=pending
+        if lines:
+            prefix=getattr(threading.current_thread(), 'instanceName', None)
+            with self.lock:
+                for line in lines:
+                    self.stream.write(('[%s] ' % prefix if prefix else '') + line + '\n')
+                self.stream.flush()
+
+    def flush(self):
+        with self.lock:
+            self.stream.flush()
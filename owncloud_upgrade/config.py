@@ -0,0 +1,153 @@
+#*******************************************************************************
+#*******************************************************************************
+# 
+#                      COPYRIGHT (c) 2015, James Sinton
+#                             ALL RIGHTS RESERVED
+# 
+#  This library is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+# 
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with this library; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# 
+#   DESCRIPTION
+#      Default configuration of an upgrade run and the command line
+#      arguments that change it
+# 
+#********************************************************************************
+#********************************************************************************
+
+import datetime
+import os
+
+from .metrics import RunMetrics
+
+##################################################################
+#Function Name: getConfig
+#Parameters:    none
+#Purpose:       Set default configuration parameters
+#		@main
+##################################################################
+def getConfig():
+    backupTime=datetime.datetime.now().strftime('%Y-%m-%d_%H%M%S')
+    wwwUser='www-data' # Set wwwUser to the user running your web server, e.g., www-data on Ubuntu
+    wwwRoot='/var/www' # Set wwwRoot to the path where your root http files are hosted, i.e. where ownCloud is installed
+    backupRoot='/var/owncloud.bak' # Set backupRoot to the path where backups will be stored
+    ocDir=wwwRoot + '/owncloud'
+    dataPath=wwwRoot + '/data'
+    ocDB='owncloud'
+    dbUser='owncloud'
+    dbPwd='owncloud'
+    
+    configDict = {  "wwwUser":wwwUser,
+                    "backupRoot":backupRoot,
+                    "wwwRoot":wwwRoot,
+                    "ocDir":ocDir,
+                    "dataPath":dataPath,
+                    "backupTime":backupTime,
+                    "ocDB":ocDB,
+                    "dbUser":dbUser,
+                    "dbPwd":dbPwd,
+                    "updateIsAvalable":False,
+                    "ocVersion":None,
+                    "ocVersionString":None,
+                    "backupDir":None,
+                    "backupDB":None,
+                    "code":None,
+                    "updateURL":None,
+                    "updateVersionString":None,
+                    "jobs":8,
+                    "fullBackup":False,
+                    "checksum":False,
+                    "compress":"gzip",
+                    "compressThreads":os.cpu_count() or 1,
+                    "dbDump":"single",
+                    "dbJobs":4,
+                    "codeChecksum":None,
+                    "connections":4,
+                    "cacheDir":"/var/cache/owncloud-upgrade",
+                    "cacheSize":2*1024**3,
+                    "staged":False,
+                    "previousCode":None,
+                    "compareInstalled":False,
+                    "php":"/usr/bin/php",
+                    "assumeYes":False,
+                    "pinned":(),
+                    "diskSlot":None,
+                    "dbSlot":None,
+                    "metrics":RunMetrics(),
+                    "stateDir":"/var/lib/owncloud-upgrade",
+                    "dataRepair":"now",
+                    "trustDataDirs":False,
+                    "updater":"https://apps.owncloud.com/updater.php",
+                    "updateTTL":3600,
+                    "updateChecker":None,
+                    "delta":False,
+                    "releaseManifest":None,
+                    "keepLast":None,
+                    "keepDaily":None,
+                    "keepWeekly":None,
+                    "maxBackupBytes":None,
+                    "codeFileName":None,
+                    "downloadDir":None,
+                    "prepare":False,
+                    "stagedCode":None,
+                    "logFile":None,
+                    "commandTimeout":600,
+                    "upgradeTimeout":None
+                 }
+    
+    return configDict
+
+##################################################################
+#Function Name: applyArgs
+#Parameters:    configDict, args
+#Purpose:       Copy command line arguments into configDict
+#		@main, runFleet
+##################################################################
+def applyArgs(configDict, args):
+    configDict['jobs']=args.jobs
+    configDict['fullBackup']=args.full_backup
+    configDict['checksum']=args.checksum
+    configDict['compress']=args.compress
+    configDict['compressThreads']=args.compress_threads
+    configDict['dbDump']=args.db_dump
+    configDict['dbJobs']=args.db_jobs
+    configDict['connections']=args.connections
+    configDict['cacheDir']=None if args.no_cache else args.cache_dir
+    configDict['cacheSize']=args.cache_size*1024**2
+    configDict['staged']=args.staged
+    configDict['delta']=args.delta
+    configDict['prepare']=args.prepare
+    if args.log:
+        configDict['logFile']=os.path.abspath(args.log)
+    configDict['commandTimeout']=args.command_timeout
+    configDict['upgradeTimeout']=args.upgrade_timeout
+    configDict['keepLast']=args.keep_last
+    configDict['keepDaily']=args.keep_daily
+    configDict['keepWeekly']=args.keep_weekly
+    if args.max_backup_size is not None:
+        configDict['maxBackupBytes']=args.max_backup_size*1024**2
+    configDict['compareInstalled']=args.compare_installed
+    configDict['assumeYes']=args.yes
+    configDict['php']=args.php
+    configDict['stateDir']=args.state_dir
+    configDict['dataRepair']=args.data_repair
+    configDict['trustDataDirs']=args.trust_data_dirs
+    configDict['updater']=args.updater
+    configDict['updateTTL']=args.update_ttl
+    if args.www_user:
+        configDict['wwwUser']=args.www_user
+    if args.sha256:
+        configDict['codeChecksum']='sha256:'+args.sha256
+    elif args.md5:
+        configDict['codeChecksum']='md5:'+args.md5
+    return configDict
@@ -0,0 +1,413 @@
+#*******************************************************************************
+#*******************************************************************************
+# 
+#                      COPYRIGHT (c) 2015, James Sinton
+#                             ALL RIGHTS RESERVED
+# 
+#  This library is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+# 
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with this library; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# 
+#   DESCRIPTION
+#      Streams database dumps into a compressor and restores them
+# 
+#********************************************************************************
+#********************************************************************************
+
+import errno
+import gzip
+import json
+import os
+import struct
+import subprocess
+import tempfile
+import time
+import zlib
+from multiprocessing.pool import ThreadPool
+
+##################################################################
+#Function Name: findExecutable
+#Parameters:    name
+#Purpose:       Return the full path of an executable on PATH or None
+#		@openCompressor
+##################################################################
+def findExecutable(name):
+    for d in os.environ.get('PATH', os.defpath).split(os.pathsep):
+        path=os.path.join(d, name)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return None
+
+##################################################################
+#Class Name:    ParallelGzipWriter
+#Purpose:       Write a single gzip member whose deflate blocks are
+#               compressed independently on a pool of threads, the
+#               way pigz does.  Each block ends on a sync flush so the
+#               compressed blocks can simply be concatenated.
+#		@openCompressor
+##################################################################
+class ParallelGzipWriter(object):
+    def __init__(self, fileObject, threads=4, level=6, blockSize=131072):
+        self.fileObject=fileObject
+        self.level=level
+        self.blockSize=blockSize
+        self.threads=max(1, threads)
+        self.pool=ThreadPool(self.threads)
+        self.pending=[]
+        self.buffer=[]
+        self.buffered=0
+        self.crc=zlib.crc32(b'')
+        self.size=0
+        self.fileObject.write(b'\x1f\x8b\x08\x00' + struct.pack('<I', int(time.time())) + b'\x00\x03')
+
+    def compressBlock(self, block):
+        c=zlib.compressobj(self.level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        return c.compress(block) + c.flush(zlib.Z_SYNC_FLUSH)
+
+    def submit(self, block):
+        self.crc=zlib.crc32(block, self.crc) & 0xffffffff
+        self.size+=len(block)
+        self.pending.append(self.pool.apply_async(self.compressBlock, (block,)))
+        while len(self.pending) > 2*self.threads:
+            self.fileObject.write(self.pending.pop(0).get())
+
+    def write(self, data):
+        self.buffer.append(data)
+        self.buffered+=len(data)
+        if self.buffered >= self.blockSize:
+            data=b''.join(self.buffer)
+            end=len(data) - len(data) % self.blockSize
+            for i in range(0, end, self.blockSize):
+                self.submit(data[i:i+self.blockSize])
+            self.buffer=[data[end:]]
+            self.buffered=len(data) - end
+
+    def close(self):
+        if self.buffered:
+            self.submit(b''.join(self.buffer))
+            self.buffer=[]
+            self.buffered=0
+        for result in self.pending:
+            self.fileObject.write(result.get())
+        self.pending=[]
+        self.pool.close()
+        self.pool.join()
+        # an empty final block terminates the deflate stream
+        self.fileObject.write(zlib.compressobj(self.level, zlib.DEFLATED, -zlib.MAX_WBITS).flush(zlib.Z_FINISH))
+        self.fileObject.write(struct.pack('<II', self.crc, self.size & 0xffffffff))
+        self.fileObject.close()
+
+##################################################################
+#Class Name:    ProcessCompressor
+#Purpose:       Compress by piping into an external multi-threaded
+#               compressor such as pigz or zstd
+#		@openCompressor
+##################################################################
+class ProcessCompressor(object):
+    def __init__(self, cmd, fileName):
+        self.cmd=cmd
+        self.fileObject=open(fileName,'xb')
+        self.proc=subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=self.fileObject)
+
+    def write(self, data):
+        self.proc.stdin.write(data)
+
+    def close(self):
+        self.proc.stdin.close()
+        rc=self.proc.wait()
+        self.fileObject.close()
+        if rc != 0:
+            raise subprocess.CalledProcessError(rc, self.cmd)
+
+##################################################################
+#Function Name: openCompressor
+#Parameters:    fileName, method, threads
+#Purpose:       Return a writer that compresses into fileName with
+#               gzip (pigz if installed) or zstd, using threads threads.
+#               Raises FileExistsError if fileName already exists.
+#		@dumpDatabase
+##################################################################
+def openCompressor(fileName, method='gzip', threads=4):
+    threads=max(1, threads)
+    if method == 'gzip':
+        pigz=findExecutable('pigz')
+        if pigz is not None:
+            return ProcessCompressor([pigz, '-6', '-p', str(threads), '-c'], fileName)
+        return ParallelGzipWriter(open(fileName,'xb'), threads)
+    elif method == 'zstd':
+        zstd=findExecutable('zstd')
+        if zstd is not None:
+            return ProcessCompressor([zstd, '-3', '-q', '-T'+str(threads), '-c'], fileName)
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError("zstd compression needs the zstd program or the zstandard module")
+        return zstandard.ZstdCompressor(level=3, threads=threads).stream_writer(open(fileName,'xb'))
+    raise ValueError("unknown compression method: '%s'" % method)
+
+##################################################################
+#Function Name: compressedSuffix
+#Parameters:    method
+#Purpose:       Return the file name suffix for a compression method
+#		@backupOC
+##################################################################
+def compressedSuffix(method='gzip'):
+    return {'gzip':'.gz', 'zstd':'.zst'}[method]
+
+##################################################################
+#Function Name: dumpDatabase
+#Parameters:    cmd, fileName, method, threads
+#Purpose:       Stream the output of the dump command cmd straight
+#               into a compressor, without an intermediate file.  The
+#               dump is written under a temporary name and only
+#               renamed to fileName once the dump command and the
+#               compressor have both succeeded, so a failed dump never
+#               looks like a backup.  An existing fileName or temporary
+#               file is refused and left alone rather than replaced.
+#               Returns bytes in, bytes out and seconds taken.
+#		@backupOC
+##################################################################
+def dumpDatabase(cmd, fileName, method='gzip', threads=4, blockSize=1048576):
+    start=time.time()
+    tmpName=os.path.join(os.path.dirname(fileName), '.tmp-'+os.path.basename(fileName))
+    try:
+        if os.path.lexists(fileName):
+            raise FileExistsError()
+        writer=openCompressor(tmpName, method, threads)
+    except FileExistsError:
+        # a finished dump, or another one being written
+        raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), fileName)
+    errFile=tempfile.TemporaryFile()
+    proc=None
+    bytesIn=0
+    try:
+        try:
+            proc=subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=errFile)
+            while True:
+                buf=proc.stdout.read(blockSize)
+                if not buf:
+                    break
+                bytesIn+=len(buf)
+                writer.write(buf)
+        finally:
+            writer.close()
+        rc=proc.wait()
+        if rc != 0:
+            errFile.seek(0)
+            print(errFile.read().decode('utf-8','replace'))
+            raise subprocess.CalledProcessError(rc, cmd[0])
+        # link fails where rename would replace a dump written meanwhile
+        try:
+            os.link(tmpName, fileName)
+        except FileExistsError:
+            raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), fileName)
+        os.remove(tmpName)
+    except Exception:
+        if proc is not None and proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        if os.path.exists(tmpName):
+            os.remove(tmpName)
+        raise
+    finally:
+        if proc is not None:
+            proc.stdout.close()
+        errFile.close()
+    return {'bytesIn':bytesIn, 'bytesOut':os.path.getsize(fileName), 'seconds':time.time()-start}
+
+##################################################################
+#Class Name:    ProcessDecompressor
+#Purpose:       Read a compressed file through an external
+#               decompressor such as pigz or zstd
+#		@openDecompressor
+##################################################################
+class ProcessDecompressor(object):
+    def __init__(self, cmd):
+        self.cmd=cmd
+        self.proc=subprocess.Popen(cmd, stdout=subprocess.PIPE)
+
+    def read(self, size=-1):
+        return self.proc.stdout.read(size)
+
+    def close(self):
+        self.proc.stdout.close()
+        rc=self.proc.wait()
+        if rc != 0:
+            raise subprocess.CalledProcessError(rc, self.cmd)
+
+##################################################################
+#Function Name: openDecompressor
+#Parameters:    fileName, threads
+#Purpose:       Return a reader for a .gz or .zst file, using pigz or
+#               zstd when they are installed
+#		@loadDatabase
+##################################################################
+def openDecompressor(fileName, threads=4):
+    if fileName.endswith('.gz'):
+        pigz=findExecutable('pigz')
+        if pigz is not None:
+            return ProcessDecompressor([pigz, '-dc', '-p', str(max(1, threads)), fileName])
+        return gzip.open(fileName, 'rb')
+    elif fileName.endswith('.zst'):
+        zstd=findExecutable('zstd')
+        if zstd is not None:
+            return ProcessDecompressor([zstd, '-dcq', fileName])
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError("zstd decompression needs the zstd program or the zstandard module")
+        return zstandard.ZstdDecompressor().stream_reader(open(fileName,'rb'))
+    return open(fileName, 'rb')
+
+##################################################################
+#Function Name: loadDatabase
+#Parameters:    cmd, fileName, threads
+#Purpose:       Stream a compressed dump into the stdin of the
+#               database client cmd without a temporary file.
+#               Returns bytes loaded and seconds taken.
+#		@restoreDB, restoreTables
+##################################################################
+def loadDatabase(cmd, fileName, threads=4, blockSize=1048576):
+    start=time.time()
+    reader=openDecompressor(fileName, threads)
+    proc=subprocess.Popen(cmd, stdin=subprocess.PIPE)
+    bytesIn=0
+    try:
+        while True:
+            buf=reader.read(blockSize)
+            if not buf:
+                break
+            bytesIn+=len(buf)
+            proc.stdin.write(buf)
+    finally:
+        proc.stdin.close()
+        rc=proc.wait()
+        reader.close()
+    if rc != 0:
+        raise subprocess.CalledProcessError(rc, cmd[0])
+    return {'bytesIn':bytesIn, 'seconds':time.time()-start}
+
+##################################################################
+#Function Name: mysqlCmd
+#Parameters:    configDict, program
+#Purpose:       Return the command line for a MySQL client program
+#               logged in to the ownCloud database
+#		@listTables, dumpTables, restoreDB
+##################################################################
+def mysqlCmd(configDict, program='mysql'):
+    return ['sudo', program, '-u', configDict['dbUser'], '--password='+configDict['dbPwd']]
+
+##################################################################
+#Function Name: listTables
+#Parameters:    configDict
+#Purpose:       Return the tables of the ownCloud database, largest
+#               first so the big ones start dumping early
+#		@dumpTables
+##################################################################
+def listTables(configDict):
+    query=("SELECT table_name FROM information_schema.tables "
+           "WHERE table_schema=DATABASE() AND table_type='BASE TABLE' "
+           "ORDER BY data_length+index_length DESC")
+    cmd=mysqlCmd(configDict) + ['-N', '-B', '-e', query, configDict['ocDB']]
+    return [t for t in subprocess.check_output(cmd, universal_newlines=True).splitlines() if t]
+
+##################################################################
+#Function Name: dumpTables
+#Parameters:    configDict, dumpDir
+#Purpose:       Dump every table concurrently into its own compressed
+#               file in dumpDir and write manifest.json describing
+#               them.  Each mysqldump reads from its own
+#               --single-transaction snapshot; ownCloud is in
+#               maintenance mode, so no writes happen in between.
+#		@backupOC
+##################################################################
+def dumpTables(configDict, dumpDir):
+    start=time.time()
+    os.makedirs(dumpDir)
+    tables=listTables(configDict)
+    dbJobs=max(1, min(configDict['dbJobs'], len(tables)))
+    threads=max(1, configDict['compressThreads'] // dbJobs)
+    suffix='.sql' + compressedSuffix(configDict['compress'])
+
+    def dumpOne(table):
+        cmd=mysqlCmd(configDict,'mysqldump') + ['--single-transaction','--quick',configDict['ocDB'],table]
+        stats=dumpDatabase(cmd, os.path.join(dumpDir, table+suffix), configDict['compress'], threads)
+        stats['name']=table
+        stats['file']=table+suffix
+        return stats
+
+    pool=ThreadPool(dbJobs)
+    try:
+        results=pool.map(dumpOne, tables)
+    finally:
+        pool.close()
+        pool.join()
+    manifest={'database':configDict['ocDB'],
+              'version':configDict['ocVersionString'],
+              'time':configDict['backupTime'],
+              'compress':configDict['compress'],
+              'tables':results}
+    with open(os.path.join(dumpDir,'manifest.json'),'w') as f:
+        json.dump(manifest, f, indent=2)
+    return {'bytesIn':sum(r['bytesIn'] for r in results),
+            'bytesOut':sum(r['bytesOut'] for r in results),
+            'seconds':time.time()-start,
+            'tables':len(results)}
+
+##################################################################
+#Function Name: restoreTables
+#Parameters:    configDict, manifestFile
+#Purpose:       Load the per-table dumps listed in a manifest.json
+#               written by dumpTables concurrently
+#		@restoreDB
+##################################################################
+def restoreTables(configDict, manifestFile):
+    start=time.time()
+    with open(manifestFile) as f:
+        manifest=json.load(f)
+    dumpDir=os.path.dirname(manifestFile)
+    tables=manifest['tables']
+    dbJobs=max(1, min(configDict['dbJobs'], len(tables)))
+
+    def restoreOne(table):
+        print("\trestoring " + table['name'])
+        return loadDatabase(mysqlCmd(configDict) + [manifest['database']], os.path.join(dumpDir, table['file']))
+
+    pool=ThreadPool(dbJobs)
+    try:
+        results=pool.map(restoreOne, tables)
+    finally:
+        pool.close()
+        pool.join()
+    return {'bytesIn':sum(r['bytesIn'] for r in results), 'seconds':time.time()-start, 'tables':len(results)}
+
+##################################################################
+#Function Name: restoreDB
+#Parameters:    configDict, path
+#Purpose:       Restore the ownCloud database from a compressed dump
+#               file or from a per-table dump directory
+#		@main
+##################################################################
+def restoreDB(configDict, path):
+    print("\n")
+    print("Restoring owncloud database from " + path + " . . .")
+    if os.path.isdir(path):
+        path=os.path.join(path,'manifest.json')
+    if os.path.basename(path) == 'manifest.json':
+        stats=restoreTables(configDict, path)
+        print("\t%d tables restored" % stats['tables'])
+    else:
+        stats=loadDatabase(mysqlCmd(configDict) + [configDict['ocDB']], path, configDict['compressThreads'])
+    mb=stats['bytesIn']/1048576.
+    print("\t%.1f MB restored in %.1f s (%.1f MB/s)" % (mb, stats['seconds'], mb/max(stats['seconds'],0.001)))
+    return stats
@@ -0,0 +1,468 @@
+#*******************************************************************************
+#*******************************************************************************
+# 
+#                      COPYRIGHT (c) 2015, James Sinton
+#                             ALL RIGHTS RESERVED
+# 
+#  This library is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+# 
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with this library; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# 
+#   DESCRIPTION
+#      Downloads, verifies and caches releases
+# 
+#********************************************************************************
+#********************************************************************************
+
+import contextlib
+import fcntl
+import glob
+import hashlib
+import http.client
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.request, urllib.error
+
+from .metrics import phase
+
+##################################################################
+#Function Name: fetchRelease
+#Parameters:    configDict
+#Purpose:       Return the file name of the verified new release,
+#               from --code, the cache or a fresh download into
+#               downloadDir (wwwRoot unless set).  Raises IOError or
+#               ValueError when it cannot be had.
+#		@backupOC, installUpgrade
+##################################################################
+def fetchRelease(configDict):
+    if configDict['code'] is None and configDict['updateURL'] is not None:
+        codeFileName=None
+        if configDict['cacheDir'] is not None:
+            codeFileName=cacheLookup(configDict['cacheDir'],configDict['updateURL'],configDict['codeChecksum'])
+        if codeFileName is not None:
+            print("Using cached release " + codeFileName)
+        else:
+            # download new release
+            print("\tdownloading " + configDict['updateURL'])
+            downloadDir=configDict['downloadDir'] or configDict['wwwRoot']
+            if not os.path.isdir(downloadDir):
+                os.makedirs(downloadDir, 0o700)
+            codeFileName=downloadDir+'/'+configDict['updateURL'].split('/')[-1]
+            with phase(configDict,'download') as m:
+                m.update(bytes=downloadFile(configDict['updateURL'],codeFileName,configDict['codeChecksum'],configDict['connections']), files=1)
+            if configDict['cacheDir'] is not None:
+                cachedFileName=cacheStore(configDict['cacheDir'],configDict['updateURL'],codeFileName,configDict['cacheSize'])
+                os.remove(codeFileName)
+                codeFileName=cachedFileName
+    elif configDict['code'] is not None:
+        codeFileName=configDict['code']
+        if configDict['codeChecksum'] is not None:
+            print("\tverifying " + codeFileName)
+            verifyFile(codeFileName,configDict['codeChecksum'])
+    else:
+        raise ValueError("no release to install")
+    return codeFileName
+
+##################################################################
+#Function Name: parseChecksum
+#Parameters:    checksum
+#Purpose:       Split 'sha256:HEX', 'md5:HEX' or a bare hex digest
+#               into (algorithm, digest)
+#		@getChecksum, verifyFile
+##################################################################
+def parseChecksum(checksum):
+    checksum=checksum.strip()
+    if ':' in checksum:
+        algo, digest=checksum.split(':',1)
+    else:
+        algo, digest={64:'sha256', 32:'md5'}.get(len(checksum)), checksum
+    if algo not in ('sha256','md5') or not re.match(r'^[0-9a-fA-F]+$', digest):
+        raise ValueError("invalid checksum: '%s'" % checksum)
+    return algo, digest.lower()
+
+##################################################################
+#Function Name: getChecksum
+#Parameters:    url, checksum
+#Purpose:       Return (algorithm, digest) to verify a download with:
+#               the checksum given by the user, or else the .sha256
+#               or .md5 file published next to url, or None
+#		@downloadFile
+##################################################################
+def getChecksum(url, checksum=None):
+    if checksum is not None:
+        return parseChecksum(checksum)
+    for algo in ('sha256','md5'):
+        try:
+            data=urllib.request.urlopen(url+'.'+algo, timeout=30).read(4096)
+            return parseChecksum(algo+':'+data.split()[0].decode('ascii'))
+        except (OSError, ValueError, IndexError, UnicodeDecodeError):
+            continue
+    return None
+
+##################################################################
+#Function Name: verifyFile
+#Parameters:    fileName, checksum
+#Purpose:       Raise IOError if fileName does not match checksum
+#		@installUpgrade
+##################################################################
+def verifyFile(fileName, checksum):
+    algo, digest=parseChecksum(checksum)
+    h=hashlib.new(algo)
+    with open(fileName,'rb') as f:
+        while True:
+            buf=f.read(1048576)
+            if not buf:
+                break
+            h.update(buf)
+    if h.hexdigest() != digest:
+        raise IOError("%s checksum mismatch for %s: expected %s, got %s" % (algo, fileName, digest, h.hexdigest()))
+    print("\t%s checksum verified" % algo)
+
+##################################################################
+#Function Name: probeDownload
+#Parameters:    url
+#Purpose:       Return (size, acceptsRanges) for url; size is None
+#               when the server does not send a length
+#		@downloadFile
+##################################################################
+def probeDownload(url):
+    request=urllib.request.Request(url, headers={'Range':'bytes=0-0'})
+    response=urllib.request.urlopen(request, timeout=60)
+    try:
+        contentRange=response.headers.get('Content-Range')
+        if response.getcode() == 206 and contentRange and '/' in contentRange:
+            total=contentRange.split('/')[-1].strip()
+            if total.isdigit():
+                return int(total), True
+        length=response.headers.get('Content-Length')
+        return (int(length) if length and length.isdigit() else None), False
+    finally:
+        response.close()
+
+##################################################################
+#Function Name: downloadFile
+#Parameters:    url, dlFileName, checksum, connections
+#Purpose:       Download url to dlFileName.  When the server accepts
+#               Range requests the file is fetched over several
+#               connections in parallel and an interrupted download
+#               resumes from dlFileName.part.  The data is hashed as
+#               it arrives and checked against the given or published
+#               SHA256/MD5 before dlFileName is created.
+#		@installUpgrade
+##################################################################
+def downloadFile(url,dlFileName,checksum=None,connections=4,blockSize=1048576,retries=3):
+    partName=dlFileName+'.part'
+    stateName=partName+'.json'
+    expected=getChecksum(url, checksum)
+    fileSize, acceptsRanges=probeDownload(url)
+    print("Downloading: %s Bytes: %s" % (dlFileName.split('/')[-1], fileSize if fileSize is not None else 'unknown'))
+    if expected is None:
+        print("\tWARNING: no checksum was given or published; the download cannot be verified")
+
+    # segments are [start, end, done]; end is None when the size is unknown
+    segments=None
+    if acceptsRanges and os.path.isfile(partName) and os.path.isfile(stateName):
+        try:
+            with open(stateName) as f:
+                state=json.load(f)
+            if state['url'] == url and state['size'] == fileSize:
+                segments=state['segments']
+                print("\tresuming from %d bytes" % sum(seg[2] for seg in segments))
+        except (ValueError, KeyError, IOError):
+            segments=None
+    if segments is None:
+        if acceptsRanges and fileSize:
+            count=max(1, min(connections, fileSize // blockSize))
+            step=fileSize // count
+            segments=[[i*step, (i+1)*step if i < count-1 else fileSize, 0] for i in range(count)]
+        else:
+            segments=[[0, fileSize, 0]]
+        with open(partName,'wb') as f:
+            if fileSize:
+                f.truncate(fileSize)
+
+    lock=threading.Lock()
+    errors=[]
+
+    def fetch(seg):
+        for attempt in range(retries):
+            try:
+                request=urllib.request.Request(url)
+                if acceptsRanges:
+                    end='' if seg[1] is None else str(seg[1]-1)
+                    request.add_header('Range','bytes=%d-%s' % (seg[0]+seg[2], end))
+                else:
+                    # without ranges every attempt starts from the first byte
+                    with lock:
+                        seg[2]=0
+                response=urllib.request.urlopen(request, timeout=60)
+                try:
+                    if acceptsRanges and response.getcode() != 206:
+                        raise IOError("the server ignored the range request")
+                    with open(partName,'r+b') as f:
+                        f.seek(seg[0]+seg[2])
+                        while seg[1] is None or seg[0]+seg[2] < seg[1]:
+                            want=blockSize if seg[1] is None else min(blockSize, seg[1]-seg[0]-seg[2])
+                            buf=response.read(want)
+                            if not buf:
+                                break
+                            f.write(buf)
+                            # the hashing thread reads what seg counts from disk
+                            f.flush()
+                            with lock:
+                                seg[2]+=len(buf)
+                        if seg[1] is None:
+                            # drop what a longer earlier attempt left behind
+                            f.truncate()
+                finally:
+                    response.close()
+                if seg[1] is not None and seg[0]+seg[2] < seg[1]:
+                    raise IOError("connection closed early")
+                return
+            except (urllib.error.URLError, IOError, http.client.HTTPException) as e:
+                if attempt == retries-1:
+                    errors.append(e)
+                else:
+                    time.sleep(2**attempt)
+            except Exception as e:
+                # anything else would end the thread without a word
+                errors.append(e)
+                return
+
+    def saveState():
+        with lock:
+            state={'url':url, 'size':fileSize, 'segments':[list(seg) for seg in segments]}
+        with open(stateName,'w') as f:
+            json.dump(state, f)
+
+    h=hashlib.new(expected[0]) if expected is not None else None
+    hashed=[0]
+
+    def hashPrefix(hashFile):
+        # hash whatever has arrived contiguously from the start of the file
+        with lock:
+            prefix=0
+            for seg in segments:
+                prefix=seg[0]+seg[2]
+                if seg[1] is None or seg[0]+seg[2] < seg[1]:
+                    break
+        hashFile.seek(hashed[0])
+        while hashed[0] < prefix:
+            buf=hashFile.read(min(blockSize, prefix-hashed[0]))
+            if not buf:
+                break
+            h.update(buf)
+            hashed[0]+=len(buf)
+
+    threads=[threading.Thread(target=fetch, args=(seg,)) for seg in segments if seg[1] is None or seg[0]+seg[2] < seg[1]]
+    for t in threads:
+        t.daemon=True
+        t.start()
+    lastState=0
+    # unbuffered: a buffered reader would keep serving the zeros it
+    # read ahead of the data still being written
+    with open(partName,'rb',0) as hashFile:
+        while any(t.is_alive() for t in threads):
+            time.sleep(0.25)
+            if h is not None:
+                hashPrefix(hashFile)
+            if acceptsRanges and time.time()-lastState > 2:
+                saveState()
+                lastState=time.time()
+            fileSizeDL=sum(seg[2] for seg in segments)
+            if fileSize:
+                status = r"%10d  [%3.2f%%]" % (fileSizeDL, fileSizeDL * 100. / fileSize)
+            else:
+                status = r"%10d" % fileSizeDL
+            sys.stdout.write(status + '\r')
+            sys.stdout.flush()
+        if errors:
+            if acceptsRanges:
+                saveState()
+            raise IOError("download of %s failed: %s" % (url, errors[0]))
+        if h is not None:
+            hashPrefix(hashFile)
+    received=sum(seg[2] for seg in segments)
+    if any(seg[1] is not None and seg[0]+seg[2] != seg[1] for seg in segments) or fileSize is not None and received != fileSize:
+        if acceptsRanges:
+            saveState()
+        raise IOError("download of %s is incomplete: %d of %s bytes" % (url, received, fileSize if fileSize is not None else 'unknown'))
+    print("%10d  [100.00%%]" % received)
+
+    if h is not None:
+        if h.hexdigest() != expected[1]:
+            os.remove(partName)
+            if os.path.exists(stateName):
+                os.remove(stateName)
+            raise IOError("%s checksum mismatch for %s: expected %s, got %s" % (expected[0], url, expected[1], h.hexdigest()))
+        print("\t%s checksum verified" % expected[0])
+    os.rename(partName, dlFileName)
+    if os.path.exists(stateName):
+        os.remove(stateName)
+    return os.path.getsize(dlFileName)
+
+##################################################################
+#Function Name: cacheLock
+#Parameters:    cacheDir, exclusive
+#Purpose:       Hold a POSIX record lock on the release cache.  lockf
+#               locks are honoured across hosts on NFS, unlike flock.
+#		@cacheLookup, cacheStore
+##################################################################
+@contextlib.contextmanager
+def cacheLock(cacheDir, exclusive=False):
+    lockFile=open(os.path.join(cacheDir,'lock'),'a+')
+    try:
+        fcntl.lockf(lockFile, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        yield
+    finally:
+        fcntl.lockf(lockFile, fcntl.LOCK_UN)
+        lockFile.close()
+
+##################################################################
+#Function Name: initCache
+#Parameters:    cacheDir
+#Purpose:       Create the release cache layout:
+#               objects/<sha256>       archives by content hash
+#               urls/<sha256 of url>   json pointing a url at an object
+#		@cacheLookup, cacheStore
+##################################################################
+def initCache(cacheDir):
+    for d in (cacheDir, os.path.join(cacheDir,'objects'), os.path.join(cacheDir,'urls')):
+        if not os.path.isdir(d):
+            try:
+                os.makedirs(d)
+            except OSError:
+                # another host may have created it first
+                if not os.path.isdir(d):
+                    raise
+
+##################################################################
+#Function Name: atomicWrite
+#Parameters:    fileName, data
+#Purpose:       Write a file so that readers see either the old or
+#               the new content, never a partial one
+#		@cacheStore
+##################################################################
+def atomicWrite(fileName, data):
+    fd, tmpName=tempfile.mkstemp(dir=os.path.dirname(fileName), prefix='.tmp-')
+    with os.fdopen(fd,'wb') as f:
+        f.write(data)
+    os.rename(tmpName, fileName)
+
+##################################################################
+#Function Name: cacheLookup
+#Parameters:    cacheDir, url, checksum
+#Purpose:       Return the cached archive for url (or for the sha256
+#               in checksum) without touching the network, or None
+#		@installUpgrade
+##################################################################
+def cacheLookup(cacheDir, url, checksum=None):
+    initCache(cacheDir)
+    algo, digest=parseChecksum(checksum) if checksum is not None else (None, None)
+    urlEntry=os.path.join(cacheDir,'urls',hashlib.sha256(url.encode('utf-8')).hexdigest())
+    with cacheLock(cacheDir):
+        entry=None
+        if os.path.isfile(urlEntry):
+            with open(urlEntry) as f:
+                entry=json.load(f)
+        elif algo == 'sha256':
+            entry={'sha256':digest}
+        if entry is None:
+            return None
+        if algo is not None and entry.get(algo, digest) != digest:
+            return None
+        objectName=os.path.join(cacheDir,'objects',entry['sha256'])
+        if not os.path.isfile(objectName) or os.path.getsize(objectName) != entry.get('size', os.path.getsize(objectName)):
+            return None
+        # mark as recently used
+        os.utime(objectName, None)
+        return objectName
+
+##################################################################
+#Function Name: cacheStore
+#Parameters:    cacheDir, url, fileName, maxBytes
+#Purpose:       Add a verified archive to the cache, hard linking it
+#               when possible, and evict the least recently used
+#               archives until the cache fits in maxBytes.  Returns
+#               the path of the cached archive.
+#		@installUpgrade
+##################################################################
+def cacheStore(cacheDir, url, fileName, maxBytes, minAge=3600):
+    initCache(cacheDir)
+    sha256=hashlib.sha256()
+    md5=hashlib.md5()
+    with open(fileName,'rb') as f:
+        while True:
+            buf=f.read(1048576)
+            if not buf:
+                break
+            sha256.update(buf)
+            md5.update(buf)
+    entry={'url':url, 'name':url.split('/')[-1], 'size':os.path.getsize(fileName),
+           'sha256':sha256.hexdigest(), 'md5':md5.hexdigest()}
+    objectName=os.path.join(cacheDir,'objects',entry['sha256'])
+    with cacheLock(cacheDir, True):
+        # a truncated object is replaced, as cacheLookup no longer uses it
+        if not os.path.isfile(objectName) or os.path.getsize(objectName) != entry['size']:
+            tmpName=os.path.join(cacheDir,'objects','.tmp-'+entry['sha256'])
+            if os.path.exists(tmpName):
+                os.remove(tmpName)
+            try:
+                os.link(fileName, tmpName)
+            except OSError:
+                shutil.copyfile(fileName, tmpName)
+            os.rename(tmpName, objectName)
+        os.utime(objectName, None)
+        atomicWrite(os.path.join(cacheDir,'urls',hashlib.sha256(url.encode('utf-8')).hexdigest()), json.dumps(entry).encode('utf-8'))
+        evictCache(cacheDir, maxBytes, minAge, keep=objectName)
+    return objectName
+
+##################################################################
+#Function Name: evictCache
+#Parameters:    cacheDir, maxBytes, minAge, keep
+#Purpose:       Remove least recently used archives until the cache
+#               holds at most maxBytes.  Archives used within minAge
+#               seconds may still be read by another host and stay.
+#               Must be called with the cache lock held.
+#		@cacheStore
+##################################################################
+def evictCache(cacheDir, maxBytes, minAge=3600, keep=None):
+    objects=[]
+    for path in glob.glob(os.path.join(cacheDir,'objects','*')):
+        st=os.stat(path)
+        objects.append((st.st_mtime, st.st_size, path))
+    total=sum(o[1] for o in objects)
+    evicted=set()
+    for mtime, size, path in sorted(objects):
+        if total <= maxBytes:
+            break
+        if path == keep or time.time()-mtime < minAge:
+            continue
+        os.remove(path)
+        evicted.add(os.path.basename(path))
+        total-=size
+        print("\tevicted %s from release cache" % os.path.basename(path))
+    if evicted:
+        for urlEntry in glob.glob(os.path.join(cacheDir,'urls','*')):
+            try:
+                with open(urlEntry) as f:
+                    if json.load(f)['sha256'] in evicted:
+                        os.remove(urlEntry)
+            except (ValueError, KeyError, OSError):
+                continue
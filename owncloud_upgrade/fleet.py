@@ -0,0 +1,201 @@
+#*******************************************************************************
+#*******************************************************************************
+# 
+#                      COPYRIGHT (c) 2015, James Sinton
+#                             ALL RIGHTS RESERVED
+# 
+#  This library is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+# 
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with this library; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# 
+#   DESCRIPTION
+#      Upgrades the instances of an inventory concurrently
+# 
+#********************************************************************************
+#********************************************************************************
+
+import json
+import os
+import re
+import sys
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+from .metrics import writeReport
+from .config import applyArgs, getConfig
+from .commands import ThreadPrefixWriter
+
+##################################################################
+#Function Name: readInventory
+#Parameters:    fileName
+#Purpose:       Return the instances of a fleet inventory.  The file
+#               is a JSON list (or {"instances": [...]}) of objects
+#               whose keys are configDict keys, e.g. name, wwwRoot,
+#               ocDir, backupRoot, wwwUser, ocDB, dbUser, dbPwd, code.
+#               Names, which default to ocDir, must be unique.
+#		@runFleet
+##################################################################
+def readInventory(fileName):
+    with open(fileName) as f:
+        inventory=json.load(f)
+    if isinstance(inventory, dict):
+        inventory=inventory['instances']
+    known=set(getConfig()) | set(['name'])
+    for i, instance in enumerate(inventory):
+        unknown=set(instance) - known
+        if unknown:
+            raise ValueError("instance %d of %s has unknown keys: %s" % (i, fileName, ', '.join(sorted(unknown))))
+        instance.setdefault('name', instance.get('ocDir', 'instance%d' % i))
+    names=[instance['name'] for instance in inventory]
+    for name in sorted(set(names)):
+        if names.count(name) > 1:
+            raise ValueError("%s names more than one instance %s" % (fileName, name))
+    return inventory
+
+##################################################################
+#Function Name: separateShared
+#Parameters:    configs
+#Purpose:       Give every instance sharing its backupRoot with
+#               another one a subdirectory of it named after the
+#               instance, and likewise its own directory below a shared
+#               wwwRoot to download the release into.  Backups are only
+#               named by version and time, which is the same for every
+#               instance of a fleet run, so shared paths would have
+#               the instances write over and delete each other's files.
+#		@runFleet
+##################################################################
+def separateShared(configs):
+    dirNames=[]
+    for configDict in configs:
+        dirName=re.sub(r'[^A-Za-z0-9._-]+', '_', configDict['name']).strip('_') or 'instance'
+        while dirName in dirNames:
+            dirName+='_'
+        dirNames.append(dirName)
+    backupRoots={}
+    downloadDirs={}
+    for configDict, dirName in zip(configs, dirNames):
+        backupRoots.setdefault(os.path.normpath(configDict['backupRoot']), []).append((configDict, dirName))
+        downloadDirs.setdefault(os.path.normpath(configDict['downloadDir'] or configDict['wwwRoot']), []).append((configDict, dirName))
+    for root, group in backupRoots.items():
+        if len(group) < 2:
+            continue
+        for configDict, dirName in group:
+            configDict['backupRoot']=os.path.join(root, dirName)
+            print("%s: the backup root is shared, backups go to %s" % (configDict['name'], configDict['backupRoot']))
+    for root, group in downloadDirs.items():
+        if len(group) < 2:
+            continue
+        for configDict, dirName in group:
+            configDict['downloadDir']=os.path.join(root, '.download-'+dirName)
+
+##################################################################
+#Function Name: upgradeInstance
+#Parameters:    configDict
+#Purpose:       Back up and upgrade one instance without asking
+#               questions and return a result row for the fleet table
+#		@runFleet
+##################################################################
+def upgradeInstance(configDict):
+    from .backup import backupOC
+    from .install import installUpgrade
+    from .php import getOCVersion, readOCFiles
+    from .updates import checkUpdate
+    threading.current_thread().instanceName=configDict['name']
+    start=time.time()
+    result={'name':configDict['name'], 'from':'', 'to':'', 'status':'failed', 'seconds':0}
+    try:
+        configDict=getOCVersion(configDict)
+        result['from']=configDict['ocVersionString']
+        if configDict['code'] is None:
+            configDict=checkUpdate(configDict)
+            if not configDict['updateIsAvailable']:
+                result['status']='current'
+                return result
+        if backupOC(configDict) is None:
+            result['status']='failed: backup'
+            return result
+        if installUpgrade(configDict):
+            result['status']='upgraded'
+        result['to']=readOCFiles(configDict['ocDir'],configDict['php'])['OC_VersionString']
+    except Exception as e:
+        print("Error:  %s" % e)
+        result['status']='error: %s' % e
+    finally:
+        result['seconds']=time.time()-start
+    return result
+
+##################################################################
+#Function Name: runFleet
+#Parameters:    args
+#Purpose:       Upgrade every instance of the inventory, at most
+#               --fleet-jobs at a time, with --disk-jobs code copies
+#               or extractions and --db-dumps database dumps running
+#               at once, then print a table of the results.  Instances
+#               sharing one apache should use --staged, since the
+#               in-place install stops the web server.  Instances
+#               sharing a backup root get a subdirectory of it each.
+#		@main
+##################################################################
+def runFleet(args):
+    from .php import readOCFiles
+    from .updates import updateChecker
+    inventory=readInventory(args.inventory)
+    diskSlot=threading.Semaphore(max(1, args.disk_jobs))
+    dbSlot=threading.Semaphore(max(1, args.db_dumps))
+    checker=None
+    configs=[]
+    for instance in inventory:
+        configDict=applyArgs(getConfig(),args)
+        if args.code:
+            configDict['code']=args.code
+        configDict.update(instance)
+        configDict['pinned']=tuple(instance)
+        configDict['assumeYes']=True
+        configDict['diskSlot']=diskSlot
+        configDict['dbSlot']=dbSlot
+        if checker is None:
+            checker=updateChecker(configDict)
+        configDict['updateChecker']=checker
+        configs.append(configDict)
+    separateShared(configs)
+
+    # ask the updater about every installed version at once
+    versions=[]
+    for configDict in configs:
+        if configDict['code'] is None:
+            try:
+                versions.append(readOCFiles(configDict['ocDir'],configDict['php'])['OC_Version'])
+            except (OSError, ValueError, KeyError):
+                pass
+    if checker is not None:
+        checker.checkMany(versions)
+
+    stdout=sys.stdout
+    sys.stdout=ThreadPrefixWriter(stdout)
+    pool=ThreadPool(max(1, min(args.fleet_jobs, len(configs))))
+    try:
+        results=pool.map(upgradeInstance, configs)
+    finally:
+        pool.close()
+        pool.join()
+        sys.stdout=stdout
+        if args.report:
+            writeReport(args.report,args.report_format,[(c['name'],c['metrics']) for c in configs])
+
+    width=max([len(r['name']) for r in results] + [8])
+    print("\n")
+    print("%-*s  %-12s  %-12s  %9s  %s" % (width, 'Instance', 'From', 'To', 'Seconds', 'Status'))
+    for r in results:
+        print("%-*s  %-12s  %-12s  %9.1f  %s" % (width, r['name'], r['from'], r['to'], r['seconds'], r['status']))
+    return results
@@ -0,0 +1,498 @@
+#*******************************************************************************
+#*******************************************************************************
+# 
+#                      COPYRIGHT (c) 2015, James Sinton
+#                             ALL RIGHTS RESERVED
+# 
+#  This library is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+# 
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with this library; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# 
+#   DESCRIPTION
+#      Installs a new release in place, staged, as a delta or from
+#      a prepared upgrade
+# 
+#********************************************************************************
+#********************************************************************************
+
+import os
+import shutil
+import tarfile
+import zipfile
+
+from .metrics import phase
+from .commands import askYesorNo, CommandError, ioSlot, runCommand, UpgradeProgress
+
+##################################################################
+#Function Name: installDelta
+#Parameters:    configDict, codeFileName
+#Purpose:       Upgrade the code in ocDir in place, writing only the
+#               files that differ between the installed release and
+#               the new one, while the web server is stopped
+#		@installUpgrade
+##################################################################
+def installDelta(configDict, codeFileName):
+    from .permissions import permissionRules, repairData, startBackgroundRepair
+    from .release import applyDelta, loadManifest, manifestFileName, protectedPaths, saveManifest, scanManifest, undoDelta
+    ocDir=os.path.normpath(configDict['ocDir'])
+    isProtected=protectedPaths(ocDir, configDict['dataPath'])
+    manifestFile=manifestFileName(configDict['stateDir'], ocDir)
+    old=loadManifest(manifestFile)
+    if old is None:
+        print("\n")
+        print("No manifest of the installed release; hashing the installed code . . .")
+        with phase(configDict,'manifestScan') as m:
+            old=scanManifest(ocDir, isProtected)
+            m.update(files=len(old['files']))
+    else:
+        print("\n")
+        print("Installed release: %s (%d files)" % (old.get('release') or 'unknown', len(old['files'])))
+
+    # stopping web server
+    print("\n")
+    print("Stopping web server")
+    cmd = ['sudo','service','apache2', 'stop']
+    with phase(configDict,'apacheStop'):
+        runCommand(configDict,cmd)
+
+    print("\n")
+    print("Applying the changes of the new release . . .")
+    rules=permissionRules(ocDir,configDict['wwwUser'],configDict['dataPath'])
+    undoDir=ocDir+'.delta_'+configDict['backupTime']
+    journal={'added':[], 'saved':[], 'removedDirs':[]}
+    try:
+        with ioSlot(configDict,'diskSlot'), phase(configDict,'extraction') as m:
+            stats, manifest=applyDelta(codeFileName,ocDir,rules,old,isProtected,undoDir,journal)
+            m.update(bytes=stats['bytes'], files=stats['written']+stats['removed'], syscallsAvoided=stats['avoided'])
+    except (ValueError, tarfile.TarError, zipfile.BadZipfile, OSError) as e:
+        print("Error:  %s" % e)
+        print("Restoring previous code")
+        undoDelta(ocDir,undoDir,journal)
+        cmd = ['sudo','service','apache2', 'start']
+        with phase(configDict,'apacheStart'):
+            runCommand(configDict,cmd)
+        return False
+    print("\t%(written)d files written (%(bytes)d bytes), %(unchanged)d unchanged, %(removed)d removed" % stats)
+    if stats['kept']:
+        print("\t%(kept)d locally modified files of the old release kept" % stats)
+    if stats['rejected']:
+        print("\t%(rejected)d unsafe members rejected" % stats)
+    saveManifest(manifestFile, manifest)
+    shutil.rmtree(undoDir, True)
+
+    # Setting secure permissions on the data directory, the code already has them
+    if configDict['dataPath'] is not None and os.path.isdir(configDict['dataPath']):
+        print("\n")
+        print("Setting secure permissions on data . . .")
+        repairData(configDict)
+
+    # stopping web server
+    print("\n")
+    print("Starting web server")
+    
+    cmd = ['sudo','service','apache2', 'start']
+    with phase(configDict,'apacheStart'):
+        runCommand(configDict,cmd)
+    startBackgroundRepair(configDict)
+    return True
+
+##################################################################
+#Function Name: makeConfigDir
+#Parameters:    configFile, rules
+#Purpose:       Create the directory of configFile with its secure
+#               permissions if the release did not ship it
+#		@installInPlace, stageRelease
+##################################################################
+def makeConfigDir(configFile, rules):
+    from .permissions import fixPermission, overlayRule, resolvePermission
+    configDir=os.path.dirname(configFile)
+    if not os.path.isdir(configDir):
+        os.mkdir(configDir, 0o700)
+        fixPermission(configDir, os.lstat(configDir), overlayRule((None,None,0o755,None), resolvePermission(rules, configDir)))
+
+##################################################################
+#Function Name: installInPlace
+#Parameters:    configDict, codeFileName
+#Purpose:       Replace the code in ocDir with the new release while
+#               the web server is stopped
+#		@installUpgrade
+##################################################################
+def installInPlace(configDict, codeFileName):
+    # stopping web server
+    from .backup import copyFile
+    from .permissions import permissionRules, repairData, resolvePermission, startBackgroundRepair
+    from .release import extractRelease, isBelow, manifestFileName, newManifest, saveManifest
+    print("\n")
+    print("Stopping web server")
+    cmd = ['sudo','service','apache2', 'stop']
+    with phase(configDict,'apacheStop'):
+        runCommand(configDict,cmd)
+
+    # move the old code aside so it can be compared against and restored on failure
+    ocDir=os.path.normpath(configDict['ocDir'])
+    oldCode=ocDir+'.old_'+configDict['backupTime']
+    relData=None
+    if configDict['dataPath'] is not None and isBelow(configDict['dataPath'],ocDir):
+        relData=os.path.relpath(os.path.realpath(configDict['dataPath']),os.path.realpath(ocDir))
+    os.rename(ocDir,oldCode)
+
+    print("\n")
+    print("Extracting new release and setting secure permissions . . .")
+    rules=permissionRules(ocDir,configDict['wwwUser'],configDict['dataPath'])
+    manifest=newManifest('release',os.path.basename(codeFileName))
+    try:
+        with ioSlot(configDict,'diskSlot'), phase(configDict,'extraction') as m:
+            stats=extractRelease(codeFileName,ocDir,rules,oldCode if configDict['compareInstalled'] else None,manifest=manifest)
+            m.update(bytes=stats['bytes'], files=stats['written']+stats['linked'], syscallsAvoided=stats['avoided'])
+    except (ValueError, tarfile.TarError, zipfile.BadZipfile, OSError) as e:
+        print("Error:  %s" % e)
+        print("Restoring previous code")
+        shutil.rmtree(ocDir,True)
+        os.rename(oldCode,ocDir)
+        cmd = ['sudo','service','apache2', 'start']
+        with phase(configDict,'apacheStart'):
+            runCommand(configDict,cmd)
+        return False
+    print("\t%(written)d files written (%(bytes)d bytes), %(linked)d unchanged files linked, %(dirs)d directories" % stats)
+    if stats['rejected']:
+        print("\t%(rejected)d unsafe members rejected" % stats)
+    if relData is not None:
+        os.rename(os.path.join(oldCode,relData),os.path.join(ocDir,relData))
+    try:
+        shutil.rmtree(oldCode)
+    except OSError as e:
+        print("Error:  %s - %s." % (e.filename,e.strerror))
+    saveManifest(manifestFileName(configDict['stateDir'],ocDir),manifest)
+
+    # Restoring config.php
+    if os.path.isfile(configDict['backupDir']+'/config/config.php'):
+        print("\n")
+        print("Restoring config.php")
+        configFile=ocDir+'/config/config.php'
+        makeConfigDir(configFile,rules)
+        copyFile(configDict['backupDir']+'/config/config.php',configFile,os.stat(configDict['backupDir']+'/config/config.php'),resolvePermission(rules,configFile))
+    else:
+        print("You must restore config.php before running occ upgrade script; no backup was found in "+configDict['backupDir'])
+    
+    # Setting secure permissions on the data directory, the code already has them
+    if configDict['dataPath'] is not None and os.path.isdir(configDict['dataPath']):
+        print("\n")
+        print("Setting secure permissions on data . . .")
+        repairData(configDict)
+
+    # stopping web server
+    print("\n")
+    print("Starting web server")
+    
+    cmd = ['sudo','service','apache2', 'start']
+    with phase(configDict,'apacheStart'):
+        runCommand(configDict,cmd)
+    startBackgroundRepair(configDict)
+    return True
+
+##################################################################
+#Function Name: stageRelease
+#Parameters:    configDict, codeFileName
+#Purpose:       Extract the new release into a staging directory next
+#               to ocDir and prepare it completely (config.php, links
+#               to data, permissions) while the old code still serves.
+#               Returns the path of the staged code or None.
+#		@installStaged
+##################################################################
+def stageRelease(configDict, codeFileName):
+    from .backup import copyFile
+    from .permissions import permissionRules, resolvePermission
+    from .release import extractRelease, isBelow, newManifest
+    ocDir=os.path.normpath(configDict['ocDir'])
+    stageDir=ocDir+'.stage_'+configDict['backupTime']
+    print("\tstaging new release in " + stageDir)
+    os.mkdir(stageDir, 0o750)
+    newCode=os.path.join(stageDir,os.path.basename(ocDir))
+    dataPath=configDict['dataPath']
+    if dataPath is not None and isBelow(dataPath,ocDir):
+        dataPath=None
+    rules=permissionRules(newCode,configDict['wwwUser'],dataPath)
+    configDict['releaseManifest']=newManifest('release',os.path.basename(codeFileName))
+    try:
+        with ioSlot(configDict,'diskSlot'), phase(configDict,'extraction') as m:
+            stats=extractRelease(codeFileName,newCode,rules,ocDir if configDict['compareInstalled'] else None,manifest=configDict['releaseManifest'])
+            m.update(bytes=stats['bytes'], files=stats['written']+stats['linked'], syscallsAvoided=stats['avoided'])
+    except (ValueError, tarfile.TarError, zipfile.BadZipfile, OSError) as e:
+        print("Error:  %s" % e)
+        shutil.rmtree(stageDir,True)
+        return None
+    print("\t%(written)d files written (%(bytes)d bytes), %(linked)d unchanged files linked, %(dirs)d directories" % stats)
+    if stats['rejected']:
+        print("\t%(rejected)d unsafe members rejected" % stats)
+
+    # carry over config.php and the symbolic links (e.g. to data) of the live installation
+    if os.path.isfile(ocDir+'/config/config.php'):
+        print("\tcopying config.php")
+        configFile=newCode+'/config/config.php'
+        makeConfigDir(configFile,rules)
+        copyFile(ocDir+'/config/config.php',configFile,os.stat(ocDir+'/config/config.php'),resolvePermission(rules,configFile))
+    else:
+        print("You must restore config.php before running occ upgrade script; none was found in "+ocDir)
+    for name in os.listdir(ocDir):
+        if os.path.islink(os.path.join(ocDir,name)) and not os.path.lexists(os.path.join(newCode,name)):
+            print("\tlinking " + name)
+            os.symlink(os.readlink(os.path.join(ocDir,name)),os.path.join(newCode,name))
+    return newCode
+
+##################################################################
+#Function Name: exchangePaths
+#Parameters:    path1, path2
+#Purpose:       Swap two directories in one atomic step with Linux
+#               renameat2(RENAME_EXCHANGE).  Returns False when the
+#               C library, the kernel (before 3.15) or the file system
+#               does not support it.
+#		@swapCode
+##################################################################
+def exchangePaths(path1, path2):
+    import ctypes
+    import errno
+    RENAME_EXCHANGE=2
+    AT_FDCWD=-100
+    try:
+        renameat2=ctypes.CDLL(None, use_errno=True).renameat2
+    except (AttributeError, OSError):
+        return False
+    renameat2.argtypes=[ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_uint]
+    if renameat2(AT_FDCWD, os.fsencode(path1), AT_FDCWD, os.fsencode(path2), RENAME_EXCHANGE) == 0:
+        return True
+    e=ctypes.get_errno()
+    if e in (errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+        return False
+    raise OSError(e, os.strerror(e), path1, None, path2)
+
+##################################################################
+#Function Name: swapCode
+#Parameters:    ocDir, newCode, dataPath, suffix
+#Purpose:       Make newCode the live code and return where the old
+#               code went.  When ocDir is a symbolic link it is
+#               flipped with a rename over it.  Otherwise newCode and
+#               ocDir are exchanged with renameat2 and the old code
+#               renamed aside; both are atomic.  Where renameat2 is
+#               not available the old directory is renamed aside and
+#               newCode renamed into its place, which leaves ocDir
+#               missing for the moment between the two renames.  A
+#               data directory kept inside the old code is moved
+#               across first.  Calling swapCode again with the
+#               returned path rolls back.
+#		@installStaged
+##################################################################
+def swapCode(ocDir, newCode, dataPath, suffix):
+    from .release import isBelow
+    ocDir=os.path.normpath(ocDir)
+    oldCode=os.path.realpath(ocDir)
+    if os.path.islink(ocDir):
+        releaseDir=ocDir+'_'+suffix
+        if os.path.realpath(newCode) != os.path.realpath(releaseDir):
+            os.rename(newCode,releaseDir)
+        previous=oldCode
+    else:
+        releaseDir=newCode
+        previous=ocDir+'.previous_'+suffix
+    if dataPath is not None and isBelow(dataPath,oldCode):
+        relData=os.path.relpath(os.path.realpath(dataPath),oldCode)
+        os.rename(os.path.join(oldCode,relData),os.path.join(releaseDir,relData))
+    if os.path.islink(ocDir):
+        tmpLink=ocDir+'.tmp_'+suffix
+        os.symlink(releaseDir,tmpLink)
+        os.rename(tmpLink,ocDir)
+    elif exchangePaths(releaseDir,ocDir):
+        # releaseDir now holds the old code
+        os.rename(releaseDir,previous)
+    else:
+        # requests arriving between these renames find no code
+        os.rename(ocDir,previous)
+        os.rename(releaseDir,ocDir)
+    return previous
+
+##################################################################
+#Function Name: installStaged
+#Parameters:    configDict, codeFileName
+#Purpose:       Install the new release without stopping the web
+#               server: stage it next to ocDir, swap it in atomically
+#               and reload apache
+#		@installUpgrade
+##################################################################
+def installStaged(configDict, codeFileName):
+    print("\n")
+    print("Staging new release . . .")
+    newCode=stageRelease(configDict,codeFileName)
+    if newCode is None:
+        return False
+    switchRelease(configDict,newCode)
+    return True
+
+##################################################################
+#Function Name: switchRelease
+#Parameters:    configDict, newCode
+#Purpose:       Swap the staged release newCode in, repair the data
+#               permissions and reload apache
+#		@installStaged, installPrepared
+##################################################################
+def switchRelease(configDict, newCode):
+    from .permissions import repairData, startBackgroundRepair
+    from .release import manifestFileName, saveManifest
+    stageDir=os.path.dirname(newCode)
+    print("\n")
+    print("Switching to new release . . .")
+    with phase(configDict,'swap') as m:
+        configDict['previousCode']=swapCode(configDict['ocDir'],newCode,configDict['dataPath'],configDict['backupTime'])
+    print("\tswitched in %.3f s; previous code kept in %s" % (m['seconds'], configDict['previousCode']))
+    configDict['stagedCode']=None
+    saveManifest(manifestFileName(configDict['stateDir'],configDict['ocDir']),configDict['releaseManifest'])
+    if os.path.isdir(stageDir) and not os.listdir(stageDir):
+        os.rmdir(stageDir)
+    print("\n")
+    print("Setting secure permissions on data . . .")
+    repairData(configDict)
+
+    # reloading clears the PHP opcache of the old code
+    print("\n")
+    print("Reloading web server")
+    cmd = ['sudo','service','apache2', 'reload']
+    with phase(configDict,'apacheReload'):
+        runCommand(configDict,cmd)
+    startBackgroundRepair(configDict)
+
+##################################################################
+#Function Name: installPrepared
+#Parameters:    configDict
+#Purpose:       Finish an upgrade prepared by prepareOC: with the site
+#               in maintenance mode, dump the database, carry the
+#               current config.php over and swap the staged release in.
+#               If the dump or the copy fails, the staged release and
+#               the backup are removed and the site is taken online.
+#		@installUpgrade
+##################################################################
+def installPrepared(configDict):
+    from .backup import backupDatabase, copyFile, discardBackup, discardPrepared
+    from .permissions import permissionRules, resolvePermission
+    from .release import isBelow
+    ocDir=os.path.normpath(configDict['ocDir'])
+    newCode=configDict['stagedCode']
+
+    # place owncloud server into maintenance mode
+    print("\n")
+    print("Placing owncloud server into maintainance mode...")
+    cmd = ['sudo','-u',configDict['wwwUser'], configDict['php'], ocDir+'/occ', 'maintenance:mode', '--on']
+    try:
+        with phase(configDict,'maintenanceOn'):
+            runCommand(configDict,cmd,check=True)
+    except CommandError as e:
+        print("Error:  %s" % e)
+        discardPrepared(configDict)
+        return False
+
+    print("\n")
+    print("Backing up owncloud database . . .")
+    try:
+        backupDatabase(configDict)
+
+        # config.php may have changed since it was staged, not least by
+        # maintenance:mode, so the backup and the new release get it again
+        configFile=ocDir+'/config/config.php'
+        if os.path.isfile(configFile):
+            print("\n")
+            print("Copying config.php")
+            st=os.stat(configFile)
+            dataPath=configDict['dataPath']
+            if dataPath is not None and isBelow(dataPath,ocDir):
+                dataPath=None
+            for target, rules in ((configDict['backupDir']+'/config/config.php', permissionRules(configDict['backupDir'],configDict['wwwUser'],None)),
+                                  (newCode+'/config/config.php', permissionRules(newCode,configDict['wwwUser'],dataPath))):
+                makeConfigDir(target,rules)
+                copyFile(configFile,target,st,resolvePermission(rules,target))
+    except Exception as e:
+        # as in runPhases: a missing compressor or a failed table listing
+        # must not leave the site in maintenance mode
+        print("Error:  %s" % e)
+        discardPrepared(configDict)
+        discardBackup(configDict)
+        print("Taking owncloud online")
+        cmd = ['sudo','-u',configDict['wwwUser'], configDict['php'], ocDir+'/occ', 'maintenance:mode', '--off']
+        with phase(configDict,'maintenanceOff'):
+            runCommand(configDict,cmd)
+        return False
+
+    switchRelease(configDict,newCode)
+    return True
+
+##################################################################
+#Function Name: installUpgrade
+#Parameters:    configDict
+#Purpose:       Install upgrade code
+#		@main
+##################################################################
+def installUpgrade(configDict):
+    from .download import fetchRelease
+    from .php import checkOCVersion
+    print("\n")
+    print("Setting up new release for installation . . .")
+        
+    # the release is fetched and verified before anything is stopped or
+    # removed; backupOC has usually done so alongside the backup
+    codeFileName=configDict['codeFileName']
+    if codeFileName is None:
+        try:
+            codeFileName=fetchRelease(configDict)
+        except (IOError, ValueError) as e:
+            print("Error:  %s" % e)
+            return False
+
+    if configDict['prepare']:
+        if not installPrepared(configDict):
+            return False
+    elif configDict['staged']:
+        if not installStaged(configDict,codeFileName):
+            return False
+    elif configDict['delta']:
+        if not installDelta(configDict,codeFileName):
+            return False
+    else:
+        if not installInPlace(configDict,codeFileName):
+            return False
+
+    # Check version
+    if checkOCVersion(configDict):
+        # Ask whether you want to run the upgrade script
+        question="Please check that updated code has been correctly installed in "+configDict['ocDir']+".\nDo you want to run the occ upgrade script?"
+        if askYesorNo(question,"yes",configDict['assumeYes']) == "yes":
+            # Upgrade owncloud
+            print("\n")
+            print("Upgrading owncloud . . .")
+            cmd = ['sudo','-u',configDict['wwwUser'], configDict['php'], configDict['ocDir']+'/occ', 'upgrade']
+            try:
+                with phase(configDict,'occUpgrade'):
+                    runCommand(configDict,cmd,configDict['upgradeTimeout'],UpgradeProgress(),True)
+            except CommandError as e:
+                print("Error:  %s" % e)
+                print("owncloud stays in maintenance mode.  Fix the problem and run occ upgrade again, or restore the backup with --rollback.")
+                return False
+    
+            # Disable maintenance mode
+            print("\n")
+            print("Taking owncloud online")
+            cmd = ['sudo','-u',configDict['wwwUser'], configDict['php'], configDict['ocDir']+'/occ', 'maintenance:mode', '--off']
+            with phase(configDict,'maintenanceOff'):
+                runCommand(configDict,cmd)
+            seconds=configDict['metrics'].span('maintenanceOn','maintenanceOff')
+            if seconds is not None:
+                print("owncloud was in maintenance mode for %.1f s" % seconds)
+    
+            print("Installation is complete . . .")
+            return True
+    return False
@@ -0,0 +1,146 @@
+#*******************************************************************************
+#*******************************************************************************
+# 
+#                      COPYRIGHT (c) 2015, James Sinton
+#                             ALL RIGHTS RESERVED
+# 
+#  This library is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+# 
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with this library; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# 
+#   DESCRIPTION
+#      Per-phase timing and resource report of an upgrade run
+# 
+#********************************************************************************
+#********************************************************************************
+
+import contextlib
+import datetime
+import json
+import resource
+import threading
+import time
+
+##################################################################
+#Class Name:    RunMetrics
+#Purpose:       Record wall time, bytes and files processed, syscalls
+#               avoided and peak memory for each phase of a run
+#		@getConfig
+##################################################################
+class RunMetrics(object):
+    def __init__(self):
+        self.start=time.time()
+        self.phases=[]
+        self.lock=threading.Lock()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        record={'phase':name, 'start':time.time()-self.start, 'seconds':0.0,
+                'bytes':0, 'files':0, 'syscallsAvoided':0, 'status':'ok'}
+        started=time.time()
+        try:
+            yield record
+        except:
+            record['status']='failed'
+            raise
+        finally:
+            record['seconds']=time.time()-started
+            # ru_maxrss is in kilobytes on Linux
+            record['peakRssBytes']=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+            record['childPeakRssBytes']=resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss*1024
+            with self.lock:
+                self.phases.append(record)
+
+    def span(self, first, last):
+        # seconds from the start of phase first to the end of phase last
+        starts=[p['start'] for p in self.phases if p['phase'] == first]
+        ends=[p['start']+p['seconds'] for p in self.phases if p['phase'] == last]
+        if not starts or not ends or max(ends) < min(starts):
+            return None
+        return max(ends)-min(starts)
+
+    def summary(self):
+        downtime=self.span('apacheStop','apacheStart')
+        if downtime is None:
+            downtime=sum(p['seconds'] for p in self.phases if p['phase'] == 'swap') if any(p['phase'] == 'swap' for p in self.phases) else None
+        return {'totalSeconds':time.time()-self.start,
+                'downtimeSeconds':downtime,
+                'maintenanceSeconds':self.span('maintenanceOn','maintenanceOff'),
+                'phases':sorted(self.phases, key=lambda p: p['start'])}
+
+##################################################################
+#Function Name: phase
+#Parameters:    configDict, name
+#Purpose:       Context manager timing one phase of the run; the
+#               yielded dict takes bytes, files and syscallsAvoided
+#		@backupOC, installUpgrade, installInPlace, installStaged
+##################################################################
+def phase(configDict, name):
+    return configDict['metrics'].phase(name)
+
+##################################################################
+#Function Name: writeReport
+#Parameters:    fileName, reportFormat, runs
+#Purpose:       Write the metrics of runs, a list of (instance,
+#               RunMetrics), as JSON or Prometheus text format
+#		@main, runFleet
+##################################################################
+def writeReport(fileName, reportFormat, runs):
+    if reportFormat == 'json':
+        report={'time':datetime.datetime.now().isoformat(),
+                'instances':[dict(instance=name, **metrics.summary()) for name, metrics in runs]}
+        data=json.dumps(report, indent=2, sort_keys=True)
+    else:
+        def label(value):
+            return str(value).replace('\\','\\\\').replace('"','\\"').replace('\n','\\n')
+        families=[('seconds','owncloud_upgrade_phase_seconds','Wall time of the phase'),
+                  ('bytes','owncloud_upgrade_phase_bytes','Bytes processed by the phase'),
+                  ('files','owncloud_upgrade_phase_files','Files processed by the phase'),
+                  ('syscallsAvoided','owncloud_upgrade_phase_syscalls_avoided','chown/chmod calls and file writes skipped because nothing had changed'),
+                  ('peakRssBytes','owncloud_upgrade_phase_peak_rss_bytes','Peak resident memory of the tool at the end of the phase'),
+                  ('childPeakRssBytes','owncloud_upgrade_phase_child_peak_rss_bytes','Peak resident memory of any child process at the end of the phase')]
+        # a phase run more than once (e.g. apacheStart after a failed
+        # extraction) is reported once, summed, so no series repeats
+        merged=[]
+        for name, metrics in runs:
+            phases={}
+            for p in metrics.summary()['phases']:
+                if p['phase'] not in phases:
+                    phases[p['phase']]=dict(p)
+                    merged.append((name, phases[p['phase']]))
+                    continue
+                m=phases[p['phase']]
+                for key in ('seconds','bytes','files','syscallsAvoided'):
+                    m[key] += p[key]
+                for key in ('peakRssBytes','childPeakRssBytes'):
+                    m[key]=max(m[key], p[key])
+                if p['status'] != 'ok':
+                    m['status']=p['status']
+        lines=[]
+        for key, metric, help in families:
+            lines.append('# HELP %s %s' % (metric, help))
+            lines.append('# TYPE %s gauge' % metric)
+            for name, p in merged:
+                lines.append('%s{instance="%s",phase="%s",status="%s"} %s' % (metric, label(name), p['phase'], p['status'], repr(p[key])))
+        for key, metric, help in [('totalSeconds','owncloud_upgrade_total_seconds','Wall time of the whole run'),
+                                  ('downtimeSeconds','owncloud_upgrade_downtime_seconds','Time the web server was stopped or switching code'),
+                                  ('maintenanceSeconds','owncloud_upgrade_maintenance_seconds','Time ownCloud was in maintenance mode')]:
+            lines.append('# HELP %s %s' % (metric, help))
+            lines.append('# TYPE %s gauge' % metric)
+            for name, metrics in runs:
+                value=metrics.summary()[key]
+                if value is not None:
+                    lines.append('%s{instance="%s"} %s' % (metric, label(name), repr(value)))
+        data='\n'.join(lines)+'\n'
+    with open(fileName,'w') as f:
+        f.write(data)
@@ -0,0 +1,543 @@
+#*******************************************************************************
+#*******************************************************************************
+# 
+#                      COPYRIGHT (c) 2015, James Sinton
+#                             ALL RIGHTS RESERVED
+# 
+#  This library is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+# 
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with this library; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# 
+#   DESCRIPTION
+#      Sets secure permissions on the code and data directories
+# 
+#********************************************************************************
+#********************************************************************************
+
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import queue
+import shutil
+import stat
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from pwd import getpwnam
+
+from .metrics import phase
+
+##################################################################
+#Function Name: scanDir
+#Parameters:    path
+#Purpose:       Yield (name, fullPath, lstat) for every entry of a
+#               directory
+#		@applyPermissions
+##################################################################
+def scanDir(path):
+    with os.scandir(path) as entries:
+        for entry in entries:
+            yield entry.name, entry.path, entry.stat(follow_symlinks=False)
+
+##################################################################
+#Function Name: permissionRules
+#Parameters:    path, wwwUser, dataPath
+#Purpose:       Return the rule table used to secure an installation:
+#               a dict mapping a path to (uid, gid, dirMode, fileMode).
+#               A rule applies to its path and everything below it;
+#               a None field is inherited from the enclosing rule.
+#		@securePermissions
+##################################################################
+def permissionRules(path='/var/www/owncloud',wwwUser='www-data',dataPath=None):
+    rootUID=getpwnam('root').pw_uid
+    wwwUID=getpwnam(wwwUser).pw_uid
+    wwwGID=getpwnam(wwwUser).pw_gid
+    rules={}
+    if path is not None:
+        path=os.path.normpath(path)
+        rules[path]=(rootUID,wwwGID,0o750,0o640)
+        for sub in ('apps','config','themes'):
+            rules[os.path.join(path,sub)]=(wwwUID,wwwGID,None,None)
+    if dataPath is not None:
+        dataPath=os.path.normpath(dataPath)
+        rules[dataPath]=(wwwUID,wwwGID,None,None)
+        rules[os.path.join(dataPath,'.htaccess')]=(None,None,None,0o640)
+    return rules
+
+##################################################################
+#Function Name: overlayRule
+#Parameters:    policy, rule
+#Purpose:       Return policy with the fields set in rule overriding it
+#		@resolvePermission, applyPermissions
+##################################################################
+def overlayRule(policy, rule):
+    if rule is None:
+        return policy
+    return tuple(r if r is not None else p for p, r in zip(policy, rule))
+
+##################################################################
+#Function Name: resolvePermission
+#Parameters:    rules, path
+#Purpose:       Return the (uid, gid, dirMode, fileMode) that rules
+#               assign to path
+#		@applyPermissions
+##################################################################
+def resolvePermission(rules, path):
+    path=os.path.normpath(path)
+    policy=(None,None,None,None)
+    for root in sorted(rules, key=len):
+        if path==root or path.startswith(root+os.sep):
+            policy=overlayRule(policy,rules[root])
+    return policy
+
+##################################################################
+#Function Name: fixPermission
+#Parameters:    path, st, policy, stats
+#Purpose:       Apply policy to path unless the lstat result st shows
+#               that owner and mode are already correct
+#		@applyPermissions
+##################################################################
+def fixPermission(path, st, policy, stats=None):
+    uid, gid, dirMode, fileMode=policy
+    if stats is None:
+        stats={'dirs':0, 'files':0, 'changed':0, 'skipped':0, 'avoided':0}
+    if stat.S_ISDIR(st.st_mode):
+        mode=dirMode
+        stats['dirs'] += 1
+    else:
+        mode=fileMode
+        stats['files'] += 1
+    changed=False
+    if (uid is not None and st.st_uid != uid) or (gid is not None and st.st_gid != gid):
+        os.chown(path, -1 if uid is None else uid, -1 if gid is None else gid)
+        changed=True
+    elif uid is not None or gid is not None:
+        stats['avoided'] += 1
+    if mode is not None and stat.S_IMODE(st.st_mode) != mode:
+        os.chmod(path, mode)
+        changed=True
+    elif mode is not None:
+        stats['avoided'] += 1
+    if changed:
+        stats['changed'] += 1
+    else:
+        stats['skipped'] += 1
+    return changed
+
+##################################################################
+#Function Name: parallelWalk
+#Parameters:    items, visitDir, stats, jobs
+#Purpose:       Run visitDir(item, local) for every queued directory
+#               on a pool of worker threads.  visitDir returns the
+#               items of the subdirectories to visit next and counts
+#               into local, which is summed into stats at the end.
+#		@applyPermissions, backupTree
+##################################################################
+def parallelWalk(items, visitDir, stats, jobs=8):
+    lock=threading.Lock()
+    work=queue.Queue()
+
+    def worker():
+        local=dict.fromkeys(stats, 0)
+        while True:
+            item=work.get()
+            if item is None:
+                work.task_done()
+                break
+            try:
+                for child in visitDir(item, local):
+                    work.put(child)
+            except OSError as e:
+                print("Error:  %s - %s." % (e.filename,e.strerror))
+                local['errors'] += 1
+            finally:
+                work.task_done()
+        with lock:
+            for k in local:
+                stats[k] += local[k]
+
+    for item in items:
+        work.put(item)
+    threads=[threading.Thread(target=worker) for i in range(max(1, jobs))]
+    for t in threads:
+        t.daemon=True
+        t.start()
+    work.join()
+    for t in threads:
+        work.put(None)
+    for t in threads:
+        t.join()
+    return stats
+
+##################################################################
+#Function Name: applyPermissions
+#Parameters:    rules, jobs, roots
+#Purpose:       Apply a rule table from permissionRules in a single
+#               traversal shared by a pool of worker threads.  Every
+#               directory is read once and only inodes whose owner or
+#               mode differ from their rule are touched.  Symbolic
+#               links below a rule root are left alone.  roots limits
+#               the walk to some subtrees of the rule table.
+#		@securePermissions, installInPlace, stageRelease
+##################################################################
+def applyPermissions(rules, jobs=8, roots=None):
+    rules=dict((os.path.normpath(k), v) for k, v in rules.items())
+    if roots is None:
+        roots=list(rules)
+    roots=[os.path.normpath(r) for r in roots]
+    stats={'dirs':0, 'files':0, 'changed':0, 'skipped':0, 'avoided':0, 'errors':0}
+
+    def visitDir(item, local):
+        dirPath, parentPolicy=item
+        subdirs=[]
+        for name, fullPath, st in scanDir(dirPath):
+            if stat.S_ISLNK(st.st_mode):
+                continue
+            policy=overlayRule(parentPolicy, rules.get(fullPath))
+            try:
+                fixPermission(fullPath, st, policy, local)
+            except OSError as e:
+                print("Error:  %s - %s." % (e.filename,e.strerror))
+                local['errors'] += 1
+            if stat.S_ISDIR(st.st_mode):
+                subdirs.append((fullPath, policy))
+        return subdirs
+
+    # walk every root that is not already below another root
+    items=[]
+    for root in sorted(set(roots)):
+        if any(root != other and root.startswith(other+os.sep) for other in roots):
+            continue
+        if not os.path.exists(root):
+            continue
+        policy=resolvePermission(rules, root)
+        st=os.stat(root)
+        fixPermission(root, st, policy, stats)
+        if stat.S_ISDIR(st.st_mode):
+            items.append((root, policy))
+
+    return parallelWalk(items, visitDir, stats, jobs)
+
+##################################################################
+#Function Name: securePermissions
+#Parameters:    path, wwwUser, dataPath, jobs
+#Purpose:       Set secure permissions for installation
+#		@installUpgrade
+##################################################################
+def securePermissions(path='/var/www/owncloud',wwwUser='www-data',dataPath='/var/www/owncloud/data',jobs=8):
+    for d in [path, path+'/apps', path+'/config', path+'/themes', dataPath]:
+        if d is not None and os.path.isdir(d)==False:
+            print("\tMaking "+ d)
+            os.mkdir(d)
+    stats=applyPermissions(permissionRules(path,wwwUser,dataPath),jobs)
+    print("\t%(dirs)d directories and %(files)d files checked, %(changed)d changed, %(skipped)d already correct" % stats)
+    if stats['errors']:
+        print("\t%(errors)d errors" % stats)
+    return stats
+
+# data directory index: a header (magic, version, record count, creation
+# time, digest of the permission rules, end of each top-byte bucket)
+# followed by 40 byte records of parent directory key, crc32 of the
+# name, uid, gid, mode, mtime and ctime.  Records are big endian so
+# their bytes sort by parent and name, keeping each directory together.
+indexRecord=struct.Struct('>QIIIIqq')
+indexHeader=struct.Struct('>4sIQd20s256Q')
+indexMagic=b'OCIX'
+
+##################################################################
+#Class Name:    InodeIndex
+#Purpose:       Read-only view of a data directory index, mmap'd and
+#               searched in place so it costs no memory for very
+#               large trees
+#		@repairDataPermissions
+##################################################################
+class InodeIndex(object):
+    def __init__(self, fileName, rulesDigest):
+        self.count=0
+        self.created=0
+        self.map=None
+        try:
+            f=open(fileName,'rb')
+        except IOError:
+            return
+        with f:
+            head=f.read(indexHeader.size)
+            if len(head) < indexHeader.size:
+                return
+            fields=indexHeader.unpack(head)
+            magic, version, count, created, digest=fields[:5]
+            if magic != indexMagic or version != 2 or digest != rulesDigest:
+                # the permission rules changed: every entry must be checked
+                return
+            if os.fstat(f.fileno()).st_size != indexHeader.size+count*indexRecord.size or count == 0:
+                return
+            self.ends=fields[5:]
+            self.count=count
+            self.created=created
+            self.map=mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def children(self, dirKey):
+        # {name crc: record} of the entries of a directory; a crc shared
+        # by two names maps to None so neither is trusted
+        entries={}
+        if self.map is None:
+            return entries
+        top=dirKey >> 56
+        lo=self.ends[top-1] if top else 0
+        hi=self.ends[top]
+        while lo < hi:
+            mid=(lo+hi)//2
+            if struct.unpack_from('>Q', self.map, indexHeader.size+mid*indexRecord.size)[0] < dirKey:
+                lo=mid+1
+            else:
+                hi=mid
+        end=self.ends[top]
+        while lo < end:
+            record=indexRecord.unpack_from(self.map, indexHeader.size+lo*indexRecord.size)
+            if record[0] != dirKey:
+                break
+            entries[record[1]]=None if record[1] in entries else record
+            lo += 1
+        return entries
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map=None
+
+##################################################################
+#Class Name:    InodeIndexWriter
+#Purpose:       Build a new index with a bucketed external sort:
+#               records are spilled to 256 bucket files by the top
+#               byte of their parent key, then each bucket is sorted
+#               on its own and appended, so memory stays at one bucket
+#		@repairDataPermissions
+##################################################################
+class InodeIndexWriter(object):
+    def __init__(self, fileName, rulesDigest, bufferRecords=65536):
+        self.fileName=fileName
+        self.rulesDigest=rulesDigest
+        self.bufferRecords=bufferRecords
+        self.bucketDir=tempfile.mkdtemp(dir=os.path.dirname(fileName), prefix='.buckets-')
+        self.buffers=[[] for i in range(256)]
+        self.buffered=0
+        self.lock=threading.Lock()
+
+    def add(self, dirKey, nameCrc, st):
+        self.addRecord((dirKey, nameCrc, st.st_uid, st.st_gid, st.st_mode, int(st.st_mtime*1e9), int(st.st_ctime*1e9)))
+
+    def addRecord(self, record):
+        data=indexRecord.pack(*record)
+        with self.lock:
+            self.buffers[record[0] >> 56].append(data)
+            self.buffered += 1
+            if self.buffered >= self.bufferRecords:
+                self.flush()
+
+    def flush(self):
+        for top, records in enumerate(self.buffers):
+            if records:
+                with open(os.path.join(self.bucketDir, '%02x' % top), 'ab') as f:
+                    f.write(b''.join(records))
+                del records[:]
+        self.buffered=0
+
+    def commit(self):
+        self.flush()
+        ends=[]
+        count=0
+        fd, tmpName=tempfile.mkstemp(dir=os.path.dirname(self.fileName), prefix='.tmp-')
+        with os.fdopen(fd,'wb') as f:
+            f.seek(indexHeader.size)
+            for top in range(256):
+                bucket=os.path.join(self.bucketDir, '%02x' % top)
+                if os.path.exists(bucket):
+                    with open(bucket,'rb') as b:
+                        data=b.read()
+                    records=sorted(data[i:i+indexRecord.size] for i in range(0, len(data), indexRecord.size))
+                    f.write(b''.join(records))
+                    count += len(records)
+                ends.append(count)
+            f.seek(0)
+            f.write(indexHeader.pack(indexMagic, 2, count, time.time(), self.rulesDigest, *ends))
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmpName, self.fileName)
+        shutil.rmtree(self.bucketDir, True)
+        return count
+
+    def abort(self):
+        shutil.rmtree(self.bucketDir, True)
+
+##################################################################
+#Function Name: indexFileName
+#Parameters:    stateDir, dataPath
+#Purpose:       Return the index file of a data directory
+#		@repairData, main
+##################################################################
+def indexFileName(stateDir, dataPath):
+    return os.path.join(stateDir, 'data-index', hashlib.sha1(os.fsencode(os.path.normpath(dataPath))).hexdigest()[:16]+'.idx')
+
+##################################################################
+#Function Name: repairDataPermissions
+#Parameters:    dataPath, rules, indexFile, jobs, maxAge, trustDirs
+#Purpose:       Apply rules below dataPath using the index of the last
+#               successful repair.  Entries whose ctime, owner and
+#               mode match the index are left alone.  With trustDirs,
+#               a directory whose mtime and ctime are unchanged is
+#               taken to have the same entries as then, so its files
+#               come from the index without an lstat each and only
+#               its subdirectories are looked at; chown or chmod of
+#               such a file is then only noticed once the index is
+#               older than maxAge seconds and everything is checked
+#               again.  The index is replaced only when no error
+#               occurred.
+#		@repairData, main
+##################################################################
+def repairDataPermissions(dataPath, rules, indexFile, jobs=8, maxAge=7*86400, trustDirs=False):
+    dataPath=os.path.normpath(dataPath)
+    rules=dict((os.path.normpath(k), v) for k, v in rules.items())
+    rulesDigest=hashlib.sha1(json.dumps(sorted(rules.items())).encode()).digest()
+    if not os.path.isdir(os.path.dirname(indexFile)):
+        os.makedirs(os.path.dirname(indexFile), 0o700)
+    stats={'dirs':0, 'files':0, 'changed':0, 'skipped':0, 'avoided':0, 'unchanged':0, 'errors':0}
+    lockFile=open(indexFile+'.lock','a+')
+    fcntl.lockf(lockFile, fcntl.LOCK_EX)
+    index=InodeIndex(indexFile, rulesDigest)
+    trustDirs=trustDirs and time.time()-index.created < maxAge
+    writer=InodeIndexWriter(indexFile, rulesDigest)
+
+    def dirKey(relPath):
+        return struct.unpack('>Q', hashlib.sha1(os.fsencode(relPath)).digest()[:8])[0]
+
+    def check(fullPath, parentKey, nameCrc, st, old, policy, local):
+        # returns whether the entry (a directory) is unchanged
+        if old is not None and old[6] == int(st.st_ctime*1e9) and old[2:5] == (st.st_uid, st.st_gid, st.st_mode):
+            local['unchanged'] += 1
+            local['dirs' if stat.S_ISDIR(st.st_mode) else 'files'] += 1
+            writer.add(parentKey, nameCrc, st)
+            return old[5] == int(st.st_mtime*1e9)
+        if fixPermission(fullPath, st, policy, local):
+            # chown and chmod change the ctime
+            st=os.lstat(fullPath)
+        writer.add(parentKey, nameCrc, st)
+        return False
+
+    def visitDir(item, local):
+        dirPath, relDir, parentPolicy, trusted=item
+        key=dirKey(relDir)
+        known=index.children(key)
+        subdirs=[]
+        if trusted:
+            entries=[]
+            for name in os.listdir(dirPath):
+                old=known.get(zlib.crc32(os.fsencode(name)))
+                if old is not None and not stat.S_ISDIR(old[4]):
+                    local['unchanged'] += 1
+                    local['files'] += 1
+                    local['avoided'] += 1
+                    writer.addRecord(old)
+                    continue
+                fullPath=os.path.join(dirPath, name)
+                entries.append((name, fullPath, os.lstat(fullPath)))
+        else:
+            entries=scanDir(dirPath)
+        for name, fullPath, st in entries:
+            nameCrc=zlib.crc32(os.fsencode(name))
+            if stat.S_ISLNK(st.st_mode):
+                # recorded so a trusted directory does not lstat it again
+                writer.add(key, nameCrc, st)
+                continue
+            relPath=os.path.join(relDir, name)
+            policy=overlayRule(parentPolicy, rules.get(fullPath))
+            try:
+                same=check(fullPath, key, nameCrc, st, known.get(nameCrc), policy, local)
+            except OSError as e:
+                print("Error:  %s - %s." % (e.filename,e.strerror))
+                local['errors'] += 1
+                same=False
+            if stat.S_ISDIR(st.st_mode):
+                subdirs.append((fullPath, relPath, policy, same and trustDirs))
+        return subdirs
+
+    try:
+        policy=resolvePermission(rules, dataPath)
+        same=check(dataPath, 0, 0, os.lstat(dataPath), index.children(0).get(0), policy, stats)
+        parallelWalk([(dataPath, '', policy, same and trustDirs)], visitDir, stats, jobs)
+        index.close()
+        if stats['errors']:
+            writer.abort()
+        else:
+            writer.commit()
+    except:
+        index.close()
+        writer.abort()
+        raise
+    finally:
+        fcntl.lockf(lockFile, fcntl.LOCK_UN)
+        lockFile.close()
+    return stats
+
+##################################################################
+#Function Name: repairData
+#Parameters:    configDict
+#Purpose:       Set secure permissions on the data directory now, or
+#               leave it for startBackgroundRepair or skip it,
+#               according to configDict['dataRepair']
+#		@installInPlace, installStaged
+##################################################################
+def repairData(configDict):
+    dataPath=configDict['dataPath']
+    if dataPath is None or not os.path.isdir(dataPath):
+        return
+    if configDict['dataRepair'] != 'now':
+        print("\tpermissions on data: " + ("repaired in the background once the site is up" if configDict['dataRepair'] == 'background' else "skipped"))
+        return
+    rules=permissionRules(None,configDict['wwwUser'],dataPath)
+    with phase(configDict,'permissions') as m:
+        stats=repairDataPermissions(dataPath,rules,indexFileName(configDict['stateDir'],dataPath),configDict['jobs'],trustDirs=configDict['trustDataDirs'])
+        m.update(files=stats['files']+stats['dirs'], syscallsAvoided=stats['avoided']+stats['unchanged'])
+    print("\t%(dirs)d directories and %(files)d files checked, %(unchanged)d unchanged since the last run, %(changed)d changed" % stats)
+
+##################################################################
+#Function Name: startBackgroundRepair
+#Parameters:    configDict
+#Purpose:       Start a detached run of this package repairing the
+#               permissions of the data directory, logging to the
+#               state directory
+#		@installInPlace, installStaged
+##################################################################
+def startBackgroundRepair(configDict):
+    dataPath=configDict['dataPath']
+    if configDict['dataRepair'] != 'background' or dataPath is None or not os.path.isdir(dataPath):
+        return None
+    logName=indexFileName(configDict['stateDir'],dataPath)[:-len('.idx')]+'.log'
+    if not os.path.isdir(os.path.dirname(logName)):
+        os.makedirs(os.path.dirname(logName), 0o700)
+    # the child runs the package from wherever this copy was loaded
+    env=dict(os.environ)
+    env['PYTHONPATH']=os.pathsep.join(p for p in (os.path.dirname(os.path.dirname(os.path.abspath(__file__))), env.get('PYTHONPATH')) if p)
+    cmd=[sys.executable, '-m', __package__, '--repair-data', dataPath,
+         '--www-user', configDict['wwwUser'], '--state-dir', configDict['stateDir'], '--jobs', str(configDict['jobs'])]
+    if configDict['trustDataDirs']:
+        cmd.append('--trust-data-dirs')
+    with open(logName,'a') as log, open(os.devnull) as devnull:
+        child=subprocess.Popen(cmd, stdin=devnull, stdout=log, stderr=subprocess.STDOUT, close_fds=True, preexec_fn=os.setsid, env=env)
+    print("\trepairing permissions on data in the background (pid %d, log %s)" % (child.pid, logName))
+    return child.pid
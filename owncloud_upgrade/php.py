@@ -0,0 +1,278 @@
+#*******************************************************************************
+#*******************************************************************************
+# 
+#                      COPYRIGHT (c) 2015, James Sinton
+#                             ALL RIGHTS RESERVED
+# 
+#  This library is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+# 
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with this library; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# 
+#   DESCRIPTION
+#      Reads version.php and config.php without running PHP
+# 
+#********************************************************************************
+#********************************************************************************
+
+import json
+import os
+import re
+
+# tokens of the PHP subset used by version.php and config.php
+phpToken=re.compile(r"""
+    (?P<skip>\s+|//[^\n]*|\#[^\n]*|/\*.*?\*/)
+  | (?P<var>\$[A-Za-z_]\w*)
+  | (?P<sq>'(?:[^'\\]|\\.)*')
+  | (?P<dq>"(?:[^"\\]|\\.)*")
+  | (?P<num>-?(?:\d+\.\d*|\.\d+|\d+)(?:[eE][-+]?\d+)?)
+  | (?P<word>[A-Za-z_]\w*)
+  | (?P<op>=>|[=;,()\[\]])
+""", re.S|re.X)
+
+# parsed PHP files, keyed by ocDir: (file identities, values)
+phpCache={}
+
+##################################################################
+#Function Name: tokenizePHP
+#Parameters:    text
+#Purpose:       Split the body of a simple PHP file into tokens;
+#               raise ValueError on anything outside the subset
+#		@parsePHP
+##################################################################
+def tokenizePHP(text):
+    text=text.strip()
+    if text.startswith('<?php'):
+        text=text[5:]
+    if text.endswith('?>'):
+        text=text[:-2]
+    tokens=[]
+    pos=0
+    while pos < len(text):
+        m=phpToken.match(text, pos)
+        if m is None:
+            raise ValueError("unsupported PHP at offset %d" % pos)
+        if m.lastgroup != 'skip':
+            tokens.append((m.lastgroup, m.group()))
+        pos=m.end()
+    return tokens
+
+##################################################################
+#Function Name: phpString
+#Parameters:    kind, literal
+#Purpose:       Decode a single or double quoted PHP string literal.
+#               A double quoted escape other than the simple ones
+#               (hex, octal, unicode, \e...) raises ValueError, so the
+#               file is read by PHP rather than decoded wrongly.
+#		@parsePHP
+##################################################################
+def phpString(kind, literal):
+    body=literal[1:-1]
+    if kind == 'sq':
+        body=re.sub(r"\\([\\'])", r'\1', body)
+    else:
+        if re.search(r'(?<!\\)(?:\\\\)*\$', body):
+            raise ValueError("interpolated PHP string")
+        escapes={'n':'\n', 't':'\t', 'r':'\r', 'v':'\v', 'f':'\f', '\\':'\\', '$':'$', '"':'"'}
+
+        def unescape(m):
+            if m.group(1) not in escapes:
+                raise ValueError("unsupported escape %r in PHP string" % m.group())
+            return escapes[m.group(1)]
+        body=re.sub(r'\\(.)', unescape, body, flags=re.S)
+    return body
+
+##################################################################
+#Function Name: phpArray
+#Parameters:    items
+#Purpose:       Turn parsed (key, value) pairs into what json_encode
+#               would produce: a list for keys 0..n-1, else a dict
+#		@parsePHP
+##################################################################
+def phpArray(items):
+    keys=[]
+    values={}
+    nextIndex=0
+    for key, value in items:
+        if key is None:
+            key=nextIndex
+        elif isinstance(key, bool) or isinstance(key, float):
+            key=int(key)
+        elif isinstance(key, str) and re.match(r'^(0|-?[1-9]\d*)$', key):
+            key=int(key)
+        if isinstance(key, int) and key >= nextIndex:
+            nextIndex=key+1
+        if key not in values:
+            keys.append(key)
+        values[key]=value
+    if keys == list(range(len(keys))):
+        return [values[k] for k in keys]
+    return dict((str(k), values[k]) for k in keys)
+
+##################################################################
+#Function Name: parsePHP
+#Parameters:    text
+#Purpose:       Parse a PHP file made only of $variable = literal;
+#               assignments, as version.php and config.php are, and
+#               return a dict of the variables.  Raise ValueError for
+#               anything else so the caller can fall back to PHP.
+#		@readOCFiles
+##################################################################
+def parsePHP(text):
+    tokens=tokenizePHP(text)
+    pos=[0]
+
+    def peek():
+        return tokens[pos[0]] if pos[0] < len(tokens) else (None, None)
+
+    def take(value=None):
+        tok=peek()
+        if tok[0] is None or (value is not None and tok[1] != value):
+            raise ValueError("unexpected PHP token %r" % (tok[1],))
+        pos[0]+=1
+        return tok
+
+    def value():
+        kind, tok=take()
+        if kind in ('sq','dq'):
+            return phpString(kind, tok)
+        if kind == 'num':
+            return float(tok) if re.search(r'[.eE]', tok) else int(tok)
+        if kind == 'word' and tok.lower() in ('true','false','null'):
+            return {'true':True, 'false':False, 'null':None}[tok.lower()]
+        if kind == 'word' and tok.lower() == 'array':
+            take('(')
+            return array(')')
+        if tok == '[':
+            return array(']')
+        raise ValueError("unsupported PHP value %r" % (tok,))
+
+    def array(close):
+        items=[]
+        while peek()[1] != close:
+            v=value()
+            if peek()[1] == '=>':
+                take('=>')
+                items.append((v, value()))
+            else:
+                items.append((None, v))
+            if peek()[1] != close:
+                take(',')
+        take(close)
+        return phpArray(items)
+
+    variables={}
+    while pos[0] < len(tokens):
+        kind, name=take()
+        if kind != 'var':
+            raise ValueError("unsupported PHP statement at %r" % (name,))
+        take('=')
+        variables[name[1:]]=value()
+        take(';')
+    return variables
+
+##################################################################
+#Function Name: phpIntrospect
+#Parameters:    fileNames, php
+#Purpose:       Include all files in one PHP process and return the
+#               ownCloud variables they define
+#		@readOCFiles
+##################################################################
+def phpIntrospect(fileNames, php='/usr/bin/php'):
+    import subprocess
+    includes=''.join("include '%s'; " % f.replace('\\','\\\\').replace("'","\\'") for f in fileNames)
+    cmd=[php,'-r',includes+'echo json_encode(array("OC_Version"=>$OC_Version,"OC_VersionString"=>$OC_VersionString,"CONFIG"=>isset($CONFIG)?$CONFIG:null));']
+    return json.loads(subprocess.check_output(cmd))
+
+##################################################################
+#Function Name: readOCFiles
+#Parameters:    ocDir, php
+#Purpose:       Return the variables of version.php and config.php.
+#               They are parsed in Python when possible, otherwise
+#               read with a single PHP call, and remembered until one
+#               of the files changes.
+#		@getOCVersion, getOCconfig, checkOCVersion
+##################################################################
+def readOCFiles(ocDir, php='/usr/bin/php'):
+    fileNames=[os.path.join(ocDir,'version.php')]
+    if os.path.isfile(os.path.join(ocDir,'config','config.php')):
+        fileNames.append(os.path.join(ocDir,'config','config.php'))
+    identity=[]
+    for f in fileNames:
+        st=os.stat(f)
+        identity.append((f, st.st_ino, st.st_size, st.st_mtime))
+    cached=phpCache.get(ocDir)
+    if cached is not None and cached[0] == identity:
+        return cached[1]
+    try:
+        values={}
+        for f in fileNames:
+            with open(f, encoding='utf-8') as phpFile:
+                values.update(parsePHP(phpFile.read()))
+        if 'OC_Version' not in values or 'OC_VersionString' not in values:
+            raise ValueError("version.php does not define the version")
+    except ValueError:
+        values=phpIntrospect(fileNames, php)
+    phpCache[ocDir]=(identity, values)
+    return values
+
+##################################################################
+#Function Name: getOCVersion
+#Parameters:    configDict
+#Purpose:       Return current version of ownCloud installed in
+#               version.php
+#		@checkUpdate
+##################################################################
+def getOCVersion(configDict):
+    print("\nGetting current version of ownCloud that is installed . . .")
+    v=readOCFiles(configDict['ocDir'],configDict['php'])
+    configDict['ocVersion'], configDict['ocVersionString']=v['OC_Version'], v['OC_VersionString']
+    print("Current Version Installed:  " + configDict['ocVersionString'])
+    return configDict
+
+##################################################################
+#Function Name: getOCconfig
+#Parameters:    configDict
+#Purpose:       Return config parameters
+#		@checkUpdate
+##################################################################
+def getOCconfig(configDict):
+    print("\nGetting database parameters and path to 'data' . . .")
+    c=readOCFiles(configDict['ocDir'],configDict['php'])['CONFIG']
+    # parameters given explicitly, e.g. in a fleet inventory, win over config.php
+    for key, ocKey in (('dataPath','datadirectory'), ('ocDB','dbname'), ('dbUser','dbuser'), ('dbPwd','dbpassword')):
+        if key not in configDict['pinned']:
+            configDict[key]=c[ocKey]
+    return configDict
+
+##################################################################
+#Function Name: checkOCVersion
+#Parameters:    configDict
+#Purpose:       Check if current version of ownCloud installed
+#               differs from previous version installed
+#		@installUpgrade
+##################################################################
+def checkOCVersion(configDict):
+    v=readOCFiles(configDict['ocDir'],configDict['php'])
+    ocVersion, ocVersionString=v['OC_Version'], v['OC_VersionString']
+    print("\n")
+    print("Previous Version Installed:  " + configDict['ocVersionString'])
+    print("Current Version Installed:  " + ocVersionString)
+    if ocVersion != configDict['ocVersion']:
+        print("\n")
+        print("The versions do not match.")
+        print("Installation seems to be successful.  You may proceed with upgrade . . .")
+        return True
+    else:
+        print("The versions match.")
+        print("Installation failed.  You should fix this then proceed with upgrade . . .")
+        return False
@@ -0,0 +1,575 @@
+#*******************************************************************************
+#*******************************************************************************
+# 
+#                      COPYRIGHT (c) 2015, James Sinton
+#                             ALL RIGHTS RESERVED
+# 
+#  This library is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+# 
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with this library; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# 
+#   DESCRIPTION
+#      Extracts releases and applies them as deltas
+# 
+#********************************************************************************
+#********************************************************************************
+
+import contextlib
+import hashlib
+import io
+import json
+import os
+import shutil
+import stat
+import tarfile
+import time
+import zipfile
+
+##################################################################
+#Function Name: archiveMembers
+#Parameters:    fn
+#Purpose:       Open a tar archive once in stream mode (or a zip file)
+#               and yield (name, kind, mode, mtime, size, fileObject,
+#               linkName) for each member.  kind is one of dir, file,
+#               symlink, hardlink or other; fileObject is only valid
+#               until the next member is requested.
+#		@extractRelease
+##################################################################
+def archiveMembers(fn):
+    try:
+        # keep the default record size: the stream reader slices its
+        # whole buffer on every read, so a large bufsize costs O(n^2)
+        tf=tarfile.open(fn,'r|*')
+    except tarfile.ReadError:
+        tf=None
+    if tf is not None:
+        with contextlib.closing(tf):
+            for m in tf:
+                if m.isdir():
+                    kind='dir'
+                elif m.isfile():
+                    kind='file'
+                elif m.issym():
+                    kind='symlink'
+                elif m.islnk():
+                    kind='hardlink'
+                else:
+                    kind='other'
+                yield m.name, kind, m.mode, m.mtime, m.size, (tf.extractfile(m) if kind == 'file' else None), m.linkname
+            # tarfile stops quietly at the end of the data, so an archive cut
+            # at a member boundary looks complete; a real one still has the
+            # second of its two zero blocks left
+            if not tf.fileobj.read(tarfile.BLOCKSIZE):
+                raise ValueError(fn + " is truncated: the end of archive marker is missing.")
+        return
+    try:
+        zf=zipfile.ZipFile(fn,'r')
+    except (zipfile.BadZipfile, OSError):
+        raise ValueError(fn + " does not seem to be a tarball or a zip file.")
+    with contextlib.closing(zf):
+        for info in zf.infolist():
+            mode=(info.external_attr >> 16) & 0o7777
+            mtime=time.mktime(info.date_time + (0, 0, -1))
+            if info.filename.endswith('/'):
+                yield info.filename, 'dir', mode or 0o755, mtime, 0, None, ''
+            elif stat.S_ISLNK(info.external_attr >> 16):
+                yield info.filename, 'symlink', 0o777, mtime, 0, None, zf.read(info).decode('utf-8')
+            else:
+                with contextlib.closing(zf.open(info)) as f:
+                    yield info.filename, 'file', mode or 0o644, mtime, info.file_size, f, ''
+
+##################################################################
+#Function Name: safeMemberPath
+#Parameters:    name, strip
+#Purpose:       Return the relative path an archive member extracts
+#               to after dropping strip leading components, '' for
+#               the stripped top directory itself, or None if the
+#               member is absolute or climbs out with '..'
+#		@extractRelease
+##################################################################
+def safeMemberPath(name, strip=1):
+    name=name.replace('\\','/')
+    parts=[part for part in name.split('/') if part not in ('','.')]
+    if name.startswith('/') or '..' in parts:
+        return None
+    parts=parts[strip:]
+    if not parts:
+        return ''
+    return os.path.join(*parts)
+
+##################################################################
+#Function Name: writeMember
+#Parameters:    fileObject, target, policy, mtime, size, installed,
+#               stats
+#Purpose:       Write one archive member with its final owner and
+#               mode.  If installed is an identical copy of the member
+#               it is hard linked instead of written again.  The file
+#               is written under a temporary name and renamed, so an
+#               existing target is replaced rather than modified.
+#		@extractRelease
+##################################################################
+def writeMember(fileObject, target, policy, mtime, size, installed=None, stats=None, blockSize=1048576):
+    from .permissions import fixPermission
+    uid, gid, dirMode, fileMode=policy
+    buffered=[]
+    if installed is not None and os.path.isfile(installed) and not os.path.islink(installed) and os.path.getsize(installed) == size:
+        same=True
+        with open(installed,'rb') as f:
+            while True:
+                buf=fileObject.read(blockSize)
+                if not buf:
+                    break
+                buffered.append(buf)
+                if f.read(len(buf)) != buf:
+                    same=False
+                    break
+        if same:
+            try:
+                if os.path.lexists(target):
+                    os.remove(target)
+                os.link(installed, target)
+                fixPermission(target, os.lstat(target), policy, stats)
+                stats['linked'] += 1
+                stats['avoided'] += 1
+                return
+            except OSError:
+                # another file system: write the data we already have
+                pass
+    tmpName=os.path.join(os.path.dirname(target), '.tmp-'+os.path.basename(target))
+    fd=os.open(tmpName, os.O_WRONLY|os.O_CREAT|os.O_TRUNC, 0o600)
+    with os.fdopen(fd,'wb',blockSize) as f:
+        if uid is not None or gid is not None:
+            os.fchown(fd, -1 if uid is None else uid, -1 if gid is None else gid)
+        os.fchmod(fd, fileMode)
+        for buf in buffered:
+            f.write(buf)
+        shutil.copyfileobj(fileObject, f, blockSize)
+    os.utime(tmpName, (mtime, mtime))
+    os.rename(tmpName, target)
+    stats['files'] += 1
+    stats['written'] += 1
+    stats['bytes'] += size
+
+##################################################################
+#Function Name: extractRelease
+#Parameters:    fn, dst, rules, compareDir, strip
+#Purpose:       Extract a release archive into dst in a single pass,
+#               giving every member its final owner and mode from
+#               rules as it is written.  The top directory of the
+#               archive is stripped.  Members that are absolute or
+#               point outside dst are rejected, including members
+#               that would be written through a symbolic link the
+#               archive created.  With compareDir,
+#               files identical to the installed copy there are hard
+#               linked instead of rewritten.  With manifest (from
+#               newManifest), the size, SHA256 and mtime of every
+#               member is recorded for a later delta upgrade.
+#		@installInPlace, stageRelease
+##################################################################
+def extractRelease(fn, dst, rules={}, compareDir=None, strip=1, manifest=None):
+    from .permissions import fixPermission, overlayRule, resolvePermission
+    rules=dict((os.path.normpath(k), v) for k, v in rules.items())
+    dst=os.path.normpath(dst)
+    realDst=os.path.realpath(dst)
+    stats={'dirs':0, 'files':0, 'written':0, 'linked':0, 'bytes':0, 'changed':0, 'skipped':0, 'avoided':0, 'rejected':0, 'errors':0}
+    implicitDirs=[]
+
+    def makeParent(path):
+        parent=os.path.dirname(path)
+        if not os.path.isdir(parent):
+            makeParent(parent)
+            os.mkdir(parent, 0o700)
+            implicitDirs.append(parent)
+
+    if not os.path.isdir(dst):
+        os.makedirs(dst, 0o700)
+    fixPermission(dst, os.lstat(dst), overlayRule((None,None,0o755,None), resolvePermission(rules, dst)), stats)
+    for name, kind, mode, mtime, size, fileObject, linkName in archiveMembers(fn):
+        rel=safeMemberPath(name, strip)
+        if rel is None:
+            print("\trejecting unsafe archive member " + name)
+            stats['rejected'] += 1
+            continue
+        if rel == '':
+            continue
+        target=os.path.join(dst, rel)
+        if not insideTree(os.path.dirname(target), realDst):
+            print("\trejecting archive member below a symbolic link " + name)
+            stats['rejected'] += 1
+            continue
+        makeParent(target)
+        if kind == 'dir':
+            if not os.path.isdir(target):
+                os.mkdir(target, 0o700)
+            fixPermission(target, os.lstat(target), overlayRule((None,None,mode,None), resolvePermission(rules, target)), stats)
+            if manifest is not None:
+                manifest['dirs'].append(rel)
+        elif kind == 'file':
+            installed=os.path.join(compareDir, rel) if compareDir is not None else None
+            if manifest is not None:
+                fileObject=HashingReader(fileObject)
+            writeMember(fileObject, target, overlayRule((None,None,None,mode), resolvePermission(rules, target)), mtime, size, installed, stats)
+            if manifest is not None:
+                manifest['files'][rel]=[fileObject.size, fileObject.hash.hexdigest(), os.lstat(target).st_mtime]
+        elif kind == 'symlink':
+            if os.path.isabs(linkName) or not insideTree(os.path.join(os.path.dirname(target), linkName), realDst, False):
+                print("\trejecting unsafe symbolic link " + name + " -> " + linkName)
+                stats['rejected'] += 1
+                continue
+            if os.path.lexists(target):
+                os.remove(target)
+            os.symlink(linkName, target)
+            if manifest is not None:
+                manifest['symlinks'][rel]=linkName
+        elif kind == 'hardlink':
+            linkRel=safeMemberPath(linkName, strip)
+            if not linkRel or not insideTree(os.path.join(dst, linkRel), realDst, False):
+                print("\trejecting unsafe hard link " + name + " -> " + linkName)
+                stats['rejected'] += 1
+                continue
+            if os.path.lexists(target):
+                os.remove(target)
+            os.link(os.path.join(dst, linkRel), target)
+            if manifest is not None and linkRel in manifest['files']:
+                manifest['files'][rel]=manifest['files'][linkRel]
+    # directories the archive did not list get the rule's mode or 0755
+    for d in implicitDirs:
+        fixPermission(d, os.lstat(d), overlayRule((None,None,0o755,None), resolvePermission(rules, d)), stats)
+    return stats
+
+##################################################################
+#Class Name:    HashingReader
+#Purpose:       File object wrapper computing the size and SHA256 of
+#               what is read through it
+#		@extractRelease, applyDelta
+##################################################################
+class HashingReader(object):
+    def __init__(self, fileObject):
+        self.fileObject=fileObject
+        self.hash=hashlib.sha256()
+        self.size=0
+
+    def read(self, size=None):
+        # tar members read in stream mode do not accept a size of -1
+        buf=self.fileObject.read() if size is None or size < 0 else self.fileObject.read(size)
+        self.hash.update(buf)
+        self.size += len(buf)
+        return buf
+
+##################################################################
+#Function Name: newManifest
+#Parameters:    source, release
+#Purpose:       Return an empty manifest of an installed tree: the
+#               size, SHA256 and mtime of each file, its directories
+#               and symbolic links.  source is 'release' when it lists
+#               exactly what a release archive installed, 'scan' when
+#               it was built from the files found on disk.
+#		@installInPlace, stageRelease, applyDelta, scanManifest
+##################################################################
+def newManifest(source='release', release=None):
+    return {'source':source, 'release':release, 'time':time.time(), 'files':{}, 'dirs':[], 'symlinks':{}}
+
+##################################################################
+#Function Name: manifestFileName
+#Parameters:    stateDir, ocDir
+#Purpose:       Return the manifest file of the code in ocDir
+#		@installInPlace, installStaged, installDelta
+##################################################################
+def manifestFileName(stateDir, ocDir):
+    return os.path.join(stateDir, 'manifests', hashlib.sha1(os.fsencode(os.path.normpath(ocDir))).hexdigest()[:16]+'.json')
+
+##################################################################
+#Function Name: loadManifest
+#Parameters:    fileName
+#Purpose:       Return a saved manifest, or None
+#		@installDelta
+##################################################################
+def loadManifest(fileName):
+    try:
+        with open(fileName) as f:
+            manifest=json.load(f)
+    except (IOError, ValueError):
+        return None
+    if not all(k in manifest for k in ('source', 'files', 'dirs', 'symlinks')):
+        return None
+    return manifest
+
+##################################################################
+#Function Name: saveManifest
+#Parameters:    fileName, manifest
+#Purpose:       Atomically replace the saved manifest
+#		@installInPlace, installStaged, installDelta
+##################################################################
+def saveManifest(fileName, manifest):
+    from .download import atomicWrite
+    try:
+        if not os.path.isdir(os.path.dirname(fileName)):
+            os.makedirs(os.path.dirname(fileName), 0o700)
+        atomicWrite(fileName, json.dumps(manifest, sort_keys=True).encode("utf-8"))
+    except OSError as e:
+        print("Error:  %s - %s." % (e.filename,e.strerror))
+
+##################################################################
+#Function Name: protectedPaths
+#Parameters:    ocDir, dataPath
+#Purpose:       Return a function telling whether a path relative to
+#               ocDir belongs to the instance rather than the release:
+#               config.php, other *.config.php files and the data
+#               directory.  A delta upgrade never writes or deletes
+#               these.
+#		@installDelta
+##################################################################
+def protectedPaths(ocDir, dataPath):
+    relData=None
+    if dataPath is not None and isBelow(dataPath, ocDir):
+        relData=os.path.relpath(os.path.realpath(dataPath), os.path.realpath(ocDir))
+
+    def isProtected(rel):
+        if relData is not None and (rel == relData or rel.startswith(relData+os.sep)):
+            return True
+        return os.path.dirname(rel) == 'config' and (rel.endswith('.config.php') or os.path.basename(rel) == 'config.php')
+    return isProtected
+
+##################################################################
+#Function Name: scanManifest
+#Parameters:    ocDir, isProtected
+#Purpose:       Build a manifest of the installed code by hashing it,
+#               for the first delta upgrade of an instance
+#		@installDelta
+##################################################################
+def scanManifest(ocDir, isProtected):
+    from .backup import fileDigest
+    manifest=newManifest('scan')
+    for dirPath, dirNames, fileNames in os.walk(ocDir):
+        for name in list(dirNames):
+            rel=os.path.relpath(os.path.join(dirPath, name), ocDir)
+            if isProtected(rel):
+                dirNames.remove(name)
+            elif os.path.islink(os.path.join(dirPath, name)):
+                manifest['symlinks'][rel]=os.readlink(os.path.join(dirPath, name))
+            else:
+                manifest['dirs'].append(rel)
+        for name in fileNames:
+            fullPath=os.path.join(dirPath, name)
+            rel=os.path.relpath(fullPath, ocDir)
+            if isProtected(rel):
+                continue
+            if os.path.islink(fullPath):
+                manifest['symlinks'][rel]=os.readlink(fullPath)
+            elif os.path.isfile(fullPath):
+                # stat first: a file changed while it is hashed then looks modified
+                st=os.stat(fullPath)
+                manifest['files'][rel]=[st.st_size, fileDigest(fullPath, 'sha256'), st.st_mtime]
+    return manifest
+
+##################################################################
+#Function Name: applyDelta
+#Parameters:    fn, ocDir, rules, old, isProtected, undoDir, journal,
+#               strip
+#Purpose:       Bring the code in ocDir from the release described by
+#               manifest old to the release archive fn.  Files whose
+#               size and SHA256 are unchanged and that still have the
+#               size and mtime old recorded (or the same SHA256, for
+#               manifests without mtimes) are not touched, permissions
+#               included; new and changed
+#               files are written under a temporary name and renamed.
+#               Files of the old release missing from the new one are
+#               removed, but only if old lists a release (not a scan
+#               of the disk, which also holds apps added later) and
+#               the file was not modified locally.  Replaced and
+#               removed files are kept in undoDir and every step is
+#               noted in journal for undoDelta.  Returns the stats and
+#               the manifest of the new release.
+#		@installDelta
+##################################################################
+def applyDelta(fn, ocDir, rules, old, isProtected, undoDir, journal, strip=1):
+    from .backup import fileDigest
+    from .permissions import fixPermission, overlayRule, resolvePermission
+    rules=dict((os.path.normpath(k), v) for k, v in rules.items())
+    ocDir=os.path.normpath(ocDir)
+    realOcDir=os.path.realpath(ocDir)
+    stats={'dirs':0, 'files':0, 'written':0, 'linked':0, 'bytes':0, 'unchanged':0, 'removed':0, 'kept':0,
+           'changed':0, 'skipped':0, 'avoided':0, 'rejected':0, 'errors':0}
+    manifest=newManifest('release', os.path.basename(fn))
+
+    def makeParent(path):
+        parent=os.path.dirname(path)
+        if not os.path.isdir(parent):
+            makeParent(parent)
+            os.mkdir(parent, 0o700)
+            journal['added'].append(parent)
+            fixPermission(parent, os.lstat(parent), overlayRule((None,None,0o755,None), resolvePermission(rules, parent)), stats)
+
+    def setAside(rel, target):
+        # keep the installed version of rel in undoDir
+        saved=os.path.join(undoDir, rel)
+        if not os.path.isdir(os.path.dirname(saved)):
+            os.makedirs(os.path.dirname(saved), 0o700)
+        os.link(target, saved)
+        journal['saved'].append(rel)
+
+    def replace(rel, target):
+        if os.path.lexists(target) and not os.path.isdir(target) or os.path.islink(target):
+            setAside(rel, target)
+            os.remove(target)
+        elif not os.path.lexists(target):
+            journal['added'].append(target)
+
+    for name, kind, mode, mtime, size, fileObject, linkName in archiveMembers(fn):
+        rel=safeMemberPath(name, strip)
+        if rel is None:
+            print("\trejecting unsafe archive member " + name)
+            stats['rejected'] += 1
+            continue
+        if rel == '' or isProtected(rel):
+            continue
+        target=os.path.join(ocDir, rel)
+        if not insideTree(os.path.dirname(target), realOcDir):
+            print("\trejecting archive member below a symbolic link " + name)
+            stats['rejected'] += 1
+            continue
+        if kind == 'dir':
+            manifest['dirs'].append(rel)
+            if not os.path.isdir(target):
+                makeParent(target)
+                replace(rel, target)
+                os.mkdir(target, 0o700)
+                fixPermission(target, os.lstat(target), overlayRule((None,None,mode,None), resolvePermission(rules, target)), stats)
+        elif kind == 'file':
+            reader=HashingReader(fileObject)
+            data=reader.read()
+            entry=[reader.size, reader.hash.hexdigest()]
+            try:
+                st=os.lstat(target)
+            except OSError:
+                st=None
+            oldEntry=old['files'].get(rel)
+            if oldEntry is not None and oldEntry[:2] == entry and st is not None and stat.S_ISREG(st.st_mode) and st.st_size == entry[0] and \
+               (st.st_mtime == oldEntry[2] if len(oldEntry) > 2 else fileDigest(target, 'sha256') == entry[1]):
+                manifest['files'][rel]=entry+[st.st_mtime]
+                stats['unchanged'] += 1
+                stats['avoided'] += 1
+                continue
+            makeParent(target)
+            if st is not None and stat.S_ISREG(st.st_mode):
+                # writeMember renames over the target; the saved link keeps the old data
+                setAside(rel, target)
+            elif st is not None:
+                replace(rel, target)
+            else:
+                journal['added'].append(target)
+            writeMember(io.BytesIO(data), target, overlayRule((None,None,None,mode), resolvePermission(rules, target)), mtime, entry[0], None, stats)
+            manifest['files'][rel]=entry+[os.lstat(target).st_mtime]
+        elif kind == 'symlink':
+            if os.path.isabs(linkName) or not insideTree(os.path.join(os.path.dirname(target), linkName), realOcDir, False):
+                print("\trejecting unsafe symbolic link " + name + " -> " + linkName)
+                stats['rejected'] += 1
+                continue
+            manifest['symlinks'][rel]=linkName
+            if os.path.islink(target) and os.readlink(target) == linkName:
+                stats['unchanged'] += 1
+                continue
+            makeParent(target)
+            replace(rel, target)
+            os.symlink(linkName, target)
+        elif kind == 'hardlink':
+            linkRel=safeMemberPath(linkName, strip)
+            if not linkRel or isProtected(linkRel) or not insideTree(os.path.join(ocDir, linkRel), realOcDir, False):
+                print("\trejecting unsafe hard link " + name + " -> " + linkName)
+                stats['rejected'] += 1
+                continue
+            if linkRel in manifest['files']:
+                manifest['files'][rel]=manifest['files'][linkRel]
+            makeParent(target)
+            replace(rel, target)
+            os.link(os.path.join(ocDir, linkRel), target)
+
+    if old['source'] != 'release':
+        return stats, manifest
+    # files and directories the new release dropped
+    for rel in sorted(set(old['files']) | set(old['symlinks'])):
+        if rel in manifest['files'] or rel in manifest['symlinks'] or isProtected(rel):
+            continue
+        target=os.path.join(ocDir, rel)
+        if not os.path.lexists(target):
+            continue
+        if rel in old['files'] and (os.path.islink(target) or not os.path.isfile(target) or
+                                    [os.path.getsize(target), fileDigest(target, 'sha256')] != old['files'][rel][:2]):
+            print("\tkeeping locally modified " + rel)
+            stats['kept'] += 1
+            continue
+        setAside(rel, target)
+        os.remove(target)
+        stats['removed'] += 1
+    for rel in sorted(set(old['dirs']) - set(manifest['dirs']), reverse=True):
+        target=os.path.join(ocDir, rel)
+        if isProtected(rel) or os.path.islink(target) or not os.path.isdir(target):
+            continue
+        try:
+            os.rmdir(target)
+            journal['removedDirs'].append(rel)
+        except OSError:
+            # still holds files that are not part of the release
+            pass
+    return stats, manifest
+
+##################################################################
+#Function Name: undoDelta
+#Parameters:    ocDir, undoDir, journal
+#Purpose:       Put back what applyDelta changed, from its journal and
+#               the files it kept in undoDir
+#		@installDelta
+##################################################################
+def undoDelta(ocDir, undoDir, journal):
+    for rel in journal['removedDirs'][::-1]:
+        if not os.path.isdir(os.path.join(ocDir, rel)):
+            os.makedirs(os.path.join(ocDir, rel))
+    for path in journal['added'][::-1]:
+        if os.path.islink(path) or os.path.isfile(path):
+            os.remove(path)
+        elif os.path.isdir(path):
+            shutil.rmtree(path, True)
+    for rel in journal['saved']:
+        saved=os.path.join(undoDir, rel)
+        if os.path.lexists(saved):
+            target=os.path.join(ocDir, rel)
+            if not os.path.isdir(os.path.dirname(target)):
+                os.makedirs(os.path.dirname(target))
+            os.rename(saved, target)
+    shutil.rmtree(undoDir, True)
+
+##################################################################
+#Function Name: insideTree
+#Parameters:    path, realRoot, orRoot
+#Purpose:       Check whether path, with every symbolic link in it
+#               resolved, is the directory realRoot (when orRoot) or
+#               lies below it.  realRoot must already be a real path.
+#               Checking each member this way stops an archive from
+#               writing outside the tree through links it created
+#               itself, however their targets are spelled.
+#		@extractRelease, applyDelta
+##################################################################
+def insideTree(path, realRoot, orRoot=True):
+    path=os.path.realpath(path)
+    return orRoot and path == realRoot or path.startswith(realRoot+os.sep)
+
+##################################################################
+#Function Name: isBelow
+#Parameters:    path, parent
+#Purpose:       Check whether path lies inside the directory parent
+#		@stageRelease, swapCode
+##################################################################
+def isBelow(path, parent):
+    path=os.path.realpath(path)
+    parent=os.path.realpath(parent)
+    return path.startswith(parent+os.sep)
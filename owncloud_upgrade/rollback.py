@@ -0,0 +1,194 @@
+#*******************************************************************************
+#*******************************************************************************
+# 
+#                      COPYRIGHT (c) 2015, James Sinton
+#                             ALL RIGHTS RESERVED
+# 
+#  This library is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+# 
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with this library; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# 
+#   DESCRIPTION
+#      Restores the code and database from a backup
+# 
+#********************************************************************************
+#********************************************************************************
+
+import errno
+import os
+import shutil
+import stat
+import subprocess
+import time
+
+from .metrics import phase
+from .commands import askYesorNo, runCommand
+
+##################################################################
+#Function Name: selectBackup
+#Parameters:    backupRoot, which
+#Purpose:       Return the newest backup with both code and database
+#               whose time, version or file name is which, or the
+#               newest of all when which is 'latest'
+#		@rollback
+##################################################################
+def selectBackup(backupRoot, which='latest'):
+    from .backup import findBackups
+    for backup in reversed(findBackups(backupRoot)):
+        if backup['code'] is None or backup['db'] is None:
+            continue
+        names=[backup['time'], backup['version'], os.path.basename(backup['code']), os.path.basename(backup['db'])]
+        if which == 'latest' or os.path.basename(os.path.normpath(which)) in names:
+            return backup
+    return None
+
+##################################################################
+#Function Name: unshareFile
+#Parameters:    path
+#Purpose:       Replace a hard linked file by a copy of its own, so
+#               writing to it leaves the other links alone
+#		@cloneBackup
+##################################################################
+def unshareFile(path):
+    from .backup import copyFile
+    st=os.lstat(path)
+    if not stat.S_ISREG(st.st_mode) or st.st_nlink < 2:
+        return
+    tmpName=os.path.join(os.path.dirname(path), '.tmp-'+os.path.basename(path))
+    copyFile(path, tmpName, st, (st.st_uid, st.st_gid, None, stat.S_IMODE(st.st_mode)))
+    os.rename(tmpName, path)
+
+##################################################################
+#Function Name: cloneBackup
+#Parameters:    configDict, backupDir, cloneDir
+#Purpose:       Make cloneDir a copy of a code backup that hard links
+#               the files owned by root instead of copying them.  The
+#               trees the web server owns (apps/, config/, themes/)
+#               and the files ownCloud writes in place (.htaccess,
+#               .user.ini) get copies of their own, so an app update
+#               or a config change cannot alter the backup, and a
+#               stale copy of a data directory inside the code is
+#               left out.
+#		@rollback
+##################################################################
+def cloneBackup(configDict, backupDir, cloneDir):
+    from .backup import backupTree
+    from .permissions import permissionRules
+    from .release import isBelow
+    rules=permissionRules(cloneDir,configDict['wwwUser'],None)
+    stats=backupTree(backupDir,cloneDir,backupDir,rules,False,configDict['jobs'],linkWritable=False)
+    if stats['errors']:
+        raise OSError(errno.EIO, "%d files could not be cloned" % stats['errors'], backupDir)
+    ocDir=os.path.normpath(configDict['ocDir'])
+    if configDict['dataPath'] is not None and isBelow(configDict['dataPath'],ocDir):
+        relData=os.path.relpath(os.path.realpath(configDict['dataPath']),os.path.realpath(ocDir))
+        shutil.rmtree(os.path.join(cloneDir,relData),True)
+    for name in ('.htaccess', '.user.ini'):
+        if os.path.isfile(os.path.join(cloneDir,name)):
+            unshareFile(os.path.join(cloneDir,name))
+    return stats
+
+##################################################################
+#Function Name: rollback
+#Parameters:    configDict, which
+#Purpose:       Restore the code and database of ownCloud from a
+#               backup pair made by backupOC.  The code is hard link
+#               cloned from the backup and swapped in with a rename;
+#               the dump is streamed into mysql through a parallel
+#               decompressor without a temporary file.  The delta
+#               manifest of the replaced release is deleted, so the
+#               next --delta upgrade hashes the restored code.
+#		@main
+##################################################################
+def rollback(configDict, which='latest'):
+    from .database import restoreDB
+    from .install import swapCode
+    from .php import getOCconfig
+    from .release import manifestFileName
+    start=time.time()
+    backup=selectBackup(configDict['backupRoot'],which)
+    if backup is None:
+        print("Error:  no backup with both code and database matching %s was found in %s" % (which, configDict['backupRoot']))
+        return False
+    print("\n")
+    print("Rolling back to ownCloud %s from the backup of %s" % (backup['version'], backup['time']))
+    print("\tcode:     " + backup['code'])
+    print("\tdatabase: " + backup['db'])
+    try:
+        configDict=getOCconfig(configDict)
+    except (OSError, ValueError, KeyError):
+        # the installed code may be what is broken; its backup has the same settings
+        liveDir=configDict['ocDir']
+        configDict['ocDir']=backup['code']
+        configDict=getOCconfig(configDict)
+        configDict['ocDir']=liveDir
+    question="This replaces the code in "+configDict['ocDir']+" and the database "+configDict['ocDB']+". Do you want to roll back?"
+    if askYesorNo(question,"no",configDict['assumeYes']) != "yes":
+        return False
+
+    ocDir=os.path.normpath(configDict['ocDir'])
+    cloneDir=ocDir+'.rollback_'+configDict['backupTime']
+    print("\n")
+    print("Cloning the code backup . . .")
+    try:
+        with phase(configDict,'codeClone') as m:
+            stats=cloneBackup(configDict,backup['code'],cloneDir)
+            m.update(files=stats['linked']+stats['copied'], bytes=stats['bytes'], syscallsAvoided=stats['avoided'])
+    except OSError as e:
+        print("Error:  %s" % e)
+        shutil.rmtree(cloneDir,True)
+        return False
+    print("\t%(linked)d files linked, %(copied)d copied" % stats)
+
+    print("\n")
+    print("Stopping web server")
+    cmd = ['sudo','service','apache2', 'stop']
+    with phase(configDict,'apacheStop'):
+        runCommand(configDict,cmd)
+
+    restored=True
+    try:
+        with phase(configDict,'dbRestore') as m:
+            dbStats=restoreDB(configDict,backup['db'])
+            m.update(bytes=dbStats['bytesIn'])
+    except (OSError, ValueError, subprocess.CalledProcessError) as e:
+        print("Error:  the database could not be restored - %s" % e)
+        restored=False
+
+    if restored:
+        print("\n")
+        print("Switching to the backed up code . . .")
+        with phase(configDict,'swap'):
+            configDict['previousCode']=swapCode(ocDir,cloneDir,configDict['dataPath'],configDict['backupTime'])
+        print("\tthe code that was replaced is kept in " + configDict['previousCode'])
+        manifestFile=manifestFileName(configDict['stateDir'],ocDir)
+        if os.path.exists(manifestFile):
+            os.remove(manifestFile)
+    else:
+        shutil.rmtree(cloneDir,True)
+
+    print("\n")
+    print("Starting web server")
+    cmd = ['sudo','service','apache2', 'start']
+    with phase(configDict,'apacheStart'):
+        runCommand(configDict,cmd)
+    if not restored:
+        return False
+
+    # the backup was taken in maintenance mode
+    print("Taking owncloud online")
+    cmd = ['sudo','-u',configDict['wwwUser'], configDict['php'], ocDir+'/occ', 'maintenance:mode', '--off']
+    with phase(configDict,'maintenanceOff'):
+        runCommand(configDict,cmd)
+    print("Rolled back to ownCloud %s in %.1f s" % (backup['version'], time.time()-start))
+    return True
@@ -0,0 +1,234 @@
+#*******************************************************************************
+#*******************************************************************************
+# 
+#                      COPYRIGHT (c) 2015, James Sinton
+#                             ALL RIGHTS RESERVED
+# 
+#  This library is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+# 
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with this library; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# 
+#   DESCRIPTION
+#      Asks the ownCloud updater whether a new release is available
+# 
+#********************************************************************************
+#********************************************************************************
+
+import json
+import os
+import threading
+import time
+
+##################################################################
+#Function Name: parseUpdateXML
+#Parameters:    data
+#Purpose:       Return the updateVersionString, updateURL and web
+#               instructions of an updater.php answer; all are None
+#               when no update is offered.  Raises ValueError when
+#               data is not XML.
+#		@UpdateChecker
+##################################################################
+def parseUpdateXML(data):
+    import xml.etree.ElementTree as ET
+    update={'updateVersionString':None, 'updateURL':None, 'web':None}
+    if not data.strip():
+        return update
+    try:
+        xml = ET.fromstring(data)
+    except ET.ParseError as e:
+        raise ValueError("the updater did not answer with XML: %s" % e)
+    for key, tag in (('updateVersionString','versionstring'), ('updateURL','url'), ('web','web')):
+        for element in xml.iter(tag):
+            if element.text is not None:
+                update[key]=element.text
+    return update
+
+##################################################################
+#Class Name:    UpdateChecker
+#Purpose:       Ask the updater whether a newer release exists for
+#               installed versions.  Answers are cached per version in
+#               the state directory for ttl seconds and requests for
+#               the same version made at the same time are merged, so
+#               a fleet costs one request per distinct version.
+#		@checkUpdate, runFleet
+##################################################################
+class UpdateChecker(object):
+    def __init__(self, updater, cacheDir, ttl=3600, timeout=10, retries=3):
+        self.updater=updater
+        self.cacheDir=cacheDir
+        self.ttl=ttl
+        self.timeout=timeout
+        self.retries=retries
+        self.lock=threading.Lock()
+        self.pending={}
+        self.answers={}
+        self.failures={}
+
+    def key(self, ocVersion):
+        # Exmample url syntax to query owncloud.com for update:
+        # https://apps.owncloud.com/updater.php?version=8x0x6x2xxxstablexx
+        return 'x'.join([str(i) for i in ocVersion]) + 'xxxstablexx'
+
+    def url(self, ocVersion):
+        return self.updater + '?version=' + self.key(ocVersion)
+
+    def cached(self, key):
+        entry=self.answers.get(key)
+        if entry is None and self.cacheDir is not None:
+            entry=self.readCache().get(key)
+        if entry is not None and 0 <= time.time()-entry['time'] < self.ttl:
+            return entry
+        return None
+
+    def readCache(self):
+        try:
+            with open(os.path.join(self.cacheDir,'updates.json')) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def store(self, key, entry):
+        from .download import atomicWrite, cacheLock
+        self.answers[key]=entry
+        if self.cacheDir is None:
+            return
+        try:
+            if not os.path.isdir(self.cacheDir):
+                os.makedirs(self.cacheDir, 0o700)
+            with cacheLock(self.cacheDir, True):
+                entries=self.readCache()
+                entries[key]=entry
+                now=time.time()
+                entries=dict((k, e) for k, e in entries.items() if 0 <= now-e['time'] < self.ttl)
+                atomicWrite(os.path.join(self.cacheDir,'updates.json'), json.dumps(entries, indent=2, sort_keys=True).encode("utf-8"))
+        except OSError as e:
+            print("Error:  %s - %s." % (e.filename,e.strerror))
+
+    def fetch(self, key):
+        # imported here: an answer from the cache needs no network code
+        import http.client, urllib.error, urllib.request
+        url=self.updater + '?version=' + key
+        for attempt in range(self.retries):
+            try:
+                response=urllib.request.urlopen(url, timeout=self.timeout)
+                try:
+                    return parseUpdateXML(response.read())
+                finally:
+                    response.close()
+            except urllib.error.HTTPError as e:
+                # the updater answered; only server errors are worth a retry
+                if e.code < 500 or attempt+1 == self.retries:
+                    raise
+            except http.client.HTTPException as e:
+                if attempt+1 == self.retries:
+                    raise IOError("bad answer from %s: %r" % (self.updater, e))
+            except IOError:
+                if attempt+1 == self.retries:
+                    raise
+            time.sleep(0.5*2**attempt)
+
+    def check(self, ocVersion):
+        key=self.key(ocVersion)
+        with self.lock:
+            entry=self.cached(key)
+            if entry is not None:
+                return dict(entry, cached=True)
+            waiting=self.pending.get(key)
+            if waiting is None:
+                waiting=self.pending[key]=threading.Event()
+                owner=True
+            else:
+                owner=False
+        if not owner:
+            waiting.wait()
+            with self.lock:
+                entry=self.answers.get(key)
+                failure=self.failures.get(key)
+            if entry is None:
+                # the request we waited for failed
+                raise failure
+            return dict(entry, cached=True)
+        try:
+            entry=dict(self.fetch(key), time=time.time())
+            with self.lock:
+                self.store(key, entry)
+                self.failures.pop(key, None)
+            return dict(entry, cached=False)
+        except (IOError, ValueError) as e:
+            with self.lock:
+                self.failures[key]=e
+            raise
+        finally:
+            with self.lock:
+                del self.pending[key]
+            waiting.set()
+
+    def checkMany(self, versions, jobs=8):
+        # distinct versions are asked for at once; errors are left for check
+        def quietCheck(ocVersion):
+            try:
+                self.check(ocVersion)
+            except (IOError, ValueError):
+                pass
+        versions=list(dict((self.key(v), v) for v in versions).values())
+        if not versions:
+            return
+        from multiprocessing.pool import ThreadPool
+        pool=ThreadPool(max(1, min(jobs, len(versions))))
+        try:
+            pool.map(quietCheck, versions)
+        finally:
+            pool.close()
+            pool.join()
+
+##################################################################
+#Function Name: updateChecker
+#Parameters:    configDict
+#Purpose:       Return the UpdateChecker of configDict, creating it
+#               on first use
+#		@checkUpdate
+##################################################################
+def updateChecker(configDict):
+    if configDict['updateChecker'] is None:
+        cacheDir=os.path.join(configDict['stateDir'],'updates') if configDict['updateTTL'] > 0 else None
+        configDict['updateChecker']=UpdateChecker(configDict['updater'],cacheDir,configDict['updateTTL'])
+    return configDict['updateChecker']
+
+##################################################################
+#Function Name: checkUpdate
+#Parameters:    configDict
+#Purpose:       check if an update is available
+#		@main
+##################################################################
+def checkUpdate(configDict):
+    checker=updateChecker(configDict)
+    print('\nChecking to see if an update is available using:\n\t' + checker.url(configDict['ocVersion']))
+    configDict['updateIsAvailable'] = False
+    try:
+        update=checker.check(configDict['ocVersion'])
+    except (IOError, ValueError) as e:
+        print("Error:  could not check for an update - %s" % e)
+        return configDict
+    if update['cached']:
+        print("\tanswer cached %d seconds ago" % (time.time()-update['time']))
+    if update['updateVersionString'] is not None:
+        configDict['updateVersionString']=update['updateVersionString']
+        print("\t" + update['updateVersionString'] + " is available.")
+    if update['updateURL'] is not None:
+        print("\tCode:\t\t" + update['updateURL'])
+        configDict['updateURL']=update['updateURL']
+        configDict['updateIsAvailable'] = True
+    if update['web'] is not None:
+        print("\tInstructions:\t" + update['web'])
+
+    return configDict
@@ -0,0 +1,268 @@
+#*******************************************************************************
+#*******************************************************************************
+# 
+#                      COPYRIGHT (c) 2015, James Sinton
+#                             ALL RIGHTS RESERVED
+# 
+#  This library is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+# 
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with this library; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# 
+#   DESCRIPTION
+#      Shared fixtures of the test suite: a local release server and
+#      stub commands put on PATH in place of mysql, sudo and friends
+# 
+#********************************************************************************
+#********************************************************************************
+
+import http.server
+import io
+import os
+import re
+import shutil
+import stat
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import unittest
+
+# the tests import the package from the checkout they belong to
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+##################################################################
+#Class Name:    ReleaseServer
+#Purpose:       HTTP server on 127.0.0.1 serving the bytes in files.
+#               Paths in noRange ignore Range headers, paths in
+#               noLength are sent without Content-Length, and the
+#               next failures[path] downloads of a path stop halfway.
+#               Every answer waits delay seconds and every request is
+#               noted in requests as (path, range).
+#		@tests
+##################################################################
+class ReleaseServer(object):
+    def __init__(self):
+        self.files={}
+        self.noRange=set()
+        self.noLength=set()
+        self.failures={}
+        self.delay=0
+        self.requests=[]
+        self.lock=threading.Lock()
+        server=self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version='HTTP/1.0'
+
+            def do_GET(self):
+                path=self.path.split('?')[0]
+                rangeHeader=self.headers.get('Range')
+                with server.lock:
+                    server.requests.append((path, rangeHeader))
+                    data=server.files.get(path)
+                    # the one byte probe of probeDownload never fails
+                    fail=data is not None and rangeHeader != 'bytes=0-0' and server.failures.get(path, 0) > 0
+                    if fail:
+                        server.failures[path] -= 1
+                time.sleep(server.delay)
+                if data is None:
+                    self.send_error(404)
+                    return
+                start, end=0, len(data)
+                if rangeHeader and path not in server.noRange:
+                    m=re.match(r'bytes=(\d+)-(\d*)$', rangeHeader)
+                    start=int(m.group(1))
+                    end=int(m.group(2))+1 if m.group(2) else len(data)
+                    self.send_response(206)
+                    self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end-1, len(data)))
+                else:
+                    self.send_response(200)
+                if path not in server.noLength:
+                    self.send_header('Content-Length', str(end-start))
+                self.end_headers()
+                if fail:
+                    end=start+(end-start)//2
+                self.wfile.write(data[start:end])
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd=http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads=True
+        self.thread=threading.Thread(target=self.httpd.serve_forever, args=(0.05,))
+        self.thread.daemon=True
+        self.thread.start()
+
+    def url(self, path):
+        return 'http://127.0.0.1:%d%s' % (self.httpd.server_address[1], path)
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+##################################################################
+#Function Name: writeStub
+#Parameters:    binDir, name, script
+#Purpose:       Write an executable shell script called name into
+#               binDir
+#		@tests
+##################################################################
+def writeStub(binDir, name, script):
+    fileName=os.path.join(binDir, name)
+    with open(fileName, 'w') as f:
+        f.write('#!/bin/sh\n' + script)
+    os.chmod(fileName, os.stat(fileName).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return fileName
+
+##################################################################
+#Class Name:    TempDirTestCase
+#Purpose:       Test case running in a fresh temporary directory,
+#               self.tmp, removed afterwards
+#		@tests
+##################################################################
+class TempDirTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp=tempfile.mkdtemp(prefix='owncloud-upgrade-test-')
+        self.addCleanup(shutil.rmtree, self.tmp, True)
+
+    def path(self, *parts):
+        return os.path.join(self.tmp, *parts)
+
+    def writeFile(self, rel, data, mode=0o644):
+        fileName=self.path(rel)
+        if not os.path.isdir(os.path.dirname(fileName)):
+            os.makedirs(os.path.dirname(fileName))
+        with open(fileName, 'wb' if isinstance(data, bytes) else 'w') as f:
+            f.write(data)
+        os.chmod(fileName, mode)
+        return fileName
+
+    def readFile(self, rel):
+        with open(self.path(rel), 'rb') as f:
+            return f.read()
+
+##################################################################
+#Function Name: versionPHP
+#Parameters:    version
+#Purpose:       Return a version.php for the version tuple
+#		@makeInstance, makeRelease
+##################################################################
+def versionPHP(version):
+    return "<?php\n$OC_Version = array(%s);\n$OC_VersionString = '%s';\n" % (','.join(str(v) for v in version), '.'.join(str(v) for v in version[:3]))
+
+##################################################################
+#Function Name: makeInstance
+#Parameters:    root, version, dbName
+#Purpose:       Create a small ownCloud instance below root: the code
+#               in root/www/owncloud and a data directory next to it.
+#               Returns the configDict keys that point at it.
+#		@tests
+##################################################################
+def makeInstance(root, version=(9,0,0,1), dbName='owncloud'):
+    ocDir=os.path.join(root, 'www', 'owncloud')
+    dataPath=os.path.join(root, 'www', 'data')
+    files={'version.php':versionPHP(version),
+           'config/config.php':"<?php\n$CONFIG = array('datadirectory' => '%s', 'dbname' => '%s', 'dbuser' => 'oc', 'dbpassword' => 'secret');\n" % (dataPath, dbName),
+           'occ':'<?php // occ\n',
+           'index.php':'<?php // %s\n' % (version,),
+           'lib/base.php':'<?php // base %s\n' % (version,),
+           'apps/files/appinfo/info.xml':'<info/>\n'}
+    for rel, data in files.items():
+        fileName=os.path.join(ocDir, rel)
+        if not os.path.isdir(os.path.dirname(fileName)):
+            os.makedirs(os.path.dirname(fileName))
+        with open(fileName, 'w') as f:
+            f.write(data)
+    os.makedirs(os.path.join(dataPath, 'alice', 'files'))
+    with open(os.path.join(dataPath, 'alice', 'files', 'notes.txt'), 'w') as f:
+        f.write('notes\n')
+    return {'wwwRoot':os.path.join(root, 'www'), 'ocDir':ocDir, 'dataPath':dataPath,
+            'backupRoot':os.path.join(root, 'backup'), 'ocDB':dbName}
+
+##################################################################
+#Function Name: makeRelease
+#Parameters:    fileName, version
+#Purpose:       Write a release tarball of the version with an
+#               owncloud/ top directory
+#		@tests
+##################################################################
+def makeRelease(fileName, version=(9,0,1,2)):
+    files={'version.php':versionPHP(version),
+           'occ':'<?php // occ\n',
+           'index.php':'<?php // %s\n' % (version,),
+           'lib/base.php':'<?php // base %s\n' % (version,),
+           'apps/files/appinfo/info.xml':'<info/>\n'}
+    with tarfile.open(fileName, 'w:gz') as tar:
+        for d in ('owncloud', 'owncloud/config', 'owncloud/lib', 'owncloud/apps', 'owncloud/apps/files', 'owncloud/apps/files/appinfo'):
+            info=tarfile.TarInfo(d)
+            info.type=tarfile.DIRTYPE
+            info.mode=0o755
+            tar.addfile(info)
+        for rel, data in sorted(files.items()):
+            data=data.encode()
+            info=tarfile.TarInfo('owncloud/'+rel)
+            info.size=len(data)
+            info.mode=0o644
+            tar.addfile(info, io.BytesIO(data))
+    return fileName
+
+##################################################################
+#Class Name:    StubCommandsTestCase
+#Purpose:       Test case with stub sudo, php, mysql, mysqldump and
+#               service commands first on PATH.  Each call is
+#               appended to self.commandLog; mysql keeps what it is
+#               fed in self.path('mysql.in').  Set self.failDump to
+#               make mysqldump fail after writing part of a dump.
+#		@tests
+##################################################################
+class StubCommandsTestCase(TempDirTestCase):
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        binDir=self.path('bin')
+        os.mkdir(binDir)
+        self.commandLog=self.path('commands.log')
+        log='echo "$(basename "$0") $*" >> %s\n' % self.commandLog
+        writeStub(binDir, 'sudo', '[ "$1" = "-u" ] && shift 2\nexec "$@"\n')
+        self.php=writeStub(binDir, 'php', log)
+        writeStub(binDir, 'service', log)
+        writeStub(binDir, 'mysql', log + 'case "$*" in *-e*) printf \'oc_filecache\\noc_users\\n\'; exit 0;; esac\ncat >> %s\n' % self.path('mysql.in'))
+        writeStub(binDir, 'mysqldump', log + 'for a; do db=$a; done\necho "-- dump of $db"\nseq 1 2000 | sed "s/.*/INSERT INTO t VALUES(&);/"\n[ -e %s ] && { echo "lost connection" >&2; exit 2; }\nexit 0\n' % self.path('fail-dump'))
+        path=os.environ.get('PATH', os.defpath)
+        os.environ['PATH']=binDir + os.pathsep + path
+        self.addCleanup(os.environ.__setitem__, 'PATH', path)
+
+    def failDump(self):
+        open(self.path('fail-dump'), 'w').close()
+
+    def commands(self):
+        if not os.path.exists(self.commandLog):
+            return []
+        with open(self.commandLog) as f:
+            return f.read().splitlines()
+
+    def instanceConfig(self, name='instance', **kwargs):
+        # the instance is created by the first call for its name
+        from owncloud_upgrade.config import getConfig
+        if not hasattr(self, 'instances'):
+            self.instances={}
+        if name not in self.instances:
+            self.instances[name]=makeInstance(self.path(name))
+        configDict=getConfig()
+        configDict.update(self.instances[name])
+        # one second apart, so each run gets backups of its own
+        self.runs=getattr(self, 'runs', 0)+1
+        configDict['backupTime']='2015-06-01_1200%02d' % self.runs
+        configDict.update(php=self.php, stateDir=self.path('state'), cacheDir=None, assumeYes=True, jobs=2)
+        configDict.update(kwargs)
+        return configDict
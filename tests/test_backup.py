@@ -0,0 +1,244 @@
+#*******************************************************************************
+#*******************************************************************************
+# 
+#                      COPYRIGHT (c) 2015, James Sinton
+#                             ALL RIGHTS RESERVED
+# 
+#  This library is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+# 
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with this library; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# 
+#   DESCRIPTION
+#      Code and database backups of an instance with stub commands
+# 
+#********************************************************************************
+#********************************************************************************
+
+import contextlib
+import io
+import os
+from unittest import mock
+
+from .support import StubCommandsTestCase, TempDirTestCase, writeStub
+
+from owncloud_upgrade.backup import (backupOC, backupTree, backupUsage, findBackups, freedBytes, planRetention,
+                                     preflightSpace, pruneBackups, usedBytes)
+from owncloud_upgrade.php import getOCVersion
+
+class BackupOCTest(StubCommandsTestCase):
+    def backup(self, **kwargs):
+        configDict=self.instanceConfig(**kwargs)
+        with contextlib.redirect_stdout(io.StringIO()):
+            configDict=getOCVersion(configDict)
+            return configDict, backupOC(configDict)
+
+    def testBackup(self):
+        configDict, result=self.backup()
+        self.assertIs(result, configDict)
+        backups=findBackups(configDict['backupRoot'])
+        self.assertEqual(len(backups), 1)
+        self.assertEqual(backups[0]['version'], '9.0.0')
+        self.assertTrue(os.path.isfile(os.path.join(backups[0]['code'], 'lib', 'base.php')))
+        self.assertTrue(backups[0]['db'].endswith('.sql.gz'))
+
+    def testFailedDumpRemovesBackup(self):
+        self.failDump()
+        configDict, result=self.backup()
+        self.assertIsNone(result)
+        self.assertEqual(os.listdir(configDict['backupRoot']), [])
+        self.assertIn('php %s/occ maintenance:mode --off' % configDict['ocDir'], self.commands())
+
+    def testFailedTableDumpRemovesBackup(self):
+        self.failDump()
+        configDict, result=self.backup(dbDump='tables', dbJobs=2)
+        self.assertIsNone(result)
+        self.assertEqual(os.listdir(configDict['backupRoot']), [])
+
+    def testExistingBackupIsLeftAlone(self):
+        backupRoot=self.instanceConfig()['backupRoot']
+        os.makedirs(backupRoot)
+        existing=os.path.join(backupRoot, 'owncloud_9.0.0_2015-06-01_120000.sql.gz')
+        with open(existing, 'w') as f:
+            f.write('another instance')
+        configDict, result=self.backup(backupTime='2015-06-01_120000')
+        self.assertIsNone(result)
+        self.assertEqual(os.listdir(configDict['backupRoot']), [os.path.basename(existing)])
+        self.assertNotIn('php %s/occ maintenance:mode --on' % configDict['ocDir'], self.commands())
+
+    def testDumpRefusedKeepsOtherBackup(self):
+        # another run creates the dump between the check and the dump
+        other=os.path.join(self.instanceConfig()['backupRoot'], 'owncloud_9.0.0_2015-06-01_120000.sql.gz')
+        writeStub(self.path('bin'), 'mysqldump', 'echo other > %s\necho "-- dump"\n' % other)
+        configDict, result=self.backup(backupTime='2015-06-01_120000')
+        self.assertIsNone(result)
+        self.assertEqual(os.listdir(configDict['backupRoot']), [os.path.basename(other)])
+        with open(other) as f:
+            self.assertEqual(f.read(), 'other\n')
+
+class BackupTreeTest(TempDirTestCase):
+    def testExistingTargetIsRefused(self):
+        self.writeFile('src/a.php', 'new')
+        self.writeFile('dst/a.php', 'old')
+        with self.assertRaises(FileExistsError):
+            backupTree(self.path('src'), self.path('dst'), jobs=2)
+        self.assertEqual(self.readFile('dst/a.php'), b'old')
+
+def backupList(*times, incomplete=()):
+    # backups as findBackups returns them, oldest first
+    return [{'time':t, 'version':'9.0.0', 'code':'/b/oc_9.0.0_'+t, 'db':None if t in incomplete else '/b/owncloud_9.0.0_'+t+'.sql.gz'}
+            for t in times]
+
+class PlanRetentionTest(TempDirTestCase):
+    def kept(self, backups, **kwargs):
+        prune=planRetention(backups, **kwargs)
+        return [b['time'] for i, b in enumerate(backups) if i not in prune]
+
+    def testNoPolicyKeepsCompleteBackups(self):
+        backups=backupList('2015-06-01_120000', '2015-06-02_120000', '2015-06-03_120000', incomplete=('2015-06-02_120000',))
+        self.assertEqual(self.kept(backups), ['2015-06-01_120000', '2015-06-03_120000'])
+
+    def testKeepLast(self):
+        backups=backupList('2015-06-01_120000', '2015-06-02_120000', '2015-06-03_120000', '2015-06-04_120000')
+        self.assertEqual(self.kept(backups, keepLast=2), ['2015-06-03_120000', '2015-06-04_120000'])
+
+    def testKeepDaily(self):
+        backups=backupList('2015-06-01_090000', '2015-06-01_180000', '2015-06-02_090000', '2015-06-03_090000', '2015-06-03_180000')
+        self.assertEqual(self.kept(backups, keepDaily=2), ['2015-06-02_090000', '2015-06-03_180000'])
+        self.assertEqual(self.kept(backups, keepDaily=3), ['2015-06-01_180000', '2015-06-02_090000', '2015-06-03_180000'])
+
+    def testKeepWeeklyAcrossTheYear(self):
+        # 2015-12-28 to 2016-01-03 is ISO week 53 of 2015, 2016-01-04 starts week 1
+        backups=backupList('2015-12-21_120000', '2015-12-28_120000', '2015-12-31_120000', '2016-01-03_120000', '2016-01-04_120000')
+        self.assertEqual(self.kept(backups, keepWeekly=2), ['2016-01-03_120000', '2016-01-04_120000'])
+        self.assertEqual(self.kept(backups, keepWeekly=3), ['2015-12-21_120000', '2016-01-03_120000', '2016-01-04_120000'])
+        # and 2014-12-29 already belongs to week 1 of 2015
+        backups=backupList('2014-12-28_120000', '2014-12-29_120000', '2015-01-02_120000')
+        self.assertEqual(self.kept(backups, keepWeekly=1), ['2015-01-02_120000'])
+        self.assertEqual(self.kept(backups, keepWeekly=2), ['2014-12-28_120000', '2015-01-02_120000'])
+
+    def testPoliciesCombine(self):
+        backups=backupList('2015-05-20_120000', '2015-06-01_120000', '2015-06-02_090000', '2015-06-02_180000')
+        self.assertEqual(self.kept(backups, keepLast=1, keepDaily=2, keepWeekly=3),
+                         ['2015-05-20_120000', '2015-06-01_120000', '2015-06-02_180000'])
+
+    def testNewestCompleteBackupIsKept(self):
+        # the newer incomplete one may still be being written
+        backups=backupList('2015-06-01_120000', '2015-06-02_120000', '2015-06-03_120000', '2015-06-04_120000',
+                           incomplete=('2015-06-01_120000', '2015-06-04_120000'))
+        self.assertEqual(self.kept(backups, keepLast=1), ['2015-06-03_120000', '2015-06-04_120000'])
+        usage={1:[4096, 1, {0:1}], 2:[4096, 1, {1:1}], 3:[4096, 1, {2:1}], 4:[4096, 1, {3:1}]}
+        self.assertEqual(self.kept(backups, keepLast=3, maxBytes=0, usage=usage), ['2015-06-03_120000', '2015-06-04_120000'])
+
+    def testOnlyIncompleteBackups(self):
+        backups=backupList('2015-06-01_120000', '2015-06-02_120000', incomplete=('2015-06-01_120000', '2015-06-02_120000'))
+        self.assertEqual(planRetention(backups, keepLast=1), [])
+
+class BackupRootTestCase(TempDirTestCase):
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.root=self.path('backup')
+        # every backup hard links the big unchanged file of the first
+        previous=None
+        for day in (1, 2, 3):
+            code=self.path('backup', 'oc_9.0.0_2015-06-0%d_120000' % day)
+            os.makedirs(os.path.join(code, 'lib'))
+            if previous is None:
+                self.writeFile(os.path.join(code, 'lib', 'big.php'), b'x' * 65536)
+            else:
+                os.link(os.path.join(previous, 'lib', 'big.php'), os.path.join(code, 'lib', 'big.php'))
+            self.writeFile(os.path.join(code, 'version.php'), b'v' * 8192)
+            self.writeFile('backup/owncloud_9.0.0_2015-06-0%d_120000.sql.gz' % day, b'd' * 8192)
+            previous=code
+        self.backups=findBackups(self.root)
+        self.usage=backupUsage(self.backups)
+
+    def config(self, **kwargs):
+        configDict={'backupRoot':self.root, 'keepLast':None, 'keepDaily':None, 'keepWeekly':None, 'maxBackupBytes':None}
+        configDict.update(kwargs)
+        return configDict
+
+    def prune(self, configDict, needBytes=None):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return pruneBackups(configDict, needBytes)
+
+    def blocks(self, *rels):
+        return sum(os.stat(self.path('backup', rel)).st_blocks * 512 for rel in rels)
+
+class PruneBackupsTest(BackupRootTestCase):
+    def testLinkedFilesCountOnce(self):
+        self.assertEqual(len(self.backups), 3)
+        big=self.blocks('oc_9.0.0_2015-06-01_120000/lib/big.php')
+        own=[self.blocks('oc_9.0.0_2015-06-0%d_120000/version.php' % day, 'owncloud_9.0.0_2015-06-0%d_120000.sql.gz' % day) for day in (1, 2, 3)]
+        self.assertEqual(usedBytes(self.usage, set([0, 1, 2])), big + sum(own))
+        self.assertEqual(usedBytes(self.usage, set([2])), big + own[2])
+        # the big file lives on in the newer backups
+        self.assertEqual(freedBytes(self.usage, set([0])), own[0])
+        self.assertEqual(freedBytes(self.usage, set([0, 1])), own[0] + own[1])
+        self.assertEqual(freedBytes(self.usage, set([0, 1, 2])), big + sum(own))
+
+    def testMaxBytes(self):
+        everything=usedBytes(self.usage, set([0, 1, 2]))
+        self.assertEqual(planRetention(self.backups, maxBytes=everything, usage=self.usage), [])
+        self.assertEqual(planRetention(self.backups, maxBytes=everything-1, usage=self.usage), [0])
+        self.assertEqual(planRetention(self.backups, maxBytes=usedBytes(self.usage, set([2])), usage=self.usage), [0, 1])
+        self.assertEqual(planRetention(self.backups, maxBytes=1, usage=self.usage), [0, 1])
+
+    def testPrune(self):
+        freed=self.prune(self.config(keepLast=1))
+        self.assertEqual(sorted(os.listdir(self.root)), ['oc_9.0.0_2015-06-03_120000', 'owncloud_9.0.0_2015-06-03_120000.sql.gz'])
+        self.assertEqual(freed, freedBytes(self.usage, set([0, 1])))
+        self.assertEqual(self.readFile('backup/oc_9.0.0_2015-06-03_120000/lib/big.php'), b'x' * 65536)
+
+    def testPruneForSpace(self):
+        # nothing is due for deletion, but the oldest backup has to go to
+        # make room for the next one
+        own=freedBytes(self.usage, set([0]))
+        with mock.patch('owncloud_upgrade.backup.freeBytes', return_value=1000):
+            self.prune(self.config(keepLast=5), 1000+own)
+        self.assertEqual([b['time'] for b in findBackups(self.root)], ['2015-06-02_120000', '2015-06-03_120000'])
+
+    def testPruneForSpaceKeepsNewest(self):
+        with mock.patch('owncloud_upgrade.backup.freeBytes', return_value=0):
+            self.prune(self.config(keepLast=5), 10**12)
+        self.assertEqual([b['time'] for b in findBackups(self.root)], ['2015-06-03_120000'])
+
+class PreflightSpaceTest(BackupRootTestCase):
+    def preflight(self, configDict, free, need):
+        # free space grows by what was deleted
+        start=usedBytes(backupUsage(findBackups(self.root)), set(range(3)))
+
+        def freeBytes(path):
+            backups=findBackups(self.root)
+            return free + start - usedBytes(backupUsage(backups), set(range(len(backups))))
+        with mock.patch('owncloud_upgrade.backup.freeBytes', side_effect=freeBytes), \
+             mock.patch('owncloud_upgrade.backup.estimateBackupSpace', return_value=(need, 0)), \
+             contextlib.redirect_stdout(io.StringIO()):
+            return preflightSpace(configDict, None)
+
+    def testEnoughSpace(self):
+        self.assertTrue(self.preflight(self.config(keepLast=5), 10**6, 1000))
+        self.assertEqual(len(findBackups(self.root)), 3)
+
+    def testPrunesOldestForSpace(self):
+        own=freedBytes(self.usage, set([0]))
+        # room for own but not for the 10% margin on top
+        self.assertTrue(self.preflight(self.config(keepLast=5), own, own))
+        self.assertEqual([b['time'] for b in findBackups(self.root)], ['2015-06-02_120000', '2015-06-03_120000'])
+
+    def testNotEnoughSpace(self):
+        self.assertFalse(self.preflight(self.config(keepLast=5), 0, 10**12))
+        self.assertEqual([b['time'] for b in findBackups(self.root)], ['2015-06-03_120000'])
+
+    def testNoPolicyDeletesNothing(self):
+        self.assertFalse(self.preflight(self.config(), 0, 10**12))
+        self.assertEqual(len(findBackups(self.root)), 3)
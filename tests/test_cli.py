@@ -0,0 +1,78 @@
+#*******************************************************************************
+#*******************************************************************************
+# 
+#                      COPYRIGHT (c) 2015, James Sinton
+#                             ALL RIGHTS RESERVED
+# 
+#  This library is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+# 
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with this library; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# 
+#   DESCRIPTION
+#      The --check-only monitoring probe
+# 
+#********************************************************************************
+#********************************************************************************
+
+import contextlib
+import io
+import os
+
+from .support import ReleaseServer, TempDirTestCase, makeInstance
+from .test_updates import UPDATE
+
+from owncloud_upgrade.cli import checkOnly
+from owncloud_upgrade.config import getConfig
+
+class CheckOnlyTest(TempDirTestCase):
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.server=ReleaseServer()
+        self.addCleanup(self.server.close)
+        self.server.files['/updater.php']=UPDATE
+        self.server.files['/current.php']=b''
+        self.instance=makeInstance(self.path('instance'))
+
+    def probe(self, updater='/updater.php', **kwargs):
+        configDict=getConfig()
+        configDict.update(self.instance)
+        configDict.update(updater=self.server.url(updater), stateDir=self.path('state'), php=self.path('no-php'))
+        configDict.update(kwargs)
+        out=io.StringIO()
+        with contextlib.redirect_stdout(out):
+            status=checkOnly(configDict)
+        lines=out.getvalue().splitlines()
+        self.assertEqual(len(lines), 1, lines)
+        return status, lines[0]
+
+    def testCurrent(self):
+        self.assertEqual(self.probe('/current.php'), (0, 'OK: ownCloud 9.0.0 installed, no update available'))
+
+    def testUpdateAvailable(self):
+        self.assertEqual(self.probe(), (1, 'WARNING: ownCloud 9.0.0 installed, ownCloud 9.1.0 is available'))
+        # probes run every few minutes; the answer comes from the state directory
+        self.server.requests[:]=[]
+        self.assertEqual(self.probe()[0], 1)
+        self.assertEqual(self.server.requests, [])
+
+    def testUpdaterUnreachable(self):
+        status, line=self.probe('/missing.php', updateTTL=0)
+        self.assertEqual(status, 3)
+        self.assertTrue(line.startswith('UNKNOWN: ownCloud 9.0.0 installed, could not check for an update - '), line)
+
+    def testVersionUnknown(self):
+        os.remove(os.path.join(self.instance['ocDir'], 'version.php'))
+        status, line=self.probe()
+        self.assertEqual(status, 3)
+        self.assertTrue(line.startswith('UNKNOWN: cannot read the installed version - '), line)
+        self.assertEqual(self.server.requests, [])
@@ -0,0 +1,120 @@
+#*******************************************************************************
+#*******************************************************************************
+# 
+#                      COPYRIGHT (c) 2015, James Sinton
+#                             ALL RIGHTS RESERVED
+# 
+#  This library is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+# 
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with this library; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# 
+#   DESCRIPTION
+#      Commands run with live output and timeouts
+# 
+#********************************************************************************
+#********************************************************************************
+
+import contextlib
+import gc
+import io
+import sys
+import threading
+import time
+import unittest
+import warnings
+
+from .support import TempDirTestCase
+
+from owncloud_upgrade.commands import CommandError, runCommand, runPhases, ThreadPrefixWriter
+from owncloud_upgrade.config import getConfig
+
+class RunCommandTest(TempDirTestCase):
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.configDict=getConfig()
+        self.configDict['logFile']=self.path('commands.log')
+
+    def runCommand(self, script, timeout=-1, check=False):
+        out=io.StringIO()
+        with contextlib.redirect_stdout(out):
+            rc=runCommand(self.configDict, ['sh', '-c', script], timeout, None, check)
+        return rc, out.getvalue()
+
+    def testOutputAndStatus(self):
+        rc, out=self.runCommand('echo one; echo two >&2; printf "3/10 [\\r5/10 [\\r"; exit 3')
+        self.assertEqual(rc, 3)
+        self.assertEqual(sorted(out.splitlines()[:4]), ['3/10 [', '5/10 [', 'one', 'two'])
+        with open(self.path('commands.log')) as f:
+            self.assertEqual(len(f.read().splitlines()), 5)
+
+    def testCheckRaises(self):
+        with self.assertRaises(CommandError):
+            self.runCommand('exit 1', check=True)
+
+    def testMissingCommand(self):
+        cmd=[self.path('no-such-service'), 'apache2', 'stop']
+        with self.assertRaises(CommandError) as raised:
+            runCommand(self.configDict, cmd, check=True)
+        self.assertEqual(str(raised.exception), "'%s apache2 stop' could not be run: No such file or directory" % cmd[0])
+        out=io.StringIO()
+        with contextlib.redirect_stdout(out):
+            self.assertIsNone(runCommand(self.configDict, cmd))
+        self.assertTrue(out.getvalue().startswith("Error:  '%s" % cmd[0]))
+
+    def testPipesAreClosed(self):
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always', ResourceWarning)
+            self.runCommand('echo one; echo two >&2')
+            gc.collect()
+        self.assertEqual([str(w.message) for w in caught if issubclass(w.category, ResourceWarning)], [])
+
+    def testTimeoutOfASilentCommand(self):
+        start=time.time()
+        rc, out=self.runCommand('exec sleep 30', 1)
+        self.assertIsNone(rc)
+        self.assertLess(time.time()-start, 5)
+
+    def testTimeoutOfAChattyCommand(self):
+        # lines keep arriving, so the queue is never idle
+        start=time.time()
+        with self.assertRaises(CommandError):
+            self.runCommand('while :; do echo working; sleep 0.01; done', 1, True)
+        self.assertLess(time.time()-start, 5)
+
+class ThreadPrefixWriterTest(unittest.TestCase):
+    def testCarriageReturnEndsALine(self):
+        out=io.StringIO()
+        writer=ThreadPrefixWriter(out, 60)
+        threading.current_thread().instanceName='download'
+        self.addCleanup(delattr, threading.current_thread(), 'instanceName')
+        for done in range(0, 100, 10):
+            writer.write('%10d  [%3.2f%%]\r' % (done, done))
+        writer.write('%10d  [100.00%%]\n' % 100)
+        writer.write('partial')
+        self.assertEqual(out.getvalue().splitlines(), ['[download]          0  [0.00%]', '[download]        100  [100.00%]'])
+
+    def testRunPhasesShowsProgress(self):
+        def download():
+            sys.stdout.write('%10d  [50.00%%]\r' % 5)
+            sys.stdout.flush()
+            time.sleep(0.2)
+            print('%10d  [100.00%%]' % 10)
+            return 'rel.tar.bz2'
+
+        out=io.StringIO()
+        with contextlib.redirect_stdout(out):
+            results=runPhases([('download', download, ()), ('dbDump', lambda: print('dumped'), ())])
+        self.assertEqual(results['download'], ('ok', 'rel.tar.bz2'))
+        lines=out.getvalue().splitlines()
+        self.assertEqual(lines[0], '[download]          5  [50.00%]')
+        self.assertEqual(sorted(lines[1:]), ['[dbDump] dumped', '[download]         10  [100.00%]'])
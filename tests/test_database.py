@@ -0,0 +1,73 @@
+#*******************************************************************************
+#*******************************************************************************
+# 
+#                      COPYRIGHT (c) 2015, James Sinton
+#                             ALL RIGHTS RESERVED
+# 
+#  This library is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+# 
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with this library; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# 
+#   DESCRIPTION
+#      Database dumps streamed into a compressor
+# 
+#********************************************************************************
+#********************************************************************************
+
+import contextlib
+import gzip
+import io
+import os
+import subprocess
+
+from .support import TempDirTestCase
+
+from owncloud_upgrade.database import dumpDatabase
+
+DUMP="seq 1 50000 | sed 's/.*/INSERT INTO t VALUES(&);/'"
+
+class DumpDatabaseTest(TempDirTestCase):
+    def dump(self, script, method='gzip'):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return dumpDatabase(['sh', '-c', script], self.path('owncloud_8.0.0_2015-01-01_000000.sql.gz'), method, 2)
+
+    def testDump(self):
+        stats=self.dump(DUMP)
+        self.assertEqual(os.listdir(self.tmp), ['owncloud_8.0.0_2015-01-01_000000.sql.gz'])
+        with gzip.open(self.path('owncloud_8.0.0_2015-01-01_000000.sql.gz')) as f:
+            data=f.read()
+        self.assertEqual(stats['bytesIn'], len(data))
+        self.assertTrue(data.endswith(b'INSERT INTO t VALUES(50000);\n'))
+
+    def testFailedDumpLeavesNoFile(self):
+        with self.assertRaises(subprocess.CalledProcessError):
+            self.dump(DUMP + '; echo lost connection >&2; exit 2')
+        self.assertEqual(os.listdir(self.tmp), [])
+
+    def testMissingCompressorLeavesNoFile(self):
+        with self.assertRaises(ValueError):
+            self.dump(DUMP, 'lzma')
+        self.assertEqual(os.listdir(self.tmp), [])
+
+    def testExistingDumpIsLeftAlone(self):
+        self.writeFile('owncloud_8.0.0_2015-01-01_000000.sql.gz', 'older dump')
+        with self.assertRaises(FileExistsError):
+            self.dump(DUMP)
+        self.assertEqual(self.readFile('owncloud_8.0.0_2015-01-01_000000.sql.gz'), b'older dump')
+
+    def testDumpBeingWrittenIsLeftAlone(self):
+        self.writeFile('.tmp-owncloud_8.0.0_2015-01-01_000000.sql.gz', 'dump in progress')
+        with self.assertRaises(FileExistsError):
+            self.dump(DUMP)
+        self.assertEqual(os.listdir(self.tmp), ['.tmp-owncloud_8.0.0_2015-01-01_000000.sql.gz'])
+        self.assertEqual(self.readFile('.tmp-owncloud_8.0.0_2015-01-01_000000.sql.gz'), b'dump in progress')
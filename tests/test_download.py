@@ -0,0 +1,213 @@
+#*******************************************************************************
+#*******************************************************************************
+# 
+#                      COPYRIGHT (c) 2015, James Sinton
+#                             ALL RIGHTS RESERVED
+# 
+#  This library is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+# 
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with this library; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# 
+#   DESCRIPTION
+#      Downloads against a local server, with and without Range
+#      support, resumed and retried
+# 
+#********************************************************************************
+#********************************************************************************
+
+import contextlib
+import hashlib
+import io
+import glob
+import json
+import os
+import time
+
+from .support import ReleaseServer, TempDirTestCase
+
+from owncloud_upgrade.config import getConfig
+from owncloud_upgrade.download import cacheLookup, cacheStore, downloadFile, evictCache, fetchRelease
+
+class DownloadTest(TempDirTestCase):
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.server=ReleaseServer()
+        self.addCleanup(self.server.close)
+        self.data=os.urandom(300000)
+        self.sha256='sha256:'+hashlib.sha256(self.data).hexdigest()
+        for path in ('/rel.tar.bz2', '/norange.tar.bz2', '/nolength.tar.bz2'):
+            self.server.files[path]=self.data
+        self.server.noRange.update(['/norange.tar.bz2', '/nolength.tar.bz2'])
+        self.server.noLength.add('/nolength.tar.bz2')
+        self.target=self.path('rel.tar.bz2')
+
+    def download(self, path, checksum=None, retries=3):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return downloadFile(self.server.url(path), self.target, checksum if checksum is not None else self.sha256,
+                                connections=4, blockSize=65536, retries=retries)
+
+    def rangeStarts(self, path):
+        return sorted(int(r[6:].split('-')[0]) for p, r in self.server.requests if p == path and r and r != 'bytes=0-0')
+
+    def assertDownloaded(self):
+        self.assertEqual(self.readFile('rel.tar.bz2'), self.data)
+        self.assertFalse(os.path.exists(self.target+'.part'))
+        self.assertFalse(os.path.exists(self.target+'.part.json'))
+
+    def testParallelRangeDownload(self):
+        self.assertEqual(self.download('/rel.tar.bz2'), len(self.data))
+        self.assertDownloaded()
+        self.assertEqual(self.rangeStarts('/rel.tar.bz2'), [0, 75000, 150000, 225000])
+
+    def testPublishedChecksum(self):
+        self.server.files['/rel.tar.bz2.sha256']=(hashlib.sha256(self.data).hexdigest()+'  rel.tar.bz2\n').encode()
+        with contextlib.redirect_stdout(io.StringIO()):
+            downloadFile(self.server.url('/rel.tar.bz2'), self.target, blockSize=65536)
+        self.assertDownloaded()
+
+    def testResumeFromPartFile(self):
+        segments=[[0, 75000, 1000], [75000, 150000, 75000], [150000, 225000, 0], [225000, 300000, 40000]]
+        with open(self.target+'.part', 'wb') as f:
+            f.truncate(len(self.data))
+            for start, end, done in segments:
+                f.seek(start)
+                f.write(self.data[start:start+done])
+        with open(self.target+'.part.json', 'w') as f:
+            json.dump({'url':self.server.url('/rel.tar.bz2'), 'size':len(self.data), 'segments':segments}, f)
+        self.download('/rel.tar.bz2')
+        self.assertDownloaded()
+        self.assertEqual(self.rangeStarts('/rel.tar.bz2'), [1000, 150000, 265000])
+
+    def testRetryContinuesFromRange(self):
+        self.server.failures['/rel.tar.bz2']=1
+        self.download('/rel.tar.bz2')
+        self.assertDownloaded()
+        starts=self.rangeStarts('/rel.tar.bz2')
+        self.assertEqual(len(starts), 5)
+        self.assertFalse(set(starts) <= set([0, 75000, 150000, 225000]))
+
+    def testRetryWithoutRangeStartsOver(self):
+        self.server.failures['/norange.tar.bz2']=1
+        self.download('/norange.tar.bz2')
+        self.assertDownloaded()
+
+    def testWithoutLength(self):
+        self.download('/nolength.tar.bz2')
+        self.assertDownloaded()
+
+    def testTruncatedWithoutLengthFailsChecksum(self):
+        self.server.failures['/nolength.tar.bz2']=1
+        with self.assertRaises(IOError):
+            self.download('/nolength.tar.bz2')
+        self.assertFalse(os.path.exists(self.target))
+        self.assertFalse(os.path.exists(self.target+'.part'))
+
+    def testChecksumMismatch(self):
+        with self.assertRaises(IOError):
+            self.download('/rel.tar.bz2', 'sha256:'+'0'*64)
+        self.assertFalse(os.path.exists(self.target))
+
+    def testFailureKeepsStateForResume(self):
+        self.server.failures['/rel.tar.bz2']=100
+        with self.assertRaises(IOError):
+            self.download('/rel.tar.bz2', retries=1)
+        self.assertFalse(os.path.exists(self.target))
+        with open(self.target+'.part.json') as f:
+            state=json.load(f)
+        self.assertEqual([seg[2] for seg in state['segments']], [37500]*4)
+        self.server.failures['/rel.tar.bz2']=0
+        self.download('/rel.tar.bz2')
+        self.assertDownloaded()
+
+class ReleaseCacheTest(TempDirTestCase):
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.server=ReleaseServer()
+        self.addCleanup(self.server.close)
+        self.data=os.urandom(200000)
+        self.sha256='sha256:'+hashlib.sha256(self.data).hexdigest()
+        self.server.files['/owncloud-9.0.1.tar.bz2']=self.data
+        self.server.files['/mirror/owncloud-9.0.1.tar.bz2']=self.data
+        self.cacheDir=self.path('cache')
+
+    def fetch(self, path='/owncloud-9.0.1.tar.bz2', checksum=None):
+        configDict=getConfig()
+        configDict.update(updateURL=self.server.url(path), codeChecksum=checksum or self.sha256, cacheDir=self.cacheDir,
+                          wwwRoot=self.path('www'))
+        with contextlib.redirect_stdout(io.StringIO()):
+            return fetchRelease(configDict)
+
+    def requests(self):
+        return [p for p, r in self.server.requests]
+
+    def testHitByURL(self):
+        first=self.fetch()
+        self.assertEqual(self.readFile(first), self.data)
+        self.assertEqual(os.listdir(self.path('www')), [])
+        self.server.requests[:]=[]
+        self.assertEqual(self.fetch(), first)
+        self.assertEqual(self.requests(), [])
+
+    def testHitBySHA256(self):
+        first=self.fetch()
+        self.server.requests[:]=[]
+        # a mirror the cache has never seen, but the same release
+        self.assertEqual(self.fetch('/mirror/owncloud-9.0.1.tar.bz2'), first)
+        self.assertEqual(self.requests(), [])
+
+    def testChecksumMismatchIsMiss(self):
+        self.fetch()
+        url=self.server.url('/owncloud-9.0.1.tar.bz2')
+        self.assertIsNone(cacheLookup(self.cacheDir, url, 'sha256:'+'0'*64))
+        self.assertIsNone(cacheLookup(self.cacheDir, self.server.url('/other.tar.bz2')))
+
+    def testSizeMismatchIsMiss(self):
+        first=self.fetch()
+        with open(first, 'r+b') as f:
+            f.truncate(1000)
+        self.assertIsNone(cacheLookup(self.cacheDir, self.server.url('/owncloud-9.0.1.tar.bz2')))
+        self.server.requests[:]=[]
+        fileName=self.fetch()
+        self.assertIn('/owncloud-9.0.1.tar.bz2', self.requests())
+        self.assertEqual(self.readFile(fileName), self.data)
+
+    def store(self, name, size, age):
+        fileName=self.writeFile('downloads/'+name, os.urandom(size))
+        with contextlib.redirect_stdout(io.StringIO()):
+            objectName=cacheStore(self.cacheDir, 'https://example.org/'+name, fileName, 10**9)
+        os.utime(objectName, (time.time()-age, time.time()-age))
+        return objectName
+
+    def testEvictionLeastRecentlyUsed(self):
+        old=self.store('a.tar.bz2', 40000, 3*86400)
+        older=self.store('b.tar.bz2', 40000, 4*86400)
+        recent=self.store('c.tar.bz2', 40000, 600)
+        with contextlib.redirect_stdout(io.StringIO()):
+            evictCache(self.cacheDir, 50000, minAge=3600)
+        # the recently used one stays even though the cache is still too big
+        self.assertEqual(sorted(glob.glob(os.path.join(self.cacheDir, 'objects', '*'))), [recent])
+        self.assertFalse(os.path.exists(old) or os.path.exists(older))
+        entries=[]
+        for urlEntry in glob.glob(os.path.join(self.cacheDir, 'urls', '*')):
+            with open(urlEntry) as f:
+                entries.append(json.load(f)['name'])
+        self.assertEqual(entries, ['c.tar.bz2'])
+        self.assertIsNone(cacheLookup(self.cacheDir, 'https://example.org/a.tar.bz2'))
+        self.assertEqual(cacheLookup(self.cacheDir, 'https://example.org/c.tar.bz2'), recent)
+
+    def testStoreEvictsButKeepsNewObject(self):
+        self.store('a.tar.bz2', 40000, 3*86400)
+        fileName=self.writeFile('downloads/d.tar.bz2', os.urandom(40000))
+        with contextlib.redirect_stdout(io.StringIO()):
+            objectName=cacheStore(self.cacheDir, 'https://example.org/d.tar.bz2', fileName, 1000)
+        self.assertEqual(glob.glob(os.path.join(self.cacheDir, 'objects', '*')), [objectName])
@@ -0,0 +1,128 @@
+#*******************************************************************************
+#*******************************************************************************
+# 
+#                      COPYRIGHT (c) 2015, James Sinton
+#                             ALL RIGHTS RESERVED
+# 
+#  This library is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+# 
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with this library; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# 
+#   DESCRIPTION
+#      Fleet runs of the command line with stub commands on PATH
+# 
+#********************************************************************************
+#********************************************************************************
+
+import json
+import os
+import subprocess
+import sys
+
+from .support import StubCommandsTestCase, makeInstance, makeRelease
+
+from owncloud_upgrade.backup import findBackups
+from owncloud_upgrade.fleet import separateShared
+from owncloud_upgrade.php import readOCFiles
+
+class FleetTest(StubCommandsTestCase):
+    def setUp(self):
+        StubCommandsTestCase.setUp(self)
+        self.release=makeRelease(self.path('owncloud-9.0.1.tar.gz'))
+        self.instances={}
+        inventory=[]
+        for name, extra in (('inplace', {}), ('staged', {'staged':True}), ('delta', {'delta':True}),
+                            ('missing', {})):
+            instance=makeInstance(self.path(name), dbName='oc_'+name)
+            if name == 'missing':
+                instance['ocDir']=self.path(name, 'www', 'nonexistent')
+            instance.update(extra, name=name)
+            inventory.append(instance)
+            self.instances[name]=instance
+        self.inventory=self.path('inventory.json')
+        with open(self.inventory, 'w') as f:
+            json.dump(inventory, f)
+
+    def runCLI(self, *args):
+        env=dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        return subprocess.run([sys.executable, '-m', 'owncloud_upgrade'] + list(args), env=env, cwd=self.tmp,
+                              stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True, timeout=120)
+
+    def installedVersion(self, name):
+        return readOCFiles(self.instances[name]['ocDir'], self.php)['OC_VersionString']
+
+    def testFleetRun(self):
+        report=self.path('report.json')
+        result=self.runCLI('--inventory', self.inventory, '--code', self.release, '--php', self.php,
+                           '--state-dir', self.path('state'), '--no-cache', '--fleet-jobs', '3', '--jobs', '2',
+                           '--report', report)
+        self.assertEqual(result.returncode, 0, result.stdout)
+        table=result.stdout.splitlines()[-5:]
+        column=table[0].index('Status')
+        rows=dict((line.split()[0], line.split()[1:3] + [line[column:]]) for line in table[1:])
+        for name in ('inplace', 'staged', 'delta'):
+            self.assertEqual(rows[name], ['9.0.0', '9.0.1', 'upgraded'], result.stdout)
+            self.assertEqual(self.installedVersion(name), '9.0.1')
+            self.assertEqual(len(os.listdir(self.instances[name]['backupRoot'])), 2)
+        self.assertTrue(rows['missing'][-1].startswith('error: '), result.stdout)
+        # every instance prints through its own prefix
+        self.assertIn('[staged] ', result.stdout)
+        commands=self.commands()
+        for name in ('inplace', 'staged', 'delta'):
+            ocDir=self.instances[name]['ocDir']
+            self.assertIn('php %s/occ maintenance:mode --on' % ocDir, commands)
+            self.assertIn('php %s/occ upgrade' % ocDir, commands)
+            self.assertIn('php %s/occ maintenance:mode --off' % ocDir, commands)
+        self.assertIn('service apache2 reload', commands)
+        with open(report) as f:
+            instances=dict((i['instance'], i) for i in json.load(f)['instances'])
+        self.assertEqual(sorted(instances), ['delta', 'inplace', 'missing', 'staged'])
+        self.assertIn('swap', [p['phase'] for p in instances['staged']['phases']])
+
+    def testBadInventory(self):
+        with open(self.inventory, 'w') as f:
+            json.dump([{'name':'x', 'ocDirectory':'/srv/owncloud'}], f)
+        result=self.runCLI('--inventory', self.inventory, '--php', self.php, '--state-dir', self.path('state'))
+        self.assertNotEqual(result.returncode, 0)
+        self.assertIn('unknown keys: ocDirectory', result.stdout)
+
+    def testSharedBackupRoot(self):
+        # same version and the same backup time: only the instance
+        # name keeps the backups apart
+        shared=self.path('shared-backup')
+        inventory=[]
+        for name in ('a', 'b'):
+            instance=dict(self.instances['inplace'] if name == 'a' else self.instances['staged'], name=name, backupRoot=shared)
+            instance.pop('staged', None)
+            inventory.append(instance)
+        with open(self.inventory, 'w') as f:
+            json.dump(inventory, f)
+        result=self.runCLI('--inventory', self.inventory, '--code', self.release, '--php', self.php,
+                           '--state-dir', self.path('state'), '--no-cache', '--staged')
+        self.assertEqual(result.returncode, 0, result.stdout)
+        self.assertEqual(sorted(os.listdir(shared)), ['a', 'b'])
+        for name in ('a', 'b'):
+            backups=findBackups(os.path.join(shared, name))
+            self.assertEqual(len(backups), 1, result.stdout)
+            self.assertEqual(backups[0]['version'], '9.0.0')
+            self.assertIsNotNone(backups[0]['code'])
+            self.assertIsNotNone(backups[0]['db'])
+        self.assertEqual(sorted(line.split()[-1] for line in result.stdout.splitlines()[-2:]), ['upgraded', 'upgraded'])
+
+    def testSharedDownloadDir(self):
+        configs=[{'name':'/srv/www/a', 'backupRoot':'/srv/backup/a', 'wwwRoot':'/srv/www', 'downloadDir':None},
+                 {'name':'/srv/www/b', 'backupRoot':'/srv/backup/b', 'wwwRoot':'/srv/www/', 'downloadDir':None},
+                 {'name':'c', 'backupRoot':'/srv/backup/c', 'wwwRoot':'/srv/other', 'downloadDir':None}]
+        separateShared(configs)
+        self.assertEqual([c['downloadDir'] for c in configs], ['/srv/www/.download-srv_www_a', '/srv/www/.download-srv_www_b', None])
+        self.assertEqual([c['backupRoot'] for c in configs], ['/srv/backup/a', '/srv/backup/b', '/srv/backup/c'])
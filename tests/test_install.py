@@ -0,0 +1,103 @@
+#*******************************************************************************
+#*******************************************************************************
+# 
+#                      COPYRIGHT (c) 2015, James Sinton
+#                             ALL RIGHTS RESERVED
+# 
+#  This library is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+# 
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with this library; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# 
+#   DESCRIPTION
+#      Prepared upgrades of an instance with stub commands
+# 
+#********************************************************************************
+#********************************************************************************
+
+import contextlib
+import io
+import os
+from unittest import mock
+
+from .support import StubCommandsTestCase, TempDirTestCase, makeRelease
+
+from owncloud_upgrade.backup import backupOC
+from owncloud_upgrade.install import installUpgrade, swapCode
+from owncloud_upgrade.php import getOCVersion, readOCFiles
+
+class InstallPreparedTest(StubCommandsTestCase):
+    def prepare(self):
+        configDict=self.instanceConfig(code=makeRelease(self.path('owncloud-9.0.1.tar.gz')), prepare=True)
+        with contextlib.redirect_stdout(io.StringIO()):
+            configDict=getOCVersion(configDict)
+            self.assertIsNotNone(backupOC(configDict))
+        self.assertTrue(os.path.isdir(configDict['stagedCode']))
+        self.assertNotIn('php %s/occ maintenance:mode --on' % configDict['ocDir'], self.commands())
+        return configDict
+
+    def installedVersion(self, configDict):
+        return readOCFiles(configDict['ocDir'], configDict['php'])['OC_VersionString']
+
+    def testPreparedUpgrade(self):
+        configDict=self.prepare()
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertTrue(installUpgrade(configDict))
+        self.assertEqual(self.installedVersion(configDict), '9.0.1')
+        self.assertEqual(self.readFile('instance/www/owncloud/config/config.php'), self.readFile(configDict['backupDir']+'/config/config.php'))
+        self.assertTrue(os.path.isfile(configDict['backupDB']))
+
+    def testFailedDumpTakesTheSiteOnline(self):
+        configDict=self.prepare()
+        stageDir=os.path.dirname(configDict['stagedCode'])
+        with mock.patch('owncloud_upgrade.database.openCompressor', side_effect=ValueError("zstd compression needs the zstd program or the zstandard module")):
+            with contextlib.redirect_stdout(io.StringIO()):
+                self.assertFalse(installUpgrade(configDict))
+        self.assertEqual(self.commands()[-1], 'php %s/occ maintenance:mode --off' % configDict['ocDir'])
+        self.assertEqual(self.installedVersion(configDict), '9.0.0')
+        self.assertFalse(os.path.exists(stageDir))
+        self.assertEqual(os.listdir(configDict['backupRoot']), [])
+
+class SwapCodeTest(TempDirTestCase):
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.ocDir=self.path('www/owncloud')
+        self.writeFile('www/owncloud/version.php', 'old')
+        self.writeFile('www/owncloud/data/alice/notes.txt', 'notes')
+        self.writeFile('www/stage/owncloud/version.php', 'new')
+
+    def swapAndBack(self):
+        previous=swapCode(self.ocDir, self.path('www/stage/owncloud'), self.path('www/owncloud/data'), '1')
+        self.assertEqual(previous, self.ocDir+'.previous_1')
+        self.assertEqual(self.readFile('www/owncloud/version.php'), b'new')
+        self.assertEqual(self.readFile('www/owncloud/data/alice/notes.txt'), b'notes')
+        self.assertEqual(self.readFile('www/owncloud.previous_1/version.php'), b'old')
+        self.assertFalse(os.path.exists(self.path('www/stage/owncloud')))
+        # swapping the returned path back in rolls back
+        swapCode(self.ocDir, previous, self.path('www/owncloud/data'), '2')
+        self.assertEqual(self.readFile('www/owncloud/version.php'), b'old')
+        self.assertEqual(self.readFile('www/owncloud/data/alice/notes.txt'), b'notes')
+
+    def testSwap(self):
+        self.swapAndBack()
+
+    def testSwapWithoutExchange(self):
+        with mock.patch('owncloud_upgrade.install.exchangePaths', return_value=False):
+            self.swapAndBack()
+
+    def testSwapSymbolicLink(self):
+        os.rename(self.ocDir, self.path('www/owncloud_0'))
+        os.symlink('owncloud_0', self.ocDir)
+        previous=swapCode(self.ocDir, self.path('www/stage/owncloud'), None, '1')
+        self.assertEqual(previous, self.path('www/owncloud_0'))
+        self.assertEqual(os.readlink(self.ocDir), self.path('www/owncloud_1'))
+        self.assertEqual(self.readFile('www/owncloud/version.php'), b'new')
@@ -0,0 +1,159 @@
+#*******************************************************************************
+#*******************************************************************************
+# 
+#                      COPYRIGHT (c) 2015, James Sinton
+#                             ALL RIGHTS RESERVED
+# 
+#  This library is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+# 
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with this library; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# 
+#   DESCRIPTION
+#      Data directory permission repair with the inode index
+# 
+#********************************************************************************
+#********************************************************************************
+
+import contextlib
+import io
+import os
+import pwd
+from pwd import getpwnam
+
+from .support import TempDirTestCase
+
+from owncloud_upgrade.permissions import permissionRules, repairDataPermissions, securePermissions
+
+class RepairDataPermissionsTest(TempDirTestCase):
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        if os.geteuid() != 0:
+            self.skipTest("changing owners needs root")
+        self.uid=pwd.getpwnam('www-data').pw_uid
+        self.dataPath=self.path('data')
+        for user in ('alice', 'bob'):
+            for i in range(5):
+                self.writeFile('data/%s/files/%d.txt' % (user, i), 'x')
+        self.rules=permissionRules(None, 'www-data', self.dataPath)
+        self.indexFile=self.path('state', 'data.idx')
+        self.repair()
+
+    def repair(self, trustDirs=False):
+        return repairDataPermissions(self.dataPath, self.rules, self.indexFile, 2, trustDirs=trustDirs)
+
+    def owner(self, rel):
+        return os.lstat(self.path('data', rel)).st_uid
+
+    def testRepair(self):
+        self.assertEqual(self.owner('alice/files/3.txt'), self.uid)
+        stats=self.repair()
+        self.assertEqual(stats['changed'], 0)
+        self.assertEqual(stats['unchanged'], stats['files']+stats['dirs'])
+
+    def testChownInUnchangedDirectory(self):
+        os.chown(self.path('data/alice/files/3.txt'), 0, 0)
+        stats=self.repair()
+        self.assertEqual(stats['changed'], 1)
+        self.assertEqual(self.owner('alice/files/3.txt'), self.uid)
+
+    def testTrustedDirectoriesSkipFiles(self):
+        os.chown(self.path('data/alice/files/3.txt'), 0, 0)
+        stats=self.repair(True)
+        self.assertEqual(stats['changed'], 0)
+        self.assertEqual(stats['avoided'], 10)
+        self.assertEqual(self.owner('alice/files/3.txt'), 0)
+
+    def testNewFileInTrustedDirectory(self):
+        self.writeFile('data/bob/files/new.txt', 'x')
+        self.repair(True)
+        self.assertEqual(self.owner('bob/files/new.txt'), self.uid)
+
+def chownR(path, uid, gid):
+    os.chown(path, uid, gid)
+    for root, dirnames, filenames in os.walk(path):
+        for name in dirnames + filenames:
+            os.chown(os.path.join(root, name), uid, gid)
+
+def multiWalkPermissions(path, wwwUser, dataPath):
+    # securePermissions as it was before the rule table: a walk per
+    # subtree to chown, then one more to chmod
+    rootUID=getpwnam('root').pw_uid
+    wwwUID=getpwnam(wwwUser).pw_uid
+    wwwGID=getpwnam(wwwUser).pw_gid
+    chownR(path, rootUID, wwwGID)
+    os.chmod(path, 0o750)
+    for sub in ('apps', 'config', 'themes'):
+        chownR(os.path.join(path, sub), wwwUID, wwwGID)
+    for root, dirnames, filenames in os.walk(path):
+        for name in dirnames:
+            os.chmod(os.path.join(root, name), 0o750)
+        for name in filenames:
+            os.chmod(os.path.join(root, name), 0o640)
+    os.chmod(os.path.join(path, '.htaccess'), 0o640)
+    if dataPath is not None:
+        chownR(dataPath, wwwUID, wwwGID)
+        if os.path.exists(os.path.join(dataPath, '.htaccess')):
+            os.chmod(os.path.join(dataPath, '.htaccess'), 0o640)
+
+class SecurePermissionsTest(TempDirTestCase):
+    files=['index.php', '.htaccess', 'lib/base.php', 'core/js/app.js', 'apps/files/appinfo/info.xml',
+           'apps/files/lib/app.php', 'config/config.php', 'themes/example/core/css/styles.css']
+    dataFiles=['.htaccess', 'owncloud.log', 'alice/files/notes.txt', 'alice/cache/x']
+
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        if os.geteuid() != 0:
+            self.skipTest("changing owners needs root")
+
+    def makeTree(self, root, dataRel):
+        # owners and modes as a release unpacked by another user leaves them
+        for i, rel in enumerate([os.path.join('owncloud', f) for f in self.files] + [os.path.join(dataRel, f) for f in self.dataFiles]):
+            fileName=self.writeFile(os.path.join(root, rel), 'x', (0o777, 0o600, 0o644, 0o666)[i % 4])
+            os.chown(fileName, 1234, 1234)
+        for dirPath, dirNames, fileNames in os.walk(self.path(root)):
+            os.chmod(dirPath, 0o777 if 'apps' in dirPath else 0o755)
+            os.chown(dirPath, 1234, 1234)
+
+    def state(self, root):
+        result={}
+        for dirPath, dirNames, fileNames in os.walk(self.path(root)):
+            for name in [''] + fileNames:
+                st=os.lstat(os.path.join(dirPath, name))
+                result[os.path.relpath(os.path.join(dirPath, name), self.path(root))]=(st.st_uid, st.st_gid, oct(st.st_mode))
+        return result
+
+    def compare(self, dataRel):
+        for root in ('old', 'new'):
+            self.makeTree(root, dataRel)
+        multiWalkPermissions(self.path('old', 'owncloud'), 'www-data', self.path('old', dataRel))
+        with contextlib.redirect_stdout(io.StringIO()):
+            securePermissions(self.path('new', 'owncloud'), 'www-data', self.path('new', dataRel), 2)
+        self.assertEqual(self.state('new'), self.state('old'))
+        with contextlib.redirect_stdout(io.StringIO()):
+            stats=securePermissions(self.path('new', 'owncloud'), 'www-data', self.path('new', dataRel), 2)
+        self.assertEqual(stats['changed'], 0)
+        self.assertEqual(stats['errors'], 0)
+        return self.state('new')
+
+    def testDataOutsideCode(self):
+        state=self.compare('data')
+        www=getpwnam('www-data')
+        self.assertEqual(state['owncloud/apps/files/appinfo/info.xml'], (www.pw_uid, www.pw_gid, oct(0o100640)))
+        self.assertEqual(state['owncloud/lib/base.php'], (0, www.pw_gid, oct(0o100640)))
+        self.assertEqual(state['owncloud/config'], (www.pw_uid, www.pw_gid, oct(0o40750)))
+        self.assertEqual(state['data/.htaccess'], (www.pw_uid, www.pw_gid, oct(0o100640)))
+
+    def testDataInsideCode(self):
+        state=self.compare('owncloud/data')
+        www=getpwnam('www-data')
+        self.assertEqual(state['owncloud/data/alice/files/notes.txt'], (www.pw_uid, www.pw_gid, oct(0o100640)))
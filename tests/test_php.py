@@ -0,0 +1,120 @@
+#*******************************************************************************
+#*******************************************************************************
+# 
+#                      COPYRIGHT (c) 2015, James Sinton
+#                             ALL RIGHTS RESERVED
+# 
+#  This library is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+# 
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with this library; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# 
+#   DESCRIPTION
+#      Parsing version.php and config.php without PHP
+# 
+#********************************************************************************
+#********************************************************************************
+
+from .support import TempDirTestCase, versionPHP, writeStub
+
+from owncloud_upgrade.php import parsePHP, readOCFiles
+
+# as written by the ownCloud installer and edited by hand afterwards
+CONFIG=r'''<?php
+$CONFIG = array (
+  'instanceid' => 'oc5d2a8e1f3b7c',
+  'passwordsalt' => 'b3+Qm/9xYk0=',
+  'trusted_domains' => 
+  array (
+    0 => 'cloud.example.org',
+    1 => '192.168.1.10',
+  ),
+  'datadirectory' => '/srv/owncloud/data',
+  'overwrite.cli.url' => 'https://cloud.example.org',
+  'dbtype' => 'mysql',
+  'version' => '9.0.0.19',
+  "dbname" => "owncloud",
+  'dbhost' => 'localhost:3306',
+  'dbtableprefix' => 'oc_',
+  'dbuser' => 'oc_admin',
+  'dbpassword' => "it's \"quoted\"\t\$and\\slashed",
+  'secret' => 'don\'t \\ \n',
+  // the cache is only local
+  'memcache.local' => '\OC\Memcache\APCu',
+  # old style comment
+  /* several
+     lines */
+  'apps_paths' => array (
+    array ('path' => '/srv/owncloud/apps', 'url' => '/apps', 'writable' => false, ),
+    1 => ['path' => '/srv/owncloud/apps2', 'url' => '/apps2', 'writable' => true],
+  ),
+  'loglevel' => 2,
+  'log_rotate_size' => 1.5e6,
+  'installed' => TRUE,
+  'ldapIgnoreNamingRules' => null,
+  'maintenance' => false,
+);
+'''
+
+class ParsePHPTest(TempDirTestCase):
+    def testConfig(self):
+        config=parsePHP(CONFIG)['CONFIG']
+        self.assertEqual(config['trusted_domains'], ['cloud.example.org', '192.168.1.10'])
+        self.assertEqual(config['datadirectory'], '/srv/owncloud/data')
+        self.assertEqual(config['dbname'], 'owncloud')
+        self.assertEqual(config['dbpassword'], 'it\'s "quoted"\t$and\\slashed')
+        self.assertEqual(config['secret'], "don't \\ \\n")
+        self.assertEqual(config['memcache.local'], '\\OC\\Memcache\\APCu')
+        self.assertEqual(config['apps_paths'], [{'path':'/srv/owncloud/apps', 'url':'/apps', 'writable':False},
+                                                {'path':'/srv/owncloud/apps2', 'url':'/apps2', 'writable':True}])
+        self.assertEqual(config['loglevel'], 2)
+        self.assertEqual(config['log_rotate_size'], 1.5e6)
+        self.assertIs(config['installed'], True)
+        self.assertIsNone(config['ldapIgnoreNamingRules'])
+        self.assertIs(config['maintenance'], False)
+
+    def testVersion(self):
+        self.assertEqual(parsePHP(versionPHP((9,0,1,2)) + "$OC_Channel = 'stable';\n"),
+                         {'OC_Version':[9,0,1,2], 'OC_VersionString':'9.0.1', 'OC_Channel':'stable'})
+
+    def testArrayKeys(self):
+        values=parsePHP("<?php $a = array(1 => 'x', 'y'); $b = array(0 => 'x', 'k' => 'y', 'z'); "
+                        "$c = array('0' => 'x', '1' => 'y'); $d = array(5 => 'x', -1 => 'y'); $e = array();")
+        self.assertEqual(values['a'], {'1':'x', '2':'y'})
+        self.assertEqual(values['b'], {'0':'x', 'k':'y', '1':'z'})
+        self.assertEqual(values['c'], ['x', 'y'])
+        self.assertEqual(values['d'], {'5':'x', '-1':'y'})
+        self.assertEqual(values['e'], [])
+
+    def testUnsupportedPHP(self):
+        for text in ('<?php $a = "\\x41";', '<?php $a = "\\101";', '<?php $a = "\\u{41}";',
+                     '<?php $a = "\\e[0m";', '<?php $a = "\\q";', '<?php $a = "$b";',
+                     '<?php $a = getenv("DB");', '<?php $a = <<<EOT\nx\nEOT;\n', '<?php $a = 1 + 1;'):
+            with self.assertRaises(ValueError, msg=text):
+                parsePHP(text)
+
+    def testFallBackToPHP(self):
+        ocDir=self.path('owncloud')
+        self.writeFile('owncloud/version.php', versionPHP((9,0,0,1)))
+        self.writeFile('owncloud/config/config.php', "<?php\n$CONFIG = array('dbpassword' => \"\\x41\\101\");\n")
+        php=writeStub(self.tmp, 'php', 'echo \'{"OC_Version":[9,0,0,1],"OC_VersionString":"9.0.0","CONFIG":{"dbpassword":"AA"}}\'\n')
+        values=readOCFiles(ocDir, php)
+        self.assertEqual(values['CONFIG'], {'dbpassword':'AA'})
+        self.assertEqual(values['OC_VersionString'], '9.0.0')
+
+    def testParsedWithoutPHP(self):
+        ocDir=self.path('owncloud')
+        self.writeFile('owncloud/version.php', versionPHP((9,0,0,1)))
+        self.writeFile('owncloud/config/config.php', CONFIG)
+        values=readOCFiles(ocDir, self.path('no-php'))
+        self.assertEqual(values['OC_Version'], [9,0,0,1])
+        self.assertEqual(values['CONFIG']['dbuser'], 'oc_admin')
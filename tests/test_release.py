@@ -0,0 +1,178 @@
+#*******************************************************************************
+#*******************************************************************************
+# 
+#                      COPYRIGHT (c) 2015, James Sinton
+#                             ALL RIGHTS RESERVED
+# 
+#  This library is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+# 
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with this library; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# 
+#   DESCRIPTION
+#      Release extraction and delta upgrades
+# 
+#********************************************************************************
+#********************************************************************************
+
+import contextlib
+import io
+import os
+import tarfile
+
+from .support import TempDirTestCase
+
+from owncloud_upgrade.release import applyDelta, extractRelease, newManifest
+
+##################################################################
+#Function Name: writeArchive
+#Parameters:    fileName, members
+#Purpose:       Write a tar.gz of members, a list of (name, data) for
+#               files, (name, None) for directories and (name, '->',
+#               target) for symbolic links
+#		@ReleaseTestCase
+##################################################################
+def writeArchive(fileName, members):
+    with tarfile.open(fileName, 'w:gz') as tar:
+        for member in members:
+            info=tarfile.TarInfo(member[0])
+            if len(member) == 3:
+                info.type=tarfile.SYMTYPE
+                info.linkname=member[2]
+                tar.addfile(info)
+            elif member[1] is None:
+                info.type=tarfile.DIRTYPE
+                info.mode=0o755
+                tar.addfile(info)
+            else:
+                info.size=len(member[1])
+                info.mode=0o644
+                info.mtime=1400000000
+                tar.addfile(info, io.BytesIO(member[1]))
+    return fileName
+
+class DeltaTest(TempDirTestCase):
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.ocDir=self.path('owncloud')
+        old=writeArchive(self.path('old.tar.gz'), [('owncloud/', None), ('owncloud/lib/', None),
+                                                   ('owncloud/index.php', b'index 1'), ('owncloud/lib/base.php', b'base 1'),
+                                                   ('owncloud/lib/same.php', b'same')])
+        self.new=writeArchive(self.path('new.tar.gz'), [('owncloud/', None), ('owncloud/lib/', None),
+                                                        ('owncloud/index.php', b'index 2'), ('owncloud/lib/base.php', b'base 1'),
+                                                        ('owncloud/lib/same.php', b'same')])
+        self.manifest=newManifest('release', 'old.tar.gz')
+        with contextlib.redirect_stdout(io.StringIO()):
+            extractRelease(old, self.ocDir, manifest=self.manifest)
+
+    def delta(self):
+        journal={'added':[], 'saved':[], 'removedDirs':[]}
+        with contextlib.redirect_stdout(io.StringIO()):
+            return applyDelta(self.new, self.ocDir, {}, self.manifest, lambda rel: False, self.path('undo'), journal)
+
+    def testUnchangedFilesAreNotTouched(self):
+        inode=os.lstat(self.path('owncloud/lib/same.php')).st_ino
+        stats, manifest=self.delta()
+        self.assertEqual(stats['unchanged'], 2)
+        self.assertEqual(stats['written'], 1)
+        self.assertEqual(self.readFile('owncloud/index.php'), b'index 2')
+        self.assertEqual(os.lstat(self.path('owncloud/lib/same.php')).st_ino, inode)
+        self.assertEqual(len(manifest['files']['lib/same.php']), 3)
+
+    def testLocalChangeOfTheSameSizeIsReplaced(self):
+        # same size, different content and mtime
+        self.writeFile('owncloud/lib/base.php', b'hack 1')
+        stats, manifest=self.delta()
+        self.assertEqual(self.readFile('owncloud/lib/base.php'), b'base 1')
+        self.assertEqual(stats['unchanged'], 1)
+
+    def testManifestWithoutMtimes(self):
+        for entry in self.manifest['files'].values():
+            del entry[2:]
+        self.writeFile('owncloud/lib/base.php', b'hack 1')
+        stats, manifest=self.delta()
+        self.assertEqual(self.readFile('owncloud/lib/base.php'), b'base 1')
+        self.assertEqual(self.readFile('owncloud/lib/same.php'), b'same')
+        self.assertEqual(stats['unchanged'], 1)
+
+class ExtractionTraversalTest(TempDirTestCase):
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        os.mkdir(self.path('outside'))
+
+    def extract(self, members, dst='owncloud'):
+        fn=writeArchive(self.path('release.tar.gz'), [('owncloud/', None)] + members)
+        with contextlib.redirect_stdout(io.StringIO()):
+            return extractRelease(fn, self.path(dst))
+
+    def delta(self, members, dst='owncloud'):
+        fn=writeArchive(self.path('release.tar.gz'), [('owncloud/', None)] + members)
+        if not os.path.isdir(self.path(dst)):
+            os.makedirs(self.path(dst))
+        journal={'added':[], 'saved':[], 'removedDirs':[]}
+        with contextlib.redirect_stdout(io.StringIO()):
+            return applyDelta(fn, self.path(dst), {}, newManifest('scan'), lambda rel: False, self.path('undo'), journal)[0]
+
+    def assertNothingEscaped(self):
+        self.assertEqual(os.listdir(self.path('outside')), [])
+        # undo holds what applyDelta replaced
+        self.assertEqual(sorted(set(os.listdir(self.tmp)) - set(['undo'])), ['outside', 'owncloud', 'release.tar.gz'])
+
+    def testAbsoluteAndParentMembers(self):
+        for apply in (self.extract, self.delta):
+            stats=apply([('/tmp/abs.php', b'x'), ('owncloud/../../outside/up.php', b'x'), ('owncloud/ok.php', b'ok')])
+            self.assertEqual(stats['rejected'], 2)
+            self.assertEqual(self.readFile('owncloud/ok.php'), b'ok')
+            self.assertNothingEscaped()
+
+    def testSymbolicLinkOutOfTheTree(self):
+        for apply in (self.extract, self.delta):
+            stats=apply([('owncloud/abs', '->', self.path('outside')), ('owncloud/up', '->', '../outside'),
+                         ('owncloud/up/x.php', b'x')])
+            self.assertEqual(stats['rejected'], 2)
+            self.assertFalse(os.path.islink(self.path('owncloud/up')))
+            self.assertNothingEscaped()
+
+    def testChainedSymbolicLinks(self):
+        # each link text stays inside once normalised, the chain does not
+        for apply in (self.extract, self.delta):
+            stats=apply([('owncloud/a/', None), ('owncloud/a/b/', None), ('owncloud/a/b/l', '->', '..'),
+                         ('owncloud/m', '->', 'a/b/l/../..'), ('owncloud/m/ESCAPED.php', b'x'),
+                         ('owncloud/m/new/x.php', b'x')])
+            self.assertGreaterEqual(stats['rejected'], 1)
+            self.assertNothingEscaped()
+
+    def testExistingSymbolicLinkOutOfTheTree(self):
+        for apply in (self.extract, self.delta):
+            os.makedirs(self.path('owncloud'))
+            os.symlink(self.path('outside'), self.path('owncloud/m'))
+            stats=apply([('owncloud/m/ESCAPED.php', b'x'), ('owncloud/m/new/', None), ('owncloud/m/new/x.php', b'x')])
+            self.assertEqual(stats['rejected'], 3)
+            self.assertNothingEscaped()
+            os.remove(self.path('owncloud/m'))
+            os.rmdir(self.path('owncloud'))
+
+    def testHardLinkThroughSymbolicLink(self):
+        with open(self.path('outside/secret'), 'w') as f:
+            f.write('secret')
+        os.makedirs(self.path('owncloud'))
+        os.symlink(self.path('outside'), self.path('owncloud/m'))
+        fn=self.path('release.tar.gz')
+        with tarfile.open(fn, 'w:gz') as tar:
+            info=tarfile.TarInfo('owncloud/copy')
+            info.type=tarfile.LNKTYPE
+            info.linkname='owncloud/m/secret'
+            tar.addfile(info)
+        with contextlib.redirect_stdout(io.StringIO()):
+            stats=extractRelease(fn, self.path('owncloud'))
+        self.assertEqual(stats['rejected'], 1)
+        self.assertFalse(os.path.exists(self.path('owncloud/copy')))
@@ -0,0 +1,101 @@
+#*******************************************************************************
+#*******************************************************************************
+# 
+#                      COPYRIGHT (c) 2015, James Sinton
+#                             ALL RIGHTS RESERVED
+# 
+#  This library is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+# 
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with this library; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# 
+#   DESCRIPTION
+#      Rollback of an upgraded instance against a stubbed mysql
+# 
+#********************************************************************************
+#********************************************************************************
+
+import contextlib
+import io
+import os
+
+from .support import StubCommandsTestCase, makeRelease
+
+from owncloud_upgrade.backup import backupOC
+from owncloud_upgrade.install import installUpgrade
+from owncloud_upgrade.php import getOCVersion, readOCFiles
+from owncloud_upgrade.release import manifestFileName
+from owncloud_upgrade.rollback import rollback
+
+class RollbackTest(StubCommandsTestCase):
+    def setUp(self):
+        StubCommandsTestCase.setUp(self)
+        self.release=makeRelease(self.path('owncloud-9.0.1.tar.gz'))
+
+    def upgrade(self):
+        configDict=self.instanceConfig(code=self.release, delta=True)
+        with contextlib.redirect_stdout(io.StringIO()):
+            configDict=getOCVersion(configDict)
+            self.assertIsNotNone(backupOC(configDict))
+            self.assertTrue(installUpgrade(configDict))
+        return configDict
+
+    def rollback(self, which='latest'):
+        configDict=self.instanceConfig()
+        with contextlib.redirect_stdout(io.StringIO()):
+            return configDict, rollback(configDict, which)
+
+    def installedVersion(self, configDict):
+        return readOCFiles(configDict['ocDir'], configDict['php'])['OC_VersionString']
+
+    def testRollback(self):
+        configDict=self.upgrade()
+        self.assertEqual(self.installedVersion(configDict), '9.0.1')
+        configDict, result=self.rollback()
+        self.assertTrue(result)
+        self.assertEqual(self.installedVersion(configDict), '9.0.0')
+        self.assertEqual(self.readFile('instance/www/owncloud/lib/base.php'), b'<?php // base (9, 0, 0, 1)\n')
+        with open(self.path('mysql.in')) as f:
+            self.assertTrue(f.read().startswith('-- dump of owncloud\n'))
+        self.assertTrue(os.path.isfile(self.path('instance/www/data/alice/files/notes.txt')))
+        commands=self.commands()
+        self.assertLess(commands.index('service apache2 stop'), commands.index('service apache2 start'))
+        self.assertEqual(commands[-1], 'php %s/occ maintenance:mode --off' % configDict['ocDir'])
+
+    def testDeltaUpgradeAfterRollback(self):
+        configDict=self.upgrade()
+        self.assertTrue(os.path.isfile(manifestFileName(configDict['stateDir'], configDict['ocDir'])))
+        self.assertTrue(self.rollback()[1])
+        self.assertFalse(os.path.exists(manifestFileName(configDict['stateDir'], configDict['ocDir'])))
+        configDict=self.upgrade()
+        self.assertEqual(self.installedVersion(configDict), '9.0.1')
+        self.assertEqual(self.readFile('instance/www/owncloud/lib/base.php'), b'<?php // base (9, 0, 1, 2)\n')
+
+    def testWritesToLiveAppsLeaveBackupAlone(self):
+        configDict=self.upgrade()
+        backupDir=configDict['backupDir']
+        configDict, result=self.rollback()
+        self.assertTrue(result)
+        live=os.path.join(configDict['ocDir'], 'apps', 'files', 'appinfo', 'info.xml')
+        self.assertEqual(os.stat(live).st_nlink, 1)
+        # an app update writing in place
+        with open(live, 'w') as f:
+            f.write('<info>updated</info>\n')
+        self.assertEqual(self.readFile(os.path.join(backupDir, 'apps', 'files', 'appinfo', 'info.xml')), b'<info/>\n')
+        # code the web server cannot write stays hard linked
+        self.assertEqual(os.stat(os.path.join(configDict['ocDir'], 'lib', 'base.php')).st_ino,
+                         os.stat(os.path.join(backupDir, 'lib', 'base.php')).st_ino)
+
+    def testNoMatchingBackup(self):
+        configDict, result=self.rollback('8.2.0')
+        self.assertFalse(result)
+        self.assertEqual(self.commands(), [])
@@ -0,0 +1,160 @@
+#*******************************************************************************
+#*******************************************************************************
+# 
+#                      COPYRIGHT (c) 2015, James Sinton
+#                             ALL RIGHTS RESERVED
+# 
+#  This library is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+# 
+#  This library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with this library; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# 
+#   DESCRIPTION
+#      Update checks against a local updater, cached and merged
+# 
+#********************************************************************************
+#********************************************************************************
+
+import contextlib
+import io
+import json
+import os
+import threading
+import time
+
+from .support import ReleaseServer, TempDirTestCase
+
+from owncloud_upgrade.config import getConfig
+from owncloud_upgrade.updates import UpdateChecker, checkUpdate
+
+UPDATE=b'<?xml version="1.0"?>\n<owncloud><version>9.1.0</version><versionstring>ownCloud 9.1.0</versionstring><url>https://download.owncloud.org/owncloud-9.1.0.tar.bz2</url><web>https://doc.owncloud.org/</web></owncloud>\n'
+
+class UpdateCheckerTest(TempDirTestCase):
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.server=ReleaseServer()
+        self.addCleanup(self.server.close)
+        self.server.files['/updater.php']=UPDATE
+        self.server.files['/current.php']=b''
+        self.server.files['/broken.php']=b'<html>Service Unavailable'
+        self.cacheDir=self.path('state', 'updates')
+
+    def checker(self, path='/updater.php', ttl=3600):
+        return UpdateChecker(self.server.url(path), self.cacheDir, ttl, retries=1)
+
+    def requests(self):
+        return [path for path, rangeHeader in self.server.requests]
+
+    def testUpdateAvailable(self):
+        update=self.checker().check((9,0,0,1))
+        self.assertEqual(update['updateVersionString'], 'ownCloud 9.1.0')
+        self.assertEqual(update['updateURL'], 'https://download.owncloud.org/owncloud-9.1.0.tar.bz2')
+        self.assertFalse(update['cached'])
+
+    def testNoUpdate(self):
+        update=self.checker('/current.php').check((9,1,0,0))
+        self.assertIsNone(update['updateURL'])
+        self.assertIsNone(update['updateVersionString'])
+
+    def testAnswersAreCachedAcrossRuns(self):
+        self.checker().check((9,0,0,1))
+        update=self.checker().check((9,0,0,1))
+        self.assertTrue(update['cached'])
+        self.assertEqual(update['updateURL'], 'https://download.owncloud.org/owncloud-9.1.0.tar.bz2')
+        self.assertEqual(self.requests(), ['/updater.php'])
+        with open(os.path.join(self.cacheDir, 'updates.json')) as f:
+            self.assertEqual(list(json.load(f)), ['9x0x0x1xxxstablexx'])
+        # another version is another question
+        self.checker().check((8,2,5,2))
+        self.assertEqual(len(self.requests()), 2)
+
+    def testExpiredAnswersAreAskedAgain(self):
+        self.checker().check((9,0,0,1))
+        cacheFile=os.path.join(self.cacheDir, 'updates.json')
+        with open(cacheFile) as f:
+            entries=json.load(f)
+        entries['9x0x0x1xxxstablexx']['time']=time.time()-7200
+        with open(cacheFile, 'w') as f:
+            json.dump(entries, f)
+        self.assertFalse(self.checker().check((9,0,0,1))['cached'])
+        self.assertEqual(len(self.requests()), 2)
+
+    def testNoCache(self):
+        checker=UpdateChecker(self.server.url('/updater.php'), None, 0, retries=1)
+        checker.check((9,0,0,1))
+        checker.check((9,0,0,1))
+        self.assertEqual(len(self.requests()), 2)
+        self.assertFalse(os.path.exists(self.cacheDir))
+
+    def testConcurrentChecksAreMerged(self):
+        self.server.delay=0.3
+        checker=self.checker()
+        results=[]
+
+        def check():
+            results.append(checker.check((9,0,0,1)))
+
+        threads=[threading.Thread(target=check) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.requests(), ['/updater.php'])
+        self.assertEqual(len(results), 8)
+        self.assertEqual(sorted(r['cached'] for r in results), [False]+[True]*7)
+        self.assertEqual(set(r['updateURL'] for r in results), set(['https://download.owncloud.org/owncloud-9.1.0.tar.bz2']))
+
+    def testCheckManyAsksOncePerVersion(self):
+        self.server.delay=0.1
+        checker=self.checker()
+        checker.checkMany([(9,0,0,1), (8,2,5,2), (9,0,0,1), (8,2,5,2), (9,0,1,3)])
+        self.assertEqual(len(self.requests()), 3)
+        checker.check((8,2,5,2))
+        self.assertEqual(len(self.requests()), 3)
+
+    def testFailureReachesEveryWaiter(self):
+        self.server.delay=0.3
+        checker=self.checker('/missing.php')
+        errors=[]
+
+        def check():
+            try:
+                checker.check((9,0,0,1))
+            except IOError as e:
+                errors.append(e)
+
+        threads=[threading.Thread(target=check) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(errors), 4)
+        self.assertEqual(self.requests(), ['/missing.php'])
+        self.assertFalse(os.path.exists(os.path.join(self.cacheDir, 'updates.json')))
+
+    def testBadAnswer(self):
+        with self.assertRaises(ValueError):
+            self.checker('/broken.php').check((9,0,0,1))
+
+    def testCheckUpdate(self):
+        configDict=getConfig()
+        configDict.update(updater=self.server.url('/updater.php'), stateDir=self.path('state'), ocVersion=(9,0,0,1))
+        with contextlib.redirect_stdout(io.StringIO()):
+            configDict=checkUpdate(configDict)
+        self.assertTrue(configDict['updateIsAvailable'])
+        self.assertEqual(configDict['updateVersionString'], 'ownCloud 9.1.0')
+        configDict.update(updater=self.server.url('/missing.php'), stateDir=self.path('state2'), updateChecker=None)
+        out=io.StringIO()
+        with contextlib.redirect_stdout(out):
+            configDict=checkUpdate(configDict)
+        self.assertFalse(configDict['updateIsAvailable'])
+        self.assertIn('Error:  could not check for an update', out.getvalue())